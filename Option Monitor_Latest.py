@@ -3,15 +3,16 @@ import ttkbootstrap as tb
 from ttkbootstrap.constants import *
 from ttkbootstrap import Style
 import tkinter as tk  # Only for tk.Listbox and tk constants
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from tkcalendar import Calendar
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import futu_options_monitor as monitor
 from ttkbootstrap.widgets import DateEntry
 import json
 import os
 from input_manager import InputManager
 import math
+import time
 import yfinance as yf
 
 # Configuration files for saving defaults
@@ -21,39 +22,15 @@ POSITION_DEFAULTS_FILE = "position_defaults.json"
 # Constants for BS Calculator
 CONTRACT_MULTIPLIER = 100
 
-# Black-Scholes functions
-def N(x):
-    """Cumulative standard normal distribution function."""
-    return (1.0 + math.erf(x / math.sqrt(2.0))) / 2.0
+# How often the GUI checks the quote stream for pushed changes (streaming mode)
+STREAM_POLL_MS = 500
 
-def black_scholes_price(S, K, T, r, sigma, option_type='call'):
-    """Calculate Black-Scholes option price."""
-    if T <= 0:
-        if option_type.lower() == 'call':
-            return max(0, S - K)
-        elif option_type.lower() == 'put':
-            return max(0, K - S)
-        else:
-            return 0.0
-    
-    if sigma <= 0:
-        if option_type.lower() == 'call':
-            return max(0, S - K)
-        elif option_type.lower() == 'put':
-            return max(0, K - S)
-        else:
-            return 0.0
-
-    d1 = (math.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * math.sqrt(T))
-    d2 = d1 - sigma * math.sqrt(T)
+# How often the GUI collects results from the background market-data worker
+FETCH_POLL_MS = 100
 
-    if option_type.lower() == 'call':
-        price = S * N(d1) - K * math.exp(-r * T) * N(d2)
-    elif option_type.lower() == 'put':
-        price = K * math.exp(-r * T) * N(-d2) - S * N(-d1)
-    else:
-        raise ValueError("Option type must be 'call' or 'put'")
-    return max(0, price)
+# Black-Scholes functions (vectorized engine shared with futu_options_monitor)
+N = monitor.N
+black_scholes_price = monitor.black_scholes_price
 
 class OptionsMonitorGUI:
     def __init__(self, root):
@@ -64,6 +41,13 @@ class OptionsMonitorGUI:
         self.positions = []
         self.spreads = []
         self.monitoring = False
+        self.quote_stream = None  # Set while streaming mode is active
+        self.stream_sync_in_flight = False  # set_codes running on the fetcher
+        self.stream_sync_pending = False    # positions changed while it ran; sync again when it finishes
+        # Blocking Futu/Yahoo calls run on this worker; results come back through poll_background_fetches
+        self.fetcher = monitor.BackgroundFetcher()
+        self.tick_in_flight = False
+        self.bs_price_quote = None  # Cache entry behind the last fetched BS stock price
         
         # Initialize input manager
         self.input_manager = InputManager()
@@ -114,6 +98,9 @@ class OptionsMonitorGUI:
         self.delta_upper_threshold_var = tk.StringVar(value="")  # New delta upper threshold
         self.delta_lower_threshold_var = tk.StringVar(value="")  # New delta lower threshold
         self.delta_remark_var = tk.StringVar(value="")  # New delta remark
+        self.streaming_var = tk.BooleanVar(value=False)  # Use OpenD quote push instead of polling
+        self.position_chain = None  # monitor.OptionChain loaded for the Add Position form
+        self.chain_quote_var = tk.StringVar(value="")
         
         # Initialize BS Calculator variables
         self.bs_legs = []
@@ -123,6 +110,49 @@ class OptionsMonitorGUI:
         self.bs_volatility_var = tk.StringVar(value="0.20")
         self.bs_risk_free_rate_var = tk.StringVar(value="0.04")
         self.bs_auto_fetch_var = tk.BooleanVar(value=True)
+        self.bs_max_quote_age_var = tk.StringVar(value="")  # Seconds; blank = accept any quote age
+        self.bs_chain = None  # monitor.OptionChain loaded for the BS calculator ticker
+        self.bs_chain_status_var = tk.StringVar(value="")
+        self.bs_surface = None  # vol_surface.VolSurface fitted from the BS ticker's chain
+        self.bs_use_surface_var = tk.BooleanVar(value=False)  # price legs off the surface instead of one flat vol
+        
+        # Scenario matrix window (opened from the BS tab) and the last monitor tick it reads live positions from
+        self.scenario_window = None
+        self.scenario_result = None
+        self.last_tick_quotes = None
+        self.scenario_days_var = tk.StringVar(value=str(monitor.SCENARIO_DAYS_FORWARD[0]))
+        self.scenario_include_bs_var = tk.BooleanVar(value=True)
+        self.scenario_include_live_var = tk.BooleanVar(value=True)
+        self.scenario_status_var = tk.StringVar(value="")
+        
+        # Monte Carlo VaR of the live positions, recomputed on a worker after each monitor tick
+        self.var_paths_var = tk.StringVar(value=str(monitor.VAR_PATHS))
+        self.var_text_var = tk.StringVar(value="VaR: waiting for the first monitor tick")
+        self.var_in_flight = False
+        # VaR runs on its own worker so a long simulation never holds up quote fetches
+        self.var_fetcher = monitor.BackgroundFetcher(max_workers=1, name="var")
+        self.var_inputs = None  # book, spots, paths and time of the last VaR run
+        
+        # Running portfolio totals, updated per leg so a tick only re-adds the legs that changed
+        self.portfolio_aggregator = monitor.PortfolioAggregator(monitor.CONTRACT_MULTIPLIER)
+        
+        # What the last refresh showed, so the next one only redoes the legs, spreads and text that changed
+        self.leg_views = {}       # position index -> {"key", "leg_number", "section", "data"}
+        self.quote_states = {}    # option code or stock ticker -> quote the leg sections were drawn from
+        self.spread_views = {}    # spread index -> (spread key, spread metrics)
+        self.status_layout = []   # section names in the status box, in order
+        self.status_chunks = {}   # section name -> [(text, tags), ...] as shown
+        self.render_chunks = None # section being built by write()
+        
+        # Alert rules (monitor.ALERT_RULES_FILE), compiled once and evaluated against every tick's metrics
+        self.alert_rules = monitor.load_rules(monitor.ALERT_RULES_FILE)
+        self.alert_rules_var = tk.StringVar(value=self.alert_rules_status())
+        self.last_var_result = None
+        
+        # P&L profile chart on the BS tab
+        self.payoff_source_var = tk.StringVar(value="BS legs")
+        self.payoff_days_var = tk.StringVar(value=", ".join(str(days) for days in monitor.PAYOFF_DAYS_FORWARD))
+        self.payoff_summary_var = tk.StringVar(value="")
         
         # Load saved defaults
         self.load_defaults()
@@ -134,6 +164,8 @@ class OptionsMonitorGUI:
         
         # Load saved inputs automatically
         self.input_manager.load_all_inputs(self)
+        
+        self.root.after(FETCH_POLL_MS, self.poll_background_fetches)
     
     def load_defaults(self):
         """Load saved default values for inputs."""
@@ -259,8 +291,10 @@ class OptionsMonitorGUI:
         # Strike price input (for options only)
         self.strike_label = ttk.Label(input_frame, text="Strike Price:")
         self.strike_label.grid(row=1, column=2, padx=5, pady=5)
-        strike_entry = ttk.Entry(input_frame, textvariable=self.strike_var)
+        # Editable; lists the listed strikes once an option chain is loaded
+        strike_entry = ttk.Combobox(input_frame, textvariable=self.strike_var)
         strike_entry.grid(row=1, column=3, padx=5, pady=5)
+        self.strike_combo = strike_entry
         
         # Option type selection (for options only)
         self.option_type_label = ttk.Label(input_frame, text="Option Type:")
@@ -273,6 +307,7 @@ class OptionsMonitorGUI:
         self.expiry_label.grid(row=2, column=2, padx=5, pady=5)
         self.expiry_entry = DateEntry(input_frame, dateformat='%Y-%m-%d')
         self.expiry_entry.grid(row=2, column=3, padx=5, pady=5)
+        self.expiry_entry.entry.bind("<FocusOut>", lambda event: self.update_chain_strikes())
         
         # Quantity input
         ttk.Label(input_frame, text="Quantity:").grid(row=3, column=0, padx=5, pady=5)
@@ -331,6 +366,12 @@ class OptionsMonitorGUI:
         # Save as default button
         ttk.Button(button_frame, text="Save as Default", command=self.save_defaults).pack(side=tk.LEFT, padx=5)
         
+        # Load the option chain for the ticker so strikes can be picked from the listed contracts
+        ttk.Button(button_frame, text="Load Chain", command=self.load_position_chain).pack(side=tk.LEFT, padx=5)
+        ttk.Label(input_frame, textvariable=self.chain_quote_var).grid(row=6, column=0, columnspan=4, padx=5, sticky='w')
+        self.option_type_var.trace('w', lambda *args: self.update_chain_strikes())
+        self.strike_var.trace('w', lambda *args: self.update_chain_quote())
+        
         # Positions list
         list_frame = ttk.LabelFrame(self.positions_frame, text="Current Positions")
         list_frame.pack(fill='both', expand=True, padx=5, pady=5)
@@ -542,6 +583,10 @@ class OptionsMonitorGUI:
         # Fetch button
         ttk.Button(market_frame, text="Fetch Market Data", command=self.fetch_bs_market_data).grid(row=3, column=0, columnspan=2, pady=5)
         
+        # Option chain: listed strikes and market quotes for added legs
+        ttk.Button(market_frame, text="Load Chain", command=self.load_bs_chain).grid(row=4, column=0, columnspan=2, pady=5)
+        ttk.Label(market_frame, textvariable=self.bs_chain_status_var).grid(row=5, column=0, columnspan=2, padx=5, sticky='w')
+        
         # Market parameters frame
         params_frame = ttk.LabelFrame(left_panel, text="Market Parameters")
         params_frame.pack(fill='x', pady=(0, 5))
@@ -561,6 +606,15 @@ class OptionsMonitorGUI:
         rate_entry = ttk.Entry(params_frame, textvariable=self.bs_risk_free_rate_var, width=15)
         rate_entry.grid(row=2, column=1, padx=5, pady=5)
         
+        # Maximum age of a fetched price before BS pricing refuses it (blank = no limit)
+        ttk.Label(params_frame, text="Max Quote Age (s):").grid(row=3, column=0, padx=5, pady=5, sticky='w')
+        max_age_entry = ttk.Entry(params_frame, textvariable=self.bs_max_quote_age_var, width=15)
+        max_age_entry.grid(row=3, column=1, padx=5, pady=5)
+        
+        # Per-strike/expiry vols from the SVI surface fitted on "Load Chain" instead of the flat volatility
+        ttk.Checkbutton(params_frame, text="Use vol surface (from chain)", variable=self.bs_use_surface_var,
+                        command=self.calculate_bs_portfolio).grid(row=4, column=0, columnspan=2, padx=5, pady=5, sticky='w')
+        
         # Option leg input frame
         leg_frame = ttk.LabelFrame(left_panel, text="Add Option Leg")
         leg_frame.pack(fill='x', pady=(0, 5))
@@ -568,8 +622,9 @@ class OptionsMonitorGUI:
         # Strike price
         ttk.Label(leg_frame, text="Strike ($):").grid(row=0, column=0, padx=5, pady=5, sticky='w')
         self.bs_strike_var = tk.StringVar()
-        strike_entry = ttk.Entry(leg_frame, textvariable=self.bs_strike_var, width=15)
+        strike_entry = ttk.Combobox(leg_frame, textvariable=self.bs_strike_var, width=13)
         strike_entry.grid(row=0, column=1, padx=5, pady=5)
+        self.bs_strike_combo = strike_entry
         
         # Days to expiration
         ttk.Label(leg_frame, text="DTE (days):").grid(row=1, column=0, padx=5, pady=5, sticky='w')
@@ -598,6 +653,7 @@ class OptionsMonitorGUI:
         
         ttk.Button(control_frame, text="Calculate All", command=self.calculate_bs_portfolio).pack(fill='x', pady=2)
         ttk.Button(control_frame, text="Clear All Legs", command=self.clear_bs_legs).pack(fill='x', pady=2)
+        ttk.Button(control_frame, text="Scenario Matrix", command=self.open_scenario_window).pack(fill='x', pady=2)
         
         # === RIGHT PANEL: RESULTS ===
         
@@ -641,6 +697,22 @@ class OptionsMonitorGUI:
         
         self.bs_portfolio_text.pack(side='left', fill='both', expand=True)
         portfolio_scrollbar.pack(side='right', fill='y')
+        
+        # P&L profile chart: expiry payoff plus T+n curves over the underlying price
+        payoff_frame = ttk.LabelFrame(right_panel, text="P&L Profile")
+        payoff_frame.pack(fill='x', pady=(5, 0))
+        payoff_controls = ttk.Frame(payoff_frame)
+        payoff_controls.pack(fill='x', padx=5, pady=2)
+        source_combo = ttk.Combobox(payoff_controls, textvariable=self.payoff_source_var, values=["BS legs", "Live positions"],
+                                    state="readonly", width=14)
+        source_combo.pack(side='left')
+        source_combo.bind("<<ComboboxSelected>>", lambda event: self.refresh_payoff_chart())
+        ttk.Label(payoff_controls, text="Days forward:").pack(side='left', padx=(10, 2))
+        ttk.Entry(payoff_controls, textvariable=self.payoff_days_var, width=10).pack(side='left')
+        ttk.Button(payoff_controls, text="Plot", command=self.refresh_payoff_chart).pack(side='left', padx=5)
+        ttk.Label(payoff_frame, textvariable=self.payoff_summary_var).pack(fill='x', padx=5)
+        self.payoff_canvas = tk.Canvas(payoff_frame, height=240, background="white")
+        self.payoff_canvas.pack(fill='x', padx=5, pady=5)
     
     def setup_monitor_tab(self):
         # Monitoring controls
@@ -656,6 +728,28 @@ class OptionsMonitorGUI:
         interval_entry = ttk.Entry(control_frame, textvariable=self.interval_var)
         interval_entry.pack(pady=5)
         
+        # Streaming mode: option quotes arrive by OpenD push; the interval then only refreshes Yahoo prices
+        ttk.Checkbutton(control_frame, text="Stream option quotes (Futu push)",
+                        variable=self.streaming_var).pack(pady=5)
+        
+        # Tail risk: Monte Carlo VaR / expected shortfall with full repricing of every leg
+        var_frame = ttk.LabelFrame(control_frame, text="Portfolio VaR (Monte Carlo)")
+        var_frame.pack(fill='x', padx=5, pady=5)
+        var_paths_frame = ttk.Frame(var_frame)
+        var_paths_frame.pack(fill='x', padx=5, pady=2)
+        ttk.Label(var_paths_frame, text="Paths:").pack(side=tk.LEFT)
+        ttk.Entry(var_paths_frame, textvariable=self.var_paths_var, width=10).pack(side=tk.LEFT, padx=2)
+        ttk.Label(var_frame, textvariable=self.var_text_var, font=('Courier', 10)).pack(fill='x', padx=5, pady=2)
+        
+        # Expression rules over portfolio / spread / leg metrics, read from the rules file
+        rules_frame = ttk.LabelFrame(control_frame, text="Alert Rules")
+        rules_frame.pack(fill='x', padx=5, pady=5)
+        ttk.Label(rules_frame, textvariable=self.alert_rules_var, wraplength=320, justify=tk.LEFT).pack(fill='x', padx=5, pady=2)
+        rules_buttons = ttk.Frame(rules_frame)
+        rules_buttons.pack(padx=5, pady=2)
+        ttk.Button(rules_buttons, text="Reload Rules", command=self.reload_alert_rules).pack(side=tk.LEFT, padx=2)
+        ttk.Button(rules_buttons, text="Re-arm Alerts", command=self.rearm_alerts).pack(side=tk.LEFT, padx=2)
+        
         # Alert threshold settings frame
         thresholds_frame = ttk.LabelFrame(control_frame, text="Portfolio Alert Thresholds")
         thresholds_frame.pack(fill='x', padx=5, pady=5)
@@ -768,10 +862,14 @@ class OptionsMonitorGUI:
                 if strike <= 0:
                     raise ValueError("Strike price must be positive")
                 
-                # Create option code
-                expiry_yymmdd = expiry_date.strftime("%y%m%d")
-                strike_formatted = str(int(strike * 1000))
-                option_code = f"{market}.{ticker}{expiry_yymmdd}{option_type}{strike_formatted}"
+                # Use the listed contract's code when the chain is loaded, else build it
+                contract = self.position_chain_contract(expiry_date.date(), strike, option_type)
+                if contract is not None:
+                    option_code = contract["option_code"]
+                else:
+                    expiry_yymmdd = expiry_date.strftime("%y%m%d")
+                    strike_formatted = str(int(strike * 1000))
+                    option_code = f"{market}.{ticker}{expiry_yymmdd}{option_type}{strike_formatted}"
                 
                 # Create position object
                 position = {
@@ -847,6 +945,7 @@ class OptionsMonitorGUI:
             
             # Update legs listbox in spreads tab
             self.update_legs_listbox()
+            self.sync_stream_subscriptions()
             
             # Clear inputs
             self.ticker_var.set("")
@@ -914,8 +1013,10 @@ class OptionsMonitorGUI:
                 self.short_rate_var.set("0.0")
         
         # Remove the position so it can be re-added with new values
+        old_count = len(self.positions)
         self.positions = [p for p in self.positions if p["leg_number"] != leg_number]
         self.positions_tree.delete(item)
+        self.forget_alert_states(legs=range(leg_number, old_count + 1))
         
         # Renumber remaining positions
         for i, pos in enumerate(self.positions, 1):
@@ -926,6 +1027,7 @@ class OptionsMonitorGUI:
         
         # Update legs listbox in spreads tab
         self.update_legs_listbox()
+        self.sync_stream_subscriptions()
         
         messagebox.showinfo("Edit Mode", "Position loaded for editing. Modify values and click 'Add Position' to save changes.")
     
@@ -1000,22 +1102,26 @@ class OptionsMonitorGUI:
             return
         
         if messagebox.askyesno("Confirm", "Are you sure you want to remove the selected position?"):
-            for item in selected:
-                values = self.positions_tree.item(item)["values"]
-                leg_number = values[0]
-                
-                # Remove from positions list
-                self.positions = [p for p in self.positions if p["leg_number"] != leg_number]
-                
-                # Renumber remaining positions
-                for i, pos in enumerate(self.positions, 1):
-                    pos["leg_number"] = i
-                
-                # Remove from treeview
-                self.positions_tree.delete(item)
+            old_count = len(self.positions)
+            # Collect every selected leg before renumbering, or later rows would name the wrong legs
+            leg_numbers = {self.positions_tree.item(item)["values"][0] for item in selected}
+            
+            # Remove from positions list
+            self.positions = [p for p in self.positions if p["leg_number"] not in leg_numbers]
+            
+            # Renumber remaining positions
+            for i, pos in enumerate(self.positions, 1):
+                pos["leg_number"] = i
+            
+            # Show the new leg numbers
+            self.refresh_positions_tree()
+            
+            # Legs from the first removed one on are renumbered: their rule alerts belong to other positions now
+            self.forget_alert_states(legs=range(min(leg_numbers), old_count + 1), portfolio=not self.positions)
             
             # Update legs listbox in spreads tab
             self.update_legs_listbox()
+            self.sync_stream_subscriptions()
     
     def update_legs_listbox(self):
         self.legs_listbox.delete(0, tk.END)
@@ -1039,6 +1145,8 @@ class OptionsMonitorGUI:
         try:
             # Calculate current spread price
             spread_price = 0
+            quotes = monitor.TickQuoteStore()
+            quotes.prefetch_options([self.positions[idx].get("option_code") for idx in selected_indices])
             for idx in selected_indices:
                 pos = self.positions[idx]
                 position_type = pos.get("position_type", "OPTION")
@@ -1047,9 +1155,9 @@ class OptionsMonitorGUI:
                     option_code = pos.get("option_code")
                     if not option_code:
                         continue
-                    ret_option, data_option_df = monitor.quote_ctx.get_market_snapshot([option_code])
-                    if ret_option == monitor.RET_OK and not data_option_df.empty:
-                        current_price = data_option_df.iloc[0].get('last_price', 0.0)
+                    option_quote = quotes.get_option_quote(option_code)
+                    if option_quote is not None:
+                        current_price = option_quote['last_price']
                         quantity = pos["quantity"]
                         spread_price += current_price * (1 if quantity > 0 else -1)
                 else:  # STOCK position
@@ -1057,9 +1165,7 @@ class OptionsMonitorGUI:
                     if not ticker:
                         continue
                     try:
-                        ticker_symbol = ticker.split('.')[-1]
-                        stock = yf.Ticker(ticker_symbol)
-                        current_price = stock.info.get('regularMarketPrice', 0.0)
+                        current_price = quotes.get_stock_price(ticker)
                         if current_price > 0:
                             quantity = pos["quantity"]
                             spread_price += current_price * (1 if quantity > 0 else -1)
@@ -1091,6 +1197,8 @@ class OptionsMonitorGUI:
         try:
             # Calculate current spread delta
             spread_delta = 0
+            quotes = monitor.TickQuoteStore()
+            quotes.prefetch_options([self.positions[idx].get("option_code") for idx in selected_indices])
             for idx in selected_indices:
                 pos = self.positions[idx]
                 position_type = pos.get("position_type", "OPTION")
@@ -1099,9 +1207,9 @@ class OptionsMonitorGUI:
                     option_code = pos.get("option_code")
                     if not option_code:
                         continue
-                    ret_option, data_option_df = monitor.quote_ctx.get_market_snapshot([option_code])
-                    if ret_option == monitor.RET_OK and not data_option_df.empty:
-                        delta = data_option_df.iloc[0].get('option_delta', 0.0)
+                    option_quote = quotes.get_option_quote(option_code)
+                    if option_quote is not None:
+                        delta = option_quote['delta']
                         quantity = pos["quantity"]
                         spread_delta += delta * quantity
                 else:  # STOCK position
@@ -1269,6 +1377,7 @@ class OptionsMonitorGUI:
                 
                 # Remove from treeview
                 self.spreads_tree.delete(item)
+                self.forget_alert_states(spread=spread_name)
             
             # Save updated spreads configuration
             monitor.save_spreads_config(self.spreads)
@@ -1298,239 +1407,22 @@ class OptionsMonitorGUI:
     def start_monitoring(self):
         # Start the monitoring loop
         self.monitoring = True
+        if self.streaming_var.get():
+            self.start_quote_stream()
         self.root.after(1000, self.monitor_loop)
     
     def stop_monitoring(self):
         self.monitoring = False
+        self.stop_quote_stream()
     
     def monitor_loop(self):
         if not self.monitoring:
             return
         
         try:
-            # Update status text
-            self.status_text.delete(1.0, tk.END)
-            self.status_text.insert("end", f"Last update: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-            
-            # Get position data
-            all_positions_data = []
-            underlying_prices_cache = {}
-            
-            self.status_text.insert("end", "--- Individual Positions ---\n")
-            for position in self.positions:
-                print(f"DEBUG: Processing position: {position}")
-                try:
-                    # Determine position type (for backward compatibility)
-                    position_type = position.get("position_type", "OPTION")  # Default to OPTION for existing positions
-                    
-                    if position_type == "OPTION":
-                        option_code = position.get("option_code")
-                        if not option_code:  # Handle legacy positions
-                            user_inputs = position.get("user_inputs", {})
-                            market = user_inputs.get("market", "US")
-                            ticker = user_inputs.get("ticker", "")
-                            strike = user_inputs.get("strike", 0)
-                            option_type = user_inputs.get("type", "C")
-                            expiry = user_inputs.get("expiry", "")
-                            
-                            if all([market, ticker, strike, option_type, expiry]):
-                                expiry_date = datetime.strptime(expiry, "%Y-%m-%d")
-                                expiry_yymmdd = expiry_date.strftime("%y%m%d")
-                                strike_formatted = str(int(strike * 1000))
-                                option_code = f"{market}.{ticker}{expiry_yymmdd}{option_type}{strike_formatted}"
-                                position["option_code"] = option_code  # Update the position with the option code
-                        
-                        if option_code:
-                            self.status_text.insert("end", f"\nLeg {position['leg_number']}: {option_code}\n")
-                            
-                            greeks_data = monitor.get_real_option_data(option_code, underlying_prices_cache)
-                            if greeks_data:
-                                all_positions_data.append({
-                                    "greeks_data": greeks_data,
-                                    "quantity": position["quantity"],
-                                    "entry_cost": position["entry_cost"]
-                                })
-                                
-                                # Display position details
-                                current_price = greeks_data['current_option_price']
-                                theoretical_price = greeks_data['theoretical_price_bs']
-                                quantity = position["quantity"]
-                                entry_cost = position["entry_cost"]
-                                
-                                # Calculate P&L
-                                if quantity > 0:  # Long position
-                                    pnl = (current_price - entry_cost) * quantity * monitor.CONTRACT_MULTIPLIER
-                                else:  # Short position
-                                    pnl = (entry_cost - current_price) * abs(quantity) * monitor.CONTRACT_MULTIPLIER
-                                
-                                # Display market data
-                                self.status_text.insert("end", f"Market Price: ${current_price:.3f}  |  BS Price: ${theoretical_price:.3f}\n")
-                                self.status_text.insert("end", f"Position: {'Long' if quantity > 0 else 'Short'} {abs(quantity)}x @ ${entry_cost:.3f}\n")
-                                self.status_text.insert("end", f"P&L: ${pnl:,.2f}\n")
-                                
-                                # Display Greeks
-                                self.status_text.insert("end", f"Delta: {greeks_data['delta']:.4f}  |  Gamma: {greeks_data['gamma']:.4f}\n")
-                                self.status_text.insert("end", f"Vega: {greeks_data['vega']:.4f}  |  Theta: {greeks_data['theta']:.4f}  |  Rho: {greeks_data['rho']:.4f}\n")
-                                
-                                if greeks_data['underlying_price'] > 0:
-                                    self.status_text.insert("end", f"Underlying Price: ${greeks_data['underlying_price']:.2f}\n")
-                                
-                                self.status_text.insert("end", f"IV: {greeks_data['volatility']:.2%}  |  Days to Expiry: {greeks_data['days_to_expiry']}\n")
-                            else:
-                                self.status_text.insert("end", "Failed to get market data\n")
-                        else:
-                            self.status_text.insert("end", f"\nLeg {position['leg_number']}: Invalid option data\n")
-                    else:  # STOCK position
-                        ticker = position.get("ticker")
-                        if not ticker:  # Handle legacy positions
-                            user_inputs = position.get("user_inputs", {})
-                            market = user_inputs.get("market", "US")
-                            ticker_name = user_inputs.get("ticker", "")
-                            if market and ticker_name:
-                                ticker = f"{market}.{ticker_name}"
-                                position["ticker"] = ticker  # Update the position with the ticker
-                        
-                        if ticker:
-                            self.status_text.insert("end", f"\nLeg {position['leg_number']}: {ticker} (Stock)\n")
-                            
-                            try:
-                                # Get stock data from yfinance
-                                ticker_symbol = ticker.split('.')[-1]  # Get the ticker symbol without market prefix
-                                stock = yf.Ticker(ticker_symbol)
-                                current_price = stock.info.get('regularMarketPrice', 0.0)
-                                
-                                if current_price > 0:
-                                    quantity = position["quantity"]
-                                    entry_cost = position["entry_cost"]
-                                    
-                                    # Calculate P&L
-                                    if quantity > 0:  # Long position
-                                        pnl = (current_price - entry_cost) * quantity
-                                    else:  # Short position
-                                        pnl = (entry_cost - current_price) * abs(quantity)
-                                        
-                                        # Add short interest cost if applicable
-                                        short_rate = position.get("user_inputs", {}).get("short_rate", 0.0)
-                                        if short_rate > 0:
-                                            days_held = (datetime.now() - datetime.strptime(position.get("entry_date", datetime.now().strftime("%Y-%m-%d")), "%Y-%m-%d")).days
-                                            short_interest_cost = abs(quantity) * entry_cost * (short_rate / 100) * (days_held / 365)
-                                            pnl -= short_interest_cost
-                                            self.status_text.insert("end", f"Short Interest Cost: ${short_interest_cost:,.2f}\n")
-                                    
-                                    # Add to positions data for portfolio summary
-                                    all_positions_data.append({
-                                        "greeks_data": {
-                                            'current_option_price': current_price,
-                                            'delta': 1.0 if quantity > 0 else -1.0,  # Stock delta is 1.0 for long, -1.0 for short
-                                            'gamma': 0.0,  # Stock has no gamma
-                                            'vega': 0.0,   # Stock has no vega
-                                            'theta': 0.0,  # Stock has no theta
-                                            'rho': 0.0     # Stock has no rho
-                                        },
-                                        "quantity": quantity,
-                                        "entry_cost": entry_cost
-                                    })
-                                    
-                                    # Display position details
-                                    self.status_text.insert("end", f"Market Price: ${current_price:.2f}\n")
-                                    self.status_text.insert("end", f"Position: {'Long' if quantity > 0 else 'Short'} {abs(quantity)} shares @ ${entry_cost:.2f}\n")
-                                    self.status_text.insert("end", f"P&L: ${pnl:,.2f}\n")
-                                    
-                                    # Display stock-specific info
-                                    if quantity < 0:  # Short position
-                                        short_rate = position.get("user_inputs", {}).get("short_rate", 0.0)
-                                        if short_rate > 0:
-                                            self.status_text.insert("end", f"Short Interest Rate: {short_rate:.2f}%\n")
-                                else:
-                                    self.status_text.insert("end", "Failed to get market data from yfinance\n")
-                            except Exception as e:
-                                self.status_text.insert("end", f"Error getting stock data: {str(e)}\n")
-                        else:
-                            self.status_text.insert("end", f"\nLeg {position['leg_number']}: Invalid stock data\n")
-                except Exception as e:
-                    self.status_text.insert("end", f"Error processing position {position.get('leg_number', 'unknown')}: {str(e)}\n")
-                    continue
-            
-            # Calculate and display portfolio summary
-            if all_positions_data:
-                print(f"DEBUG: all_positions_data = {all_positions_data}")
-                combined_summary = monitor.calculate_and_display_combined_summary(all_positions_data)
-                
-                self.status_text.insert("end", "\n--- Portfolio Summary ---\n")
-                self.status_text.insert("end", f"Total P&L: ${combined_summary['portfolio_pnl']:,.2f}\n")
-                self.status_text.insert("end", f"Total Market Value: ${combined_summary['portfolio_market_value']:,.2f}\n")
-                self.status_text.insert("end", f"Total BS Value: ${combined_summary['portfolio_bs_value']:,.2f}\n")
-                
-                self.status_text.insert("end", "\nNet Greeks (Total):\n")
-                self.status_text.insert("end", f"Delta: {combined_summary['total_net_delta']:,.2f}\n")
-                self.status_text.insert("end", f"Gamma: {combined_summary['total_net_gamma']:,.2f}\n")
-                self.status_text.insert("end", f"Vega: {combined_summary['net_vega_per_share_equiv'] * monitor.CONTRACT_MULTIPLIER:,.2f}\n")
-                self.status_text.insert("end", f"Theta: {combined_summary['net_theta_per_share_equiv'] * monitor.CONTRACT_MULTIPLIER:,.2f}\n")
-                self.status_text.insert("end", f"Rho: {combined_summary['net_rho_per_share_equiv'] * monitor.CONTRACT_MULTIPLIER:,.2f}\n")
-                
-                # Check portfolio-level thresholds
-                self.check_portfolio_thresholds(combined_summary, all_positions_data)
-            
-            # Monitor spreads
-            if self.spreads:
-                self.status_text.insert("end", "\n--- Spread Monitoring ---\n")
-                for spread in self.spreads:
-                    spread_metrics = self.calculate_spread_metrics(spread, self.positions)
-                    if spread_metrics:
-                        self.status_text.insert("end", f"\n{spread_metrics['name']}:\n")
-                        price_label = "Debit" if spread_metrics['price'] > 0 else "Credit"
-                        self.status_text.insert("end", f"Price: ${abs(spread_metrics['price']):.2f} {price_label} per spread\n")
-                        self.status_text.insert("end", f"Delta: {spread_metrics['delta']:.3f}\n")
-                        
-                        # Check price targets
-                        current_price = spread_metrics['price']
-                        upper_target = spread.get('target_price_upper')
-                        lower_target = spread.get('target_price_lower')
-                        
-                        if upper_target is not None and abs(current_price) >= upper_target:
-                            price_label = "Debit" if current_price > 0 else "Credit"
-                            alert_msg = f"Price ${abs(current_price):.2f} {price_label} per spread reached or exceeded upper target ${upper_target:.2f}"
-                            if spread_metrics.get('remark'):
-                                alert_msg += f"\nRemark: {spread_metrics['remark']}"
-                            self.status_text.insert("end", f"ALERT: {alert_msg}\n", "alert")
-                            monitor.send_notification(f"Spread Alert - {spread_metrics['name']}", alert_msg)
-                        
-                        if lower_target is not None and abs(current_price) <= lower_target:
-                            price_label = "Debit" if current_price > 0 else "Credit"
-                            alert_msg = f"Price ${abs(current_price):.2f} {price_label} per spread reached or fell below lower target ${lower_target:.2f}"
-                            if spread_metrics.get('remark'):
-                                alert_msg += f"\nRemark: {spread_metrics['remark']}"
-                            self.status_text.insert("end", f"ALERT: {alert_msg}\n", "alert")
-                            monitor.send_notification(f"Spread Alert - {spread_metrics['name']}", alert_msg)
-                        
-                        # Check delta targets
-                        current_delta = spread_metrics['delta']
-                        upper_delta = spread.get('target_delta_upper')
-                        lower_delta = spread.get('target_delta_lower')
-                        
-                        if upper_delta is not None and current_delta >= upper_delta:
-                            alert_msg = f"Delta {current_delta:.3f} reached or exceeded upper target {upper_delta:.3f}"
-                            if spread_metrics.get('remark'):
-                                alert_msg += f"\nRemark: {spread_metrics['remark']}"
-                            self.status_text.insert("end", f"ALERT: {alert_msg}\n", "alert")
-                            monitor.send_notification(f"Spread Alert - {spread_metrics['name']}", alert_msg)
-                        
-                        if lower_delta is not None and current_delta <= lower_delta:
-                            alert_msg = f"Delta {current_delta:.3f} reached or fell below lower target {lower_delta:.3f}"
-                            if spread_metrics.get('remark'):
-                                alert_msg += f"\nRemark: {spread_metrics['remark']}"
-                            self.status_text.insert("end", f"ALERT: {alert_msg}\n", "alert")
-                            monitor.send_notification(f"Spread Alert - {spread_metrics['name']}", alert_msg)
-                        
-                        # Update previous values
-                        if 'spreads' not in self.previous_values:
-                            self.previous_values['spreads'] = {}
-                        self.previous_values['spreads'][spread['name']] = {
-                            'delta': current_delta
-                        }
-            
-            # Scroll to bottom
-            self.status_text.see("end")
+            # Fetch this tick's quotes in the background; the display refreshes when they arrive
+            if not self.request_monitor_tick():
+                self.status_text.insert("end", "Previous update still running; skipping this tick.\n")
             
             # Schedule next update
             interval_ms = int(self.interval_var.get()) * 60 * 1000
@@ -1542,6 +1434,670 @@ class OptionsMonitorGUI:
             self.monitor_button["text"] = "Start Monitoring"
             messagebox.showerror("Error", f"Monitoring stopped due to error: {str(e)}")
 
+    def poll_background_fetches(self):
+        """Hand finished background fetches to their callbacks on the Tk thread."""
+        self.fetcher.drain()
+        self.var_fetcher.drain()
+        self.root.after(FETCH_POLL_MS, self.poll_background_fetches)
+
+    def tick_instruments(self):
+        """Return (option codes, stock tickers) the current positions need quotes for."""
+        option_codes = []
+        stock_tickers = []
+        for position in self.positions:
+            if position.get("position_type", "OPTION") == "OPTION":
+                try:
+                    option_codes.append(self.get_position_option_code(position))
+                except ValueError as e:
+                    print(f"Invalid option data for leg {position.get('leg_number', 'unknown')}: {e}")
+            elif position.get("ticker"):
+                stock_tickers.append(position["ticker"])
+        return [code for code in option_codes if code], stock_tickers
+
+    def request_monitor_tick(self):
+        """Start loading one tick's quotes on the worker. Returns False if a tick is still running."""
+        if self.tick_in_flight:
+            return False
+        option_codes, stock_tickers = self.tick_instruments()
+        # One quote store per tick: legs, summary, spreads and thresholds share its fetches
+        option_quotes = self.quote_stream.get_quotes() if self.quote_stream is not None else None
+        self.tick_in_flight = True
+        self.fetcher.submit(monitor.load_tick_quotes, self.on_tick_quotes, self.on_tick_error,
+                            option_codes, stock_tickers, option_quotes)
+        return True
+
+    def on_tick_quotes(self, quotes):
+        """Worker finished loading a tick: redraw the monitor from its quote store."""
+        self.tick_in_flight = False
+        if not self.monitoring:
+            return
+        try:
+            self.refresh_monitor_display(quotes)
+        except Exception as e:
+            self.on_tick_error(e)
+
+    def on_tick_error(self, error):
+        self.tick_in_flight = False
+        if not self.monitoring:
+            return
+        self.status_text.insert("end", f"Error in monitoring loop: {str(error)}\n")
+        self.stop_monitoring()
+        self.monitor_button["text"] = "Start Monitoring"
+        messagebox.showerror("Error", f"Monitoring stopped due to error: {str(error)}")
+
+    def var_is_stale(self, book, spots, paths):
+        """True if the last VaR run no longer describes the book: it changed, spots moved or the interval passed."""
+        last = self.var_inputs
+        if last is None or last["book"] != book or last["paths"] != paths:
+            return True
+        if time.monotonic() - last["at"] >= monitor.VAR_INTERVAL_SECONDS:
+            return True
+        return any(not last["spots"].get(underlying) or abs(spot / last["spots"][underlying] - 1) > monitor.VAR_SPOT_MOVE
+                   for underlying, spot in spots.items())
+    
+    def request_portfolio_var(self):
+        """
+        Start a VaR run for the live positions on the VaR worker (process pool), unless one is
+        still running or the last run is still current (see var_is_stale).
+        """
+        if self.var_in_flight:
+            return
+        legs = self.live_position_legs()
+        if not legs:
+            self.var_inputs = None
+            self.var_text_var.set("VaR: no priced positions")
+            return
+        try:
+            paths = max(1000, int(self.var_paths_var.get()))
+        except ValueError:
+            paths = monitor.VAR_PATHS
+        book = sorted((str(leg["underlying"]), leg["option_type"], leg["K"], leg["T"] > 0, leg["quantity"]) for leg in legs)
+        spots = {leg["underlying"]: leg["S"] for leg in legs}
+        if not self.var_is_stale(book, spots, paths):
+            return
+        self.var_inputs = {"book": book, "spots": spots, "paths": paths, "at": time.monotonic()}
+        self.var_in_flight = True
+        
+        def on_done(result):
+            self.var_in_flight = False
+            self.last_var_result = result
+            horizon = f"{monitor.VAR_HORIZON_DAYS:g}-day"
+            self.var_text_var.set(
+                f"{horizon} VaR 95%: ${result['var'][0.95]:,.0f}  ES: ${result['es'][0.95]:,.0f}\n"
+                f"{horizon} VaR 99%: ${result['var'][0.99]:,.0f}  ES: ${result['es'][0.99]:,.0f}\n"
+                f"{result['paths']:,} paths, {len(legs)} legs, {result['workers']} process(es), {result['seconds']:.1f}s "
+                f"at {datetime.now().strftime('%H:%M:%S')}")
+        
+        def on_failed(error):
+            self.var_in_flight = False
+            self.var_inputs = None  # retry on the next tick
+            self.var_text_var.set(f"VaR failed: {error}")
+        
+        self.var_fetcher.submit(monitor.run_portfolio_var, on_done, on_failed, legs, paths)
+    
+    def refresh_monitor_display(self, quotes, full_tick=True):
+        """
+        Recompute legs, portfolio summary and spreads from `quotes` and update the status box.
+        `quotes` comes from monitor.load_tick_quotes, so this runs on the Tk thread without network calls.
+        Only legs whose quote or position changed are re-formatted and re-added to the totals,
+        only spreads holding one of them are recomputed, and only changed sections are redrawn.
+        Pushed quotes (full_tick=False) leave the scenario grid and VaR to the next full tick.
+        """
+        self.last_tick_quotes = quotes
+        if full_tick:
+            self.refresh_scenario_window()
+            self.request_portfolio_var()
+        
+        sections = [self.build_section("header", self.render_status_header)]
+        leg_sections, all_positions_data, changed_legs = self.refresh_legs(quotes)
+        sections.extend(leg_sections)
+        
+        # Portfolio totals are kept current leg by leg in refresh_legs
+        combined_summary = None
+        if all_positions_data:
+            combined_summary = self.portfolio_aggregator.summary()
+            sections.append(self.build_section("summary", self.render_portfolio_summary, combined_summary, all_positions_data))
+        
+        # Monitor spreads
+        previous_spreads = dict(self.previous_values.get('spreads', {}))
+        spread_sections, tick_spread_metrics = self.refresh_spreads(quotes, changed_legs)
+        sections.extend(spread_sections)
+        
+        if all_positions_data:
+            sections.append(self.build_section("rules", self.check_alert_rules, combined_summary, tick_spread_metrics,
+                                               all_positions_data, previous_spreads))
+        self.update_status_sections(sections)
+
+    # --- Status box sections ---
+    def write(self, text, *tags):
+        """Add text to the status-box section being built, or to the end of the box outside a refresh."""
+        if self.render_chunks is None:
+            self.status_text.insert("end", text, tags)
+        else:
+            self.render_chunks.append((text, tags))
+
+    def build_section(self, name, render, *args):
+        """Run render(*args) with write() collecting its text. Returns (name, [(text, tags), ...])."""
+        self.render_chunks = []
+        try:
+            render(*args)
+            return name, self.render_chunks
+        finally:
+            self.render_chunks = None
+
+    def update_status_sections(self, sections):
+        """
+        Show (name, chunks) sections in order in the status box. Sections whose text is unchanged
+        since the last refresh are left alone; a different set or order of sections redraws the box.
+        """
+        text = self.status_text
+        sections = [(name, chunks) for name, chunks in sections if chunks]
+        layout = [name for name, _ in sections]
+        if layout and layout == self.status_layout and text.tag_ranges(f"section:{layout[-1]}"):
+            for name, chunks in sections:
+                if chunks != self.status_chunks.get(name):
+                    start, end = text.tag_ranges(f"section:{name}")[:2]
+                    text.delete(start, end)
+                    self.insert_section(start, name, chunks)
+            # Messages written below the sections since the last refresh go, as with a full redraw
+            text.delete(text.tag_ranges(f"section:{layout[-1]}")[-1], tk.END)
+        else:
+            text.delete(1.0, tk.END)
+            for name, chunks in sections:
+                self.insert_section("end", name, chunks)
+            text.see("end")
+        self.status_layout = layout
+        self.status_chunks = dict(sections)
+
+    def insert_section(self, index, name, chunks):
+        """Insert a section's chunks at index in one call, all tagged with the section's tag."""
+        args = []
+        for chunk_text, tags in chunks:
+            args.extend((chunk_text, (f"section:{name}",) + tuple(tags)))
+        self.status_text.insert(index, *args)
+
+    def render_status_header(self):
+        self.write(f"Last update: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        opend_status = monitor.opend.status()
+        quota = monitor.snapshot_scheduler.status()
+        self.write(f"Market data: {monitor.market_data_provider.name}\n")
+        rejected = f", {quota['rejected_codes']} rejected codes skipped" if quota['rejected_codes'] else ""
+        self.write(f"FutuOpenD: {opend_status['state']} (reconnects: {opend_status['reconnect_count']}) | "
+                   f"Snapshot quota: {quota['tokens']}/{quota['capacity']}, last wait {quota['last_wait']:.1f}s{rejected}\n")
+        cache_stats = monitor.greeks_cache.stats()
+        self.write(f"Greeks cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                   f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} entries\n\n")
+        self.write("--- Individual Positions ---\n")
+
+    # --- Legs ---
+    def leg_quote(self, position, quotes):
+        """
+        Look a position up in the tick's quote store without formatting anything. Returns
+        (label, greeks data or None if unpriced, underlying/stock quote entry or None);
+        label is None for positions without a valid option code or ticker.
+        """
+        if position.get("position_type", "OPTION") == "OPTION":
+            option_code = self.get_position_option_code(position)
+            if not option_code:
+                return None, None, None
+            greeks_data = quotes.get_option_greeks_data(option_code)
+            underlying_quote = None
+            if greeks_data and greeks_data['underlying_price'] > 0:
+                underlying_quote = quotes.get_underlying_quote(quotes.option_quotes[option_code]['stock_owner'])
+            return option_code, greeks_data, underlying_quote
+        
+        ticker = position.get("ticker")
+        if not ticker:  # Handle legacy positions
+            user_inputs = position.get("user_inputs", {})
+            market = user_inputs.get("market", "US")
+            ticker_name = user_inputs.get("ticker", "")
+            if market and ticker_name:
+                ticker = f"{market}.{ticker_name}"
+                position["ticker"] = ticker  # Update the position with the ticker
+        if not ticker:
+            return None, None, None
+        # Stock prices come from the tick's quote store (Yahoo Finance)
+        stock_quote = quotes.get_underlying_quote(ticker)
+        current_price = stock_quote["price"] if stock_quote else 0.0
+        if current_price <= 0:
+            return ticker, None, stock_quote
+        quantity = position["quantity"]
+        return ticker, {
+            'ticker': ticker,
+            'current_option_price': current_price,
+            'delta': 1.0 if quantity > 0 else -1.0,  # Stock delta is 1.0 for long, -1.0 for short
+            'gamma': 0.0,  # Stock has no gamma
+            'vega': 0.0,   # Stock has no vega
+            'theta': 0.0,  # Stock has no theta
+            'rho': 0.0     # Stock has no rho
+        }, stock_quote
+
+    def refresh_legs(self, quotes):
+        """
+        Leg sections and portfolio-summary inputs for this tick. A leg is re-formatted only if its
+        quote or its position changed since the last refresh; option codes whose quote changed
+        are re-priced in the portfolio totals through update_codes.
+        Returns (sections, positions data, leg numbers that changed).
+        """
+        aggregator = self.portfolio_aggregator
+        views, quote_states = {}, {}
+        changed_codes, changed_legs = set(), set()
+        sections, all_positions_data = [], []
+        for index, position in enumerate(self.positions):
+            is_option = position.get("position_type", "OPTION") == "OPTION"
+            try:
+                label, greeks_data, quote_entry = self.leg_quote(position, quotes)
+                key = (position['leg_number'], label, position['quantity'], position['entry_cost'],
+                       position.get('user_inputs', {}).get('short_rate'), position.get('entry_date'), date.today())
+            except Exception as e:
+                label, greeks_data, quote_entry = None, None, None
+                key = ("error", position.get('leg_number'), str(e))
+            
+            if label and label not in quote_states:
+                # Stock legs on one ticker can differ in delta sign; their quote is the price
+                quote = greeks_data if is_option or not greeks_data else greeks_data['current_option_price']
+                quote_states[label] = (quote, quote_entry["timestamp"] if quote_entry else None)
+                if self.quote_states.get(label) != quote_states[label]:
+                    changed_codes.add(label)
+            
+            view = self.leg_views.get(index)
+            key_changed = view is None or view["key"] != key
+            if key_changed or label in changed_codes or key[0] == "error":
+                if key[0] == "error":
+                    section = (f"leg:{index}", [(f"Error processing position {key[1] or 'unknown'}: {key[2]}\n", ())])
+                else:
+                    section = self.build_section(f"leg:{index}", self.render_leg, position, label, greeks_data, quote_entry)
+                data = None
+                if greeks_data:
+                    data = {
+                        "leg_number": position["leg_number"],
+                        "greeks_data": greeks_data,
+                        "quantity": position["quantity"],
+                        "entry_cost": position["entry_cost"]
+                    }
+                    # Option legs already in the totals are re-priced by update_codes below
+                    if not is_option or key_changed or data["leg_number"] not in aggregator.legs:
+                        aggregator.update_leg(data["leg_number"], greeks_data, data["quantity"], data["entry_cost"])
+                view = {"key": key, "leg_number": position.get('leg_number'), "section": section, "data": data}
+                changed_legs.add(view["leg_number"])
+            views[index] = view
+            sections.append(view["section"])
+            if view["data"] is not None:
+                all_positions_data.append(view["data"])
+        
+        changed_legs.update(view["leg_number"] for index, view in self.leg_views.items() if index not in views)
+        self.leg_views, self.quote_states = views, quote_states
+        aggregator.update_codes([code for code in changed_codes if code in quotes.option_quotes], quotes.get_option_greeks_data)
+        aggregator.retain(item["leg_number"] for item in all_positions_data)
+        return sections, all_positions_data, changed_legs
+
+    def render_leg(self, position, label, greeks_data, quote_entry):
+        """Status-box text for one leg."""
+        if position.get("position_type", "OPTION") == "OPTION":
+            if not label:
+                self.write(f"\nLeg {position['leg_number']}: Invalid option data\n")
+                return
+            self.write(f"\nLeg {position['leg_number']}: {label}\n")
+            if not greeks_data:
+                self.write("Failed to get market data\n")
+                return
+            
+            # Display position details
+            current_price = greeks_data['current_option_price']
+            theoretical_price = greeks_data['theoretical_price_bs']
+            quantity = position["quantity"]
+            entry_cost = position["entry_cost"]
+            
+            # Calculate P&L
+            if quantity > 0:  # Long position
+                pnl = (current_price - entry_cost) * quantity * monitor.CONTRACT_MULTIPLIER
+            else:  # Short position
+                pnl = (entry_cost - current_price) * abs(quantity) * monitor.CONTRACT_MULTIPLIER
+            
+            # Display market data
+            model_label = "American" if greeks_data.get('pricing_model') == "american" else "BS"
+            self.write(f"Market Price: ${current_price:.3f}  |  {model_label} Price: ${theoretical_price:.3f}\n")
+            self.write(f"Position: {'Long' if quantity > 0 else 'Short'} {abs(quantity)}x @ ${entry_cost:.3f}\n")
+            self.write(f"P&L: ${pnl:,.2f}\n")
+            
+            # Display Greeks
+            self.write(f"Delta: {greeks_data['delta']:.4f}  |  Gamma: {greeks_data['gamma']:.4f}\n")
+            self.write(f"Vega: {greeks_data['vega']:.4f}  |  Theta: {greeks_data['theta']:.4f}  |  Rho: {greeks_data['rho']:.4f}\n")
+            self.write(f"Vanna: {greeks_data['vanna']:.4f}  |  Volga: {greeks_data['volga']:.4f}  |  "
+                       f"Charm: {greeks_data['charm']:.4f}  |  Speed: {greeks_data['speed']:.6f}\n")
+            
+            if greeks_data['underlying_price'] > 0:
+                # Quote time rather than age, so the text only changes when a new quote arrives
+                quote_text = f" ({monitor.format_quote_time(quote_entry)})" if quote_entry else ""
+                self.write(f"Underlying Price: ${greeks_data['underlying_price']:.2f}{quote_text}\n")
+            
+            self.write(f"IV: {greeks_data['volatility']:.2%}{' (solved)' if greeks_data.get('iv_source') == 'solved' else ''}  |  Days to Expiry: {greeks_data['days_to_expiry']}\n")
+            return
+        
+        # STOCK position
+        if not label:
+            self.write(f"\nLeg {position['leg_number']}: Invalid stock data\n")
+            return
+        self.write(f"\nLeg {position['leg_number']}: {label} (Stock)\n")
+        if not greeks_data:
+            self.write("Failed to get market data from yfinance\n")
+            return
+        current_price = greeks_data['current_option_price']
+        quantity = position["quantity"]
+        entry_cost = position["entry_cost"]
+        
+        # Calculate P&L
+        if quantity > 0:  # Long position
+            pnl = (current_price - entry_cost) * quantity
+        else:  # Short position
+            pnl = (entry_cost - current_price) * abs(quantity)
+            
+            # Add short interest cost if applicable
+            short_rate = position.get("user_inputs", {}).get("short_rate", 0.0)
+            if short_rate > 0:
+                days_held = (datetime.now() - datetime.strptime(position.get("entry_date", datetime.now().strftime("%Y-%m-%d")), "%Y-%m-%d")).days
+                short_interest_cost = abs(quantity) * entry_cost * (short_rate / 100) * (days_held / 365)
+                pnl -= short_interest_cost
+                self.write(f"Short Interest Cost: ${short_interest_cost:,.2f}\n")
+        
+        # Display position details
+        quote_text = f" ({monitor.format_quote_time(quote_entry)})" if quote_entry else ""
+        self.write(f"Market Price: ${current_price:.2f}{quote_text}\n")
+        self.write(f"Position: {'Long' if quantity > 0 else 'Short'} {abs(quantity)} shares @ ${entry_cost:.2f}\n")
+        self.write(f"P&L: ${pnl:,.2f}\n")
+        
+        # Display stock-specific info
+        if quantity < 0:  # Short position
+            short_rate = position.get("user_inputs", {}).get("short_rate", 0.0)
+            if short_rate > 0:
+                self.write(f"Short Interest Rate: {short_rate:.2f}%\n")
+
+    def render_portfolio_summary(self, combined_summary, all_positions_data):
+        self.write("\n--- Portfolio Summary ---\n")
+        self.write(f"Total P&L: ${combined_summary['portfolio_pnl']:,.2f}\n")
+        self.write(f"Total Market Value: ${combined_summary['portfolio_market_value']:,.2f}\n")
+        self.write(f"Total BS Value: ${combined_summary['portfolio_bs_value']:,.2f}\n")
+        
+        self.write("\nNet Greeks (Total):\n")
+        self.write(f"Delta: {combined_summary['total_net_delta']:,.2f}\n")
+        self.write(f"Gamma: {combined_summary['total_net_gamma']:,.2f}\n")
+        self.write(f"Vega: {combined_summary['net_vega_per_share_equiv'] * monitor.CONTRACT_MULTIPLIER:,.2f}\n")
+        self.write(f"Theta: {combined_summary['net_theta_per_share_equiv'] * monitor.CONTRACT_MULTIPLIER:,.2f}\n")
+        self.write(f"Rho: {combined_summary['net_rho_per_share_equiv'] * monitor.CONTRACT_MULTIPLIER:,.2f}\n")
+        self.write(f"Vanna: {combined_summary['net_vanna_per_share_equiv'] * monitor.CONTRACT_MULTIPLIER:,.2f}  |  "
+                   f"Volga: {combined_summary['net_volga_per_share_equiv'] * monitor.CONTRACT_MULTIPLIER:,.2f}  |  "
+                   f"Charm: {combined_summary['net_charm_per_share_equiv'] * monitor.CONTRACT_MULTIPLIER:,.2f}  |  "
+                   f"Speed: {combined_summary['net_speed_per_share_equiv'] * monitor.CONTRACT_MULTIPLIER:,.4f}\n")
+        
+        # Check portfolio-level thresholds
+        self.check_portfolio_thresholds(combined_summary, all_positions_data)
+
+    # --- Spreads ---
+    def refresh_spreads(self, quotes, changed_legs):
+        """
+        Spread sections and metrics for this tick. Metrics are recomputed only for spreads holding
+        a changed leg; the price and delta alerts are checked every tick, since a held alert can
+        fire once its cooldown ends. Returns (sections, spread metrics).
+        """
+        sections, tick_spread_metrics, views = [], [], {}
+        if self.spreads:
+            sections.append(self.build_section("spreads", self.write, "\n--- Spread Monitoring ---\n"))
+        for index, spread in enumerate(self.spreads):
+            key = (spread['name'], tuple(spread['legs']), spread.get('remark', ''))
+            view = self.spread_views.get(index)
+            if view is None or view[0] != key or changed_legs.intersection(spread['legs']):
+                view = (key, self.calculate_spread_metrics(spread, self.positions, quotes))
+            views[index] = view
+            spread_metrics = view[1]
+            if spread_metrics:
+                tick_spread_metrics.append(spread_metrics)
+                sections.append(self.build_section(f"spread:{index}", self.render_spread, spread, spread_metrics))
+        self.spread_views = views
+        return sections, tick_spread_metrics
+
+    def render_spread(self, spread, spread_metrics):
+        """Status-box text for one spread, with its price and delta target alerts."""
+        self.write(f"\n{spread_metrics['name']}:\n")
+        price_label = "Debit" if spread_metrics['price'] > 0 else "Credit"
+        self.write(f"Price: ${abs(spread_metrics['price']):.2f} {price_label} per spread\n")
+        self.write(f"Delta: {spread_metrics['delta']:.3f}  |  Vanna: {spread_metrics['vanna']:.4f}  |  "
+                   f"Volga: {spread_metrics['volga']:.4f}  |  Charm: {spread_metrics['charm']:.4f}  |  "
+                   f"Speed: {spread_metrics['speed']:.6f}\n")
+        
+        # Check price targets
+        current_price = spread_metrics['price']
+        upper_target = spread.get('target_price_upper')
+        lower_target = spread.get('target_price_lower')
+        
+        # Alert states fire once per crossing; a held alert is shown but not re-sent
+        overrides = {'hysteresis': spread.get('hysteresis'), 'cooldown': spread.get('cooldown'),
+                     'min_band': spread.get('min_band')}
+        state_key = f"spread:{spread['name']}"
+        notify = monitor.alert_state.update_threshold(f"{state_key}:price_upper", abs(current_price), upper_target, "above", **overrides)
+        if upper_target is not None and abs(current_price) >= upper_target:
+            price_label = "Debit" if current_price > 0 else "Credit"
+            alert_msg = f"Price ${abs(current_price):.2f} {price_label} per spread reached or exceeded upper target ${upper_target:.2f}"
+            if spread_metrics.get('remark'):
+                alert_msg += f"\nRemark: {spread_metrics['remark']}"
+            self.show_alert(alert_msg, notify)
+            if notify:
+                monitor.send_notification(f"Spread Alert - {spread_metrics['name']}", alert_msg)
+        
+        notify = monitor.alert_state.update_threshold(f"{state_key}:price_lower", abs(current_price), lower_target, "below", **overrides)
+        if lower_target is not None and abs(current_price) <= lower_target:
+            price_label = "Debit" if current_price > 0 else "Credit"
+            alert_msg = f"Price ${abs(current_price):.2f} {price_label} per spread reached or fell below lower target ${lower_target:.2f}"
+            if spread_metrics.get('remark'):
+                alert_msg += f"\nRemark: {spread_metrics['remark']}"
+            self.show_alert(alert_msg, notify)
+            if notify:
+                monitor.send_notification(f"Spread Alert - {spread_metrics['name']}", alert_msg)
+        
+        # Check delta targets
+        current_delta = spread_metrics['delta']
+        upper_delta = spread.get('target_delta_upper')
+        lower_delta = spread.get('target_delta_lower')
+        
+        notify = monitor.alert_state.update_threshold(f"{state_key}:delta_upper", current_delta, upper_delta, "above", **overrides)
+        if upper_delta is not None and current_delta >= upper_delta:
+            alert_msg = f"Delta {current_delta:.3f} reached or exceeded upper target {upper_delta:.3f}"
+            if spread_metrics.get('remark'):
+                alert_msg += f"\nRemark: {spread_metrics['remark']}"
+            self.show_alert(alert_msg, notify)
+            if notify:
+                monitor.send_notification(f"Spread Alert - {spread_metrics['name']}", alert_msg)
+        
+        notify = monitor.alert_state.update_threshold(f"{state_key}:delta_lower", current_delta, lower_delta, "below", **overrides)
+        if lower_delta is not None and current_delta <= lower_delta:
+            alert_msg = f"Delta {current_delta:.3f} reached or fell below lower target {lower_delta:.3f}"
+            if spread_metrics.get('remark'):
+                alert_msg += f"\nRemark: {spread_metrics['remark']}"
+            self.show_alert(alert_msg, notify)
+            if notify:
+                monitor.send_notification(f"Spread Alert - {spread_metrics['name']}", alert_msg)
+        
+        # Update previous values
+        if 'spreads' not in self.previous_values:
+            self.previous_values['spreads'] = {}
+        self.previous_values['spreads'][spread['name']] = {
+            'delta': current_delta
+        }
+
+    def start_quote_stream(self):
+        """Switch option quotes to OpenD push. Returns False if OpenD is not available."""
+        provider = monitor.market_data_provider
+        if provider.push_source is None:
+            self.status_text.insert("end", f"Streaming unavailable with {provider.name} market data; polling instead.\n")
+            return False
+        # For Futu the push source is the connection manager, which replays subscriptions after an OpenD restart
+        self.quote_stream = monitor.QuoteStream(provider.push_source, initial_snapshot=provider.get_option_quotes)
+        self.sync_stream_subscriptions()
+        self.root.after(STREAM_POLL_MS, self.poll_quote_stream)
+        return True
+
+    def stop_quote_stream(self):
+        if self.quote_stream is not None:
+            stream = self.quote_stream
+            self.quote_stream = None
+            # Unsubscribing blocks on OpenD; set_codes serializes it behind a sync still running
+            self.fetcher.submit(stream.stop, lambda result: None)
+
+    def sync_stream_subscriptions(self):
+        """Keep the stream's subscriptions in line with the current option positions, on the worker."""
+        if self.quote_stream is None:
+            return
+        if self.stream_sync_in_flight:
+            # Run once more with the newest positions when the running sync finishes
+            self.stream_sync_pending = True
+            return
+        option_codes = []
+        for position in self.positions:
+            if position.get("position_type", "OPTION") == "OPTION":
+                try:
+                    option_codes.append(self.get_position_option_code(position))
+                except ValueError:
+                    continue
+        stream = self.quote_stream
+        self.stream_sync_in_flight = True
+        
+        def on_done(result):
+            self.stream_sync_in_flight = False
+            added, removed = result
+            if added or removed:
+                print(f"Quote stream subscriptions: +{len(added)} -{len(removed)}")
+            if self.stream_sync_pending:
+                self.stream_sync_pending = False
+                self.sync_stream_subscriptions()
+        
+        def on_failed(error):
+            self.stream_sync_in_flight = False
+            self.stream_sync_pending = False
+            self.status_text.insert("end", f"Error updating quote stream subscriptions: {str(error)}\n")
+        
+        self.fetcher.submit(stream.set_codes, on_done, on_failed, option_codes)
+
+    def poll_quote_stream(self):
+        """Recompute only what depends on the option codes pushed since the last poll."""
+        if not self.monitoring or self.quote_stream is None:
+            return
+        try:
+            # Leave changes pending while a tick is loading; the next poll picks them up
+            if not self.tick_in_flight:
+                changed = self.quote_stream.consume_changes()
+                if changed:
+                    self.apply_pushed_quotes(changed)
+        except Exception as e:
+            self.status_text.insert("end", f"Error refreshing streamed quotes: {str(e)}\n")
+        self.root.after(STREAM_POLL_MS, self.poll_quote_stream)
+
+    def apply_pushed_quotes(self, changed_codes):
+        """
+        Fold pushed option quotes into the last tick's quote store and refresh the legs, spreads
+        and totals on those codes, keeping the tick's underlying prices and without restarting
+        VaR. Codes the last tick did not load (new positions) start a full tick instead.
+        """
+        quotes = self.last_tick_quotes
+        if quotes is None:
+            self.request_monitor_tick()
+            return
+        pushed = self.quote_stream.get_quotes(changed_codes)
+        applied = quotes.apply_option_quotes(pushed)
+        if len(applied) < len(pushed):
+            self.request_monitor_tick()
+        elif applied:
+            self.refresh_monitor_display(quotes, full_tick=False)
+
+    def get_position_option_code(self, position):
+        """Return the Futu option code for a position, building it for legacy positions."""
+        option_code = position.get("option_code")
+        if not option_code:  # Handle legacy positions
+            user_inputs = position.get("user_inputs", {})
+            market = user_inputs.get("market", "US")
+            ticker = user_inputs.get("ticker", "")
+            strike = user_inputs.get("strike", 0)
+            option_type = user_inputs.get("type", "C")
+            expiry = user_inputs.get("expiry", "")
+            
+            if all([market, ticker, strike, option_type, expiry]):
+                expiry_date = datetime.strptime(expiry, "%Y-%m-%d")
+                expiry_yymmdd = expiry_date.strftime("%y%m%d")
+                strike_formatted = str(int(strike * 1000))
+                option_code = f"{market}.{ticker}{expiry_yymmdd}{option_type}{strike_formatted}"
+                position["option_code"] = option_code  # Update the position with the option code
+        return option_code
+
+    def load_position_chain(self):
+        """Load the option chain for the Add Position ticker on the worker."""
+        ticker = self.ticker_var.get().strip().upper()
+        if not ticker:
+            messagebox.showwarning("Warning", "Please enter a ticker symbol")
+            return
+        underlying = f"{self.market_var.get()}.{ticker}"
+        start = date.today()
+        end = start + timedelta(days=monitor.OPTION_CHAIN_DEFAULT_DAYS)
+        try:
+            end = max(end, datetime.strptime(self.expiry_entry.entry.get(), "%Y-%m-%d").date())
+        except ValueError:
+            pass
+        self.chain_quote_var.set(f"Loading option chain for {underlying}...")
+        
+        def on_loaded(chain):
+            self.position_chain = chain
+            if not len(chain):
+                self.chain_quote_var.set(f"No listed options found for {underlying}")
+                return
+            self.update_chain_strikes()
+        
+        def on_failed(error):
+            self.chain_quote_var.set("")
+            messagebox.showerror("Error", f"Failed to load option chain: {str(error)}")
+        
+        self.fetcher.submit(monitor.load_option_chain, on_loaded, on_failed, underlying, start, end)
+    
+    def position_chain_contract(self, expiry, strike, option_type):
+        """Listed contract from the loaded chain for the form's ticker, or None. option_type is 'C' or 'P'."""
+        chain = self.position_chain
+        if chain is None or chain.underlying != f"{self.market_var.get()}.{self.ticker_var.get().strip().upper()}":
+            return None
+        return chain.get(expiry, strike, "Call" if option_type == 'C' else "Put")
+    
+    def update_chain_strikes(self):
+        """Snap the expiry to a listed one and offer that expiry's strikes in the strike box."""
+        chain = self.position_chain
+        if chain is None or not len(chain):
+            return
+        try:
+            expiry = datetime.strptime(self.expiry_entry.entry.get(), "%Y-%m-%d").date()
+        except ValueError:
+            expiry = date.today()
+        listed_expiry = chain.nearest_expiry(expiry)
+        if listed_expiry != expiry:
+            self.expiry_entry.entry.delete(0, tk.END)
+            self.expiry_entry.entry.insert(0, listed_expiry.strftime("%Y-%m-%d"))
+        option_type = "Call" if self.option_type_var.get() == "CALL" else "Put"
+        self.strike_combo["values"] = [f"{strike:g}" for strike in chain.strikes(listed_expiry, option_type)]
+        self.update_chain_quote()
+    
+    def update_chain_quote(self):
+        """Show the chain quote for the selected expiry/strike/type, if the contract is listed."""
+        chain = self.position_chain
+        if chain is None:
+            return
+        try:
+            expiry = datetime.strptime(self.expiry_entry.entry.get(), "%Y-%m-%d").date()
+            strike = float(self.strike_var.get())
+        except ValueError:
+            self.chain_quote_var.set(f"Chain: {len(chain)} contracts for {chain.underlying}, {len(chain.expiries())} expiries")
+            return
+        contract = self.position_chain_contract(expiry, strike, 'C' if self.option_type_var.get() == "CALL" else 'P')
+        if contract is None:
+            self.chain_quote_var.set(f"Not listed in the {chain.underlying} chain")
+        elif contract.get('last_price') is None:
+            self.chain_quote_var.set(f"{contract['option_code']}: no quote")
+        else:
+            self.chain_quote_var.set(f"{contract['option_code']}: last ${contract['last_price']:.3f}, "
+                                     f"IV {contract['implied_volatility']:.1%}, delta {contract['delta']:.3f}")
+    
     def reset_spread(self):
         """Reset all spread inputs to create a new spread."""
         self.spread_name_var.set("")
@@ -1554,38 +2110,41 @@ class OptionsMonitorGUI:
         self.lower_delta_target_var.set("")
         self.spread_remark_var.set("")
 
-    def get_leg_market_data(self, leg_position):
+    def get_leg_market_data(self, leg_position, quotes):
         position_type = leg_position.get("position_type", "OPTION")
         if position_type == "OPTION":
             option_code = leg_position.get("option_code")
             if not option_code:
                 return None
-            ret_option, data_option_df = monitor.quote_ctx.get_market_snapshot([option_code])
-            if ret_option != monitor.RET_OK or data_option_df.empty:
+            option_quote = quotes.get_option_quote(option_code)
+            if option_quote is None:
                 return None
+            greeks_data = quotes.get_option_greeks_data(option_code) or {}
             return {
                 'label': option_code,
-                'price': data_option_df.iloc[0].get('last_price', 0.0),
-                'delta': data_option_df.iloc[0].get('option_delta', 0.0)
+                'price': option_quote['last_price'],
+                'delta': option_quote['delta'],
+                **{name: greeks_data.get(name, 0.0) for name in monitor.SECOND_ORDER_GREEKS}
             }
         else:  # STOCK
             ticker = leg_position.get("ticker")
             if not ticker:
                 return None
-            ticker_symbol = ticker.split('.')[-1]
-            stock = yf.Ticker(ticker_symbol)
-            price = stock.info.get('regularMarketPrice', 0.0)
+            price = quotes.get_stock_price(ticker)
             if price <= 0:
                 return None
             quantity = leg_position["quantity"]
             return {
                 'label': ticker,
                 'price': price,
-                'delta': 1.0 if quantity > 0 else -1.0
+                'delta': 1.0 if quantity > 0 else -1.0,
+                **dict.fromkeys(monitor.SECOND_ORDER_GREEKS, 0.0)
             }
 
-    def calculate_spread_metrics(self, spread, positions):
-        """Calculate metrics for a specific spread."""
+    def calculate_spread_metrics(self, spread, positions, quotes=None):
+        """Calculate metrics for a specific spread. Reads quotes from the tick's store when given."""
+        if quotes is None:
+            quotes = monitor.TickQuoteStore()
         spread_legs_data = []
         for leg_num in spread['legs']:
             # Find the position with matching leg number
@@ -1593,7 +2152,7 @@ class OptionsMonitorGUI:
             if leg_position is None:
                 return None
             try:
-                market_data = self.get_leg_market_data(leg_position)
+                market_data = self.get_leg_market_data(leg_position, quotes)
                 if not market_data:
                     return None
                 spread_legs_data.append({
@@ -1606,6 +2165,7 @@ class OptionsMonitorGUI:
         # Calculate combined metrics
         spread_price = 0
         spread_delta = 0
+        spread_second_order = dict.fromkeys(monitor.SECOND_ORDER_GREEKS, 0.0)
         leg_details = []
         for leg_data in spread_legs_data:
             position = leg_data['position']
@@ -1625,15 +2185,77 @@ class OptionsMonitorGUI:
             })
             spread_price += leg_contribution
             spread_delta += delta_contribution
+            for name in monitor.SECOND_ORDER_GREEKS:
+                spread_second_order[name] += market_data[name] * (quantity / abs(quantity)) if quantity != 0 else 0
         return {
             'name': spread['name'],
             'price': spread_price,
             'delta': spread_delta,
+            **spread_second_order,
             'legs': leg_details,
             'timestamp': datetime.now().isoformat(),
             'remark': spread.get('remark', '')
         }
 
+    def alert_rules_status(self):
+        enabled = sum(rule.enabled for rule in self.alert_rules.rules)
+        counts = monitor.alert_state.counts()
+        return (f"{enabled} of {len(self.alert_rules)} rules enabled ({monitor.ALERT_RULES_FILE})\n"
+                f"Alerts: {counts['fired']} fired, {counts['cooldown']} cooling down")
+    
+    def reload_alert_rules(self):
+        """Re-read and recompile the rules file."""
+        self.alert_rules = monitor.load_rules(monitor.ALERT_RULES_FILE)
+        self.alert_rules_var.set(self.alert_rules_status())
+    
+    def rearm_alerts(self):
+        """Forget every alert state, so alerts whose condition still holds notify again on the next tick."""
+        count = monitor.alert_state.reset()
+        self.alert_rules_var.set(self.alert_rules_status())
+        self.status_text.insert("end", f"\nRe-armed {count} alerts\n")
+    
+    def forget_alert_states(self, spread=None, legs=(), portfolio=False):
+        """
+        Drop the alert states of a removed spread, of renumbered or removed legs and, once the
+        book is empty, of the portfolio, so a new spread or leg in their place starts armed.
+        """
+        state = monitor.alert_state
+        if spread is not None:
+            state.reset(f"spread:{spread}:")
+            state.forget_labels("rule:", [spread])
+        state.forget_labels("rule:", legs)
+        if portfolio:
+            state.reset("portfolio:")
+            state.forget_labels("rule:", [0])   # portfolio-scope rules have a single row, label 0
+        self.alert_rules_var.set(self.alert_rules_status())
+    
+    def show_alert(self, alert_msg, notify, newline=False):
+        """Alert line for the status area; alerts already notified on an earlier tick are marked as held."""
+        prefix = "\n" if newline else ""
+        if notify:
+            self.write(f"{prefix}ALERT: {alert_msg}\n", "alert")
+        else:
+            self.write(f"{prefix}ALERT (active, already notified): {alert_msg}\n", "alert")
+    
+    def check_alert_rules(self, combined_summary, spread_metrics_list, all_positions_data, previous_spreads):
+        """Evaluate the alert rules against this tick's portfolio, spread and leg metrics."""
+        self.alert_rules_var.set(self.alert_rules_status())
+        if not len(self.alert_rules) and not self.alert_rules.errors:
+            return
+        try:
+            table = monitor.build_metric_table(combined_summary, spread_metrics_list, all_positions_data,
+                                               self.last_var_result, previous_spreads)
+            matches = monitor.check_alert_rules(self.alert_rules, table)
+        except Exception as e:
+            self.write(f"Error checking alert rules: {str(e)}\n")
+            return
+        if matches:
+            self.write("\n--- Rule Alerts ---\n")
+        for match in matches:
+            self.show_alert(f"{monitor.rule_match_title(match)}: {match['message']}", match["notify"])
+        for name, error in self.alert_rules.errors.items():
+            self.write(f"Rule '{name}' skipped: {error}\n")
+    
     def check_portfolio_thresholds(self, combined_summary, all_positions_data):
         """Check portfolio-level P&L and delta thresholds."""
         try:
@@ -1643,13 +2265,9 @@ class OptionsMonitorGUI:
             delta_upper_threshold = float(self.delta_upper_threshold_var.get()) if self.delta_upper_threshold_var.get().strip() else None
             delta_lower_threshold = float(self.delta_lower_threshold_var.get()) if self.delta_lower_threshold_var.get().strip() else None
             
-            # Calculate initial position value for percentage P&L calculation
-            # Use contract multiplier only for options; stocks use 1x
-            initial_value = 0
-            for pos_data in all_positions_data:
-                is_option = bool(pos_data.get('greeks_data', {}).get('option_code'))
-                multiplier = monitor.CONTRACT_MULTIPLIER if is_option else 1
-                initial_value += abs(pos_data['quantity']) * pos_data['entry_cost'] * multiplier
+            # Initial position value for percentage P&L, kept by the portfolio aggregator
+            # (contract multiplier only for options; stocks use 1x)
+            initial_value = combined_summary['initial_value']
             
             # Check P&L thresholds
             current_pnl = combined_summary['portfolio_pnl']
@@ -1657,6 +2275,7 @@ class OptionsMonitorGUI:
                 pnl_pct = (current_pnl / initial_value) * 100
                 
                 # Check upper P&L threshold (profit)
+                notify = monitor.alert_state.update_threshold("portfolio:pnl_upper", pnl_pct, pnl_upper_threshold, "above")
                 if pnl_upper_threshold is not None and pnl_pct >= pnl_upper_threshold:
                     alert_msg = f"Portfolio P&L reached {pnl_pct:.1f}% (${current_pnl:,.2f})\nUpper threshold: {pnl_upper_threshold}%"
                     
@@ -1673,22 +2292,24 @@ class OptionsMonitorGUI:
                     if position_remarks:
                         alert_msg += f"\n\nPosition Notes:\n" + "\n".join(position_remarks)
                     
-                    self.status_text.insert("end", f"\nALERT: {alert_msg}\n", "alert")
-                    monitor.send_notification("Portfolio P&L Upper Alert", alert_msg)
-                    
-                    # Save alert data
-                    alert_data = {
-                        'pnl_percentage': pnl_pct,
-                        'current_pnl': current_pnl,
-                        'initial_value': initial_value,
-                        'threshold': pnl_upper_threshold,
-                        'threshold_type': 'upper',
-                        'pnl_remark': self.pnl_remark_var.get(),
-                        'position_remarks': position_remarks
-                    }
-                    monitor.save_alert_data('portfolio_pnl_upper', alert_data)
+                    self.show_alert(alert_msg, notify, newline=True)
+                    if notify:
+                        monitor.send_notification("Portfolio P&L Upper Alert", alert_msg)
+                        
+                        # Save alert data
+                        alert_data = {
+                            'pnl_percentage': pnl_pct,
+                            'current_pnl': current_pnl,
+                            'initial_value': initial_value,
+                            'threshold': pnl_upper_threshold,
+                            'threshold_type': 'upper',
+                            'pnl_remark': self.pnl_remark_var.get(),
+                            'position_remarks': position_remarks
+                        }
+                        monitor.save_alert_data('portfolio_pnl_upper', alert_data)
                 
                 # Check lower P&L threshold (loss)
+                notify = monitor.alert_state.update_threshold("portfolio:pnl_lower", pnl_pct, pnl_lower_threshold, "below")
                 if pnl_lower_threshold is not None and pnl_pct <= pnl_lower_threshold:
                     alert_msg = f"Portfolio P&L reached {pnl_pct:.1f}% (${current_pnl:,.2f})\nLower threshold: {pnl_lower_threshold}%"
                     
@@ -1705,25 +2326,27 @@ class OptionsMonitorGUI:
                     if position_remarks:
                         alert_msg += f"\n\nPosition Notes:\n" + "\n".join(position_remarks)
                     
-                    self.status_text.insert("end", f"\nALERT: {alert_msg}\n", "alert")
-                    monitor.send_notification("Portfolio P&L Lower Alert", alert_msg)
-                    
-                    # Save alert data
-                    alert_data = {
-                        'pnl_percentage': pnl_pct,
-                        'current_pnl': current_pnl,
-                        'initial_value': initial_value,
-                        'threshold': pnl_lower_threshold,
-                        'threshold_type': 'lower',
-                        'pnl_remark': self.pnl_remark_var.get(),
-                        'position_remarks': position_remarks
-                    }
-                    monitor.save_alert_data('portfolio_pnl_lower', alert_data)
+                    self.show_alert(alert_msg, notify, newline=True)
+                    if notify:
+                        monitor.send_notification("Portfolio P&L Lower Alert", alert_msg)
+                        
+                        # Save alert data
+                        alert_data = {
+                            'pnl_percentage': pnl_pct,
+                            'current_pnl': current_pnl,
+                            'initial_value': initial_value,
+                            'threshold': pnl_lower_threshold,
+                            'threshold_type': 'lower',
+                            'pnl_remark': self.pnl_remark_var.get(),
+                            'position_remarks': position_remarks
+                        }
+                        monitor.save_alert_data('portfolio_pnl_lower', alert_data)
             
             # Check Delta thresholds
             current_delta = combined_summary['total_net_delta']
             
             # Check upper delta threshold
+            notify = monitor.alert_state.update_threshold("portfolio:delta_upper", current_delta, delta_upper_threshold, "above")
             if delta_upper_threshold is not None and current_delta >= delta_upper_threshold:
                 alert_msg = f"Portfolio delta ({current_delta:,.2f}) exceeds upper threshold: {delta_upper_threshold}\nCurrent P&L: ${current_pnl:,.2f}"
                 
@@ -1740,21 +2363,23 @@ class OptionsMonitorGUI:
                 if position_remarks:
                     alert_msg += f"\n\nPosition Notes:\n" + "\n".join(position_remarks)
                 
-                self.status_text.insert("end", f"\nALERT: {alert_msg}\n", "alert")
-                monitor.send_notification("Portfolio Delta Upper Alert", alert_msg)
-                
-                # Save alert data
-                alert_data = {
-                    'current_delta': current_delta,
-                    'threshold': delta_upper_threshold,
-                    'threshold_type': 'upper',
-                    'current_pnl': current_pnl,
-                    'delta_remark': self.delta_remark_var.get(),
-                    'position_remarks': position_remarks
-                }
-                monitor.save_alert_data('portfolio_delta_upper', alert_data)
+                self.show_alert(alert_msg, notify, newline=True)
+                if notify:
+                    monitor.send_notification("Portfolio Delta Upper Alert", alert_msg)
+                    
+                    # Save alert data
+                    alert_data = {
+                        'current_delta': current_delta,
+                        'threshold': delta_upper_threshold,
+                        'threshold_type': 'upper',
+                        'current_pnl': current_pnl,
+                        'delta_remark': self.delta_remark_var.get(),
+                        'position_remarks': position_remarks
+                    }
+                    monitor.save_alert_data('portfolio_delta_upper', alert_data)
             
             # Check lower delta threshold
+            notify = monitor.alert_state.update_threshold("portfolio:delta_lower", current_delta, delta_lower_threshold, "below")
             if delta_lower_threshold is not None and current_delta <= delta_lower_threshold:
                 alert_msg = f"Portfolio delta ({current_delta:,.2f}) below lower threshold: {delta_lower_threshold}\nCurrent P&L: ${current_pnl:,.2f}"
                 
@@ -1771,26 +2396,27 @@ class OptionsMonitorGUI:
                 if position_remarks:
                     alert_msg += f"\n\nPosition Notes:\n" + "\n".join(position_remarks)
                 
-                self.status_text.insert("end", f"\nALERT: {alert_msg}\n", "alert")
-                monitor.send_notification("Portfolio Delta Lower Alert", alert_msg)
-                
-                # Save alert data
-                alert_data = {
-                    'current_delta': current_delta,
-                    'threshold': delta_lower_threshold,
-                    'threshold_type': 'lower',
-                    'current_pnl': current_pnl,
-                    'delta_remark': self.delta_remark_var.get(),
-                    'position_remarks': position_remarks
-                }
-                monitor.save_alert_data('portfolio_delta_lower', alert_data)
+                self.show_alert(alert_msg, notify, newline=True)
+                if notify:
+                    monitor.send_notification("Portfolio Delta Lower Alert", alert_msg)
+                    
+                    # Save alert data
+                    alert_data = {
+                        'current_delta': current_delta,
+                        'threshold': delta_lower_threshold,
+                        'threshold_type': 'lower',
+                        'current_pnl': current_pnl,
+                        'delta_remark': self.delta_remark_var.get(),
+                        'position_remarks': position_remarks
+                    }
+                    monitor.save_alert_data('portfolio_delta_lower', alert_data)
             
             # Update previous values for future change detection
             self.previous_values['total_pnl'] = current_pnl
             self.previous_values['total_delta'] = current_delta
             
         except ValueError as e:
-            self.status_text.insert("end", f"Error in threshold values: {e}\n")
+            self.write(f"Error in threshold values: {e}\n")
 
     # === BS CALCULATOR METHODS ===
     
@@ -1803,35 +2429,80 @@ class OptionsMonitorGUI:
             messagebox.showwarning("Warning", "Please enter a ticker symbol")
             return
         
-        try:
-            # Fetch from Yahoo Finance
-            print(f"Fetching market data for {ticker}...")
-            stock_yf_ticker = yf.Ticker(ticker)
-            stock_info = stock_yf_ticker.info
-            
-            # Get current price
-            current_price = 0.0
-            if 'currentPrice' in stock_info and stock_info['currentPrice'] is not None:
-                current_price = stock_info['currentPrice']
-            elif 'regularMarketPrice' in stock_info and stock_info['regularMarketPrice'] is not None:
-                current_price = stock_info['regularMarketPrice']
-            elif 'previousClose' in stock_info and stock_info['previousClose'] is not None:
-                current_price = stock_info['previousClose']
-            else:
-                hist = stock_yf_ticker.history(period="1d", interval="1m")
-                if not hist.empty:
-                    current_price = hist['Close'].iloc[-1]
-            
+        # Fetch from the shared underlying price cache (Yahoo Finance) on the background worker
+        print(f"Fetching market data for {ticker}...")
+        symbol = self.bs_yahoo_symbol()
+        
+        def on_fetched(entries):
+            entry = entries.get(symbol)
+            current_price = entry["price"] if entry else 0.0
             if current_price > 0:
+                self.bs_price_quote = entry
                 self.bs_current_price_var.set(f"{current_price:.2f}")
-                print(f"Fetched stock price: ${current_price:.2f}")
-                messagebox.showinfo("Success", f"Market data fetched for {ticker}\nStock Price: ${current_price:.2f}")
+                print(f"Fetched stock price: ${current_price:.2f} ({monitor.format_quote_age(entry)})")
+                messagebox.showinfo("Success", f"Market data fetched for {ticker}\nStock Price: ${current_price:.2f}\nSource: {monitor.format_quote_age(entry)}")
             else:
                 messagebox.showwarning("Warning", f"Could not fetch current price for {ticker}")
+        
+        def on_failed(error):
+            messagebox.showerror("Error", f"Failed to fetch market data: {str(error)}")
+        
+        self.fetcher.submit(monitor.underlying_price_cache.fetch, on_fetched, on_failed, [symbol])
+    
+    def bs_yahoo_symbol(self):
+        """Yahoo symbol for the BS calculator ticker; a ticker that already has a suffix is used as typed."""
+        ticker = self.bs_ticker_var.get().strip().upper()
+        if '.' in ticker:
+            return ticker
+        return monitor.to_yahoo_symbol(f"{self.bs_market_var.get()}.{ticker}")
+    
+    def load_bs_chain(self):
+        """Load the option chain for the BS ticker on the worker; strikes of the nearest expiry to DTE fill the strike box."""
+        ticker = self.bs_ticker_var.get().strip().upper()
+        if not ticker:
+            messagebox.showwarning("Warning", "Please enter a ticker symbol")
+            return
+        underlying = f"{self.bs_market_var.get()}.{ticker}"
+        self.bs_chain_status_var.set("Loading option chain...")
+        
+        def load_chain_and_surface():
+            chain = monitor.load_option_chain(underlying)
+            return chain, monitor.load_vol_surface(underlying, chain)
+        
+        def on_loaded(result):
+            chain, self.bs_surface = result
+            self.bs_chain = chain
+            try:
+                target = date.today() + timedelta(days=int(self.bs_dte_var.get()))
+            except ValueError:
+                target = date.today()
+            expiry = chain.nearest_expiry(target)
+            if expiry is None:
+                self.bs_chain_status_var.set(f"No listed options for {underlying}")
                 return
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to fetch market data: {str(e)}")
+            self.bs_dte_var.set(str((expiry - date.today()).days))
+            self.bs_strike_combo["values"] = [f"{strike:g}" for strike in chain.strikes(expiry)]
+            surface_text = f", surface: {len(self.bs_surface.smiles)} smiles" if self.bs_surface else ""
+            self.bs_chain_status_var.set(f"Chain: {len(chain)} contracts, {len(chain.expiries())} expiries{surface_text}")
+            if self.bs_use_surface_var.get():
+                self.calculate_bs_portfolio()
+        
+        def on_failed(error):
+            self.bs_chain_status_var.set("")
+            messagebox.showerror("Error", f"Failed to load option chain: {str(error)}")
+        
+        self.fetcher.submit(load_chain_and_surface, on_loaded, on_failed)
+    
+    def check_bs_quote_age(self, S):
+        """Raise ValueError if S is the last fetched quote and it is older than the configured limit."""
+        limit_text = self.bs_max_quote_age_var.get().strip()
+        if not limit_text or self.bs_price_quote is None:
+            return
+        if abs(round(self.bs_price_quote["price"], 2) - S) > 0.005:
+            return  # Price was typed in manually
+        age = monitor.UnderlyingPriceCache.age(self.bs_price_quote)
+        if age > float(limit_text):
+            raise ValueError(f"Stock price quote is {age:.0f}s old (limit {float(limit_text):.0f}s). Fetch market data again or enter the price manually.")
     
     def add_bs_leg(self):
         """Add a new option leg to the BS calculator."""
@@ -1858,6 +2529,15 @@ class OptionsMonitorGUI:
                 'leg_id': len(self.bs_legs) + 1
             }
             
+            # Attach the listed contract's market quote when the chain has this expiry and strike
+            if self.bs_chain is not None and self.bs_chain.underlying == f"{self.bs_market_var.get()}.{self.bs_ticker_var.get().strip().upper()}":
+                expiry = date.today() + timedelta(days=dte)
+                contract = self.bs_chain.get(expiry, strike, option_type.capitalize())
+                if contract is not None and contract.get('last_price') is not None:
+                    leg['option_code'] = contract['option_code']
+                    leg['market_price'] = contract['last_price']
+                    leg['market_iv'] = contract['implied_volatility']
+            
             # Add to legs list
             self.bs_legs.append(leg)
             
@@ -1904,47 +2584,32 @@ class OptionsMonitorGUI:
             self.bs_legs.clear()
             self.calculate_bs_portfolio()
     
+    def active_bs_surface(self):
+        """The fitted surface if "Use vol surface" is on and it belongs to the current BS ticker, else None."""
+        surface = self.bs_surface
+        if not self.bs_use_surface_var.get() or surface is None or not surface.smiles:
+            return None
+        if surface.underlying != f"{self.bs_market_var.get()}.{self.bs_ticker_var.get().strip().upper()}":
+            return None
+        return surface
+    
+    def bs_leg_volatilities(self):
+        """Volatility of every BS leg: vol(K, T) from the surface when active, else the flat volatility."""
+        surface = self.active_bs_surface()
+        if surface is not None:
+            return [surface.vol(leg['strike'], max(leg['dte'], 1) / 365.0) for leg in self.bs_legs]
+        return [float(self.bs_volatility_var.get())] * len(self.bs_legs)
+    
+    def bs_scenario_legs(self):
+        """The BS calculator legs as monitor.scenario_leg()s (P&L from today's model value)."""
+        S = float(self.bs_current_price_var.get())
+        return [monitor.scenario_leg(S, leg['quantity'], K=leg['strike'], T=leg['dte'] / 365.0,
+                                     sigma=sigma, option_type=leg['option_type'])
+                for leg, sigma in zip(self.bs_legs, self.bs_leg_volatilities())]
+    
     def calculate_bs_greeks(self, S, K, T, r, sigma, option_type):
         """Calculate Black-Scholes Greeks."""
-        if T <= 0 or sigma <= 0:
-            return {
-                'price': max(0, S - K) if option_type.upper() == 'CALL' else max(0, K - S),
-                'delta': 1.0 if option_type.upper() == 'CALL' and S > K else 0.0,
-                'gamma': 0.0,
-                'vega': 0.0,
-                'theta': 0.0,
-                'rho': 0.0
-            }
-        
-        # Calculate d1 and d2
-        d1 = (math.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * math.sqrt(T))
-        d2 = d1 - sigma * math.sqrt(T)
-        
-        # Calculate price using existing function
-        price = black_scholes_price(S, K, T, r, sigma, option_type.lower())
-        
-        # Calculate Greeks
-        if option_type.upper() == 'CALL':
-            delta = N(d1)
-            rho = K * T * math.exp(-r * T) * N(d2) / 100  # Divided by 100 for 1% change
-        else:  # PUT
-            delta = N(d1) - 1
-            rho = -K * T * math.exp(-r * T) * N(-d2) / 100  # Divided by 100 for 1% change
-        
-        # Common Greeks
-        gamma = math.exp(-d1**2 / 2) / (S * sigma * math.sqrt(2 * math.pi * T))
-        vega = S * math.exp(-d1**2 / 2) * math.sqrt(T) / (math.sqrt(2 * math.pi) * 100)  # Divided by 100 for 1% change
-        theta = -(S * math.exp(-d1**2 / 2) * sigma / (2 * math.sqrt(2 * math.pi * T)) + 
-                 r * K * math.exp(-r * T) * (N(d2) if option_type.upper() == 'CALL' else N(-d2))) / 365  # Per day
-        
-        return {
-            'price': price,
-            'delta': delta,
-            'gamma': gamma,
-            'vega': vega,
-            'theta': theta,
-            'rho': rho
-        }
+        return monitor.greeks_cache.greeks(S, K, T, r, sigma, option_type)
     
     def calculate_bs_portfolio(self):
         """Calculate and display BS portfolio metrics."""
@@ -1968,6 +2633,7 @@ class OptionsMonitorGUI:
                 raise ValueError("Stock price must be positive")
             if sigma < 0:
                 raise ValueError("Volatility cannot be negative")
+            self.check_bs_quote_age(S)
             
             # Calculate individual legs
             total_portfolio_value = 0
@@ -1976,22 +2642,37 @@ class OptionsMonitorGUI:
             total_vega = 0
             total_theta = 0
             total_rho = 0
+            total_second_order = dict.fromkeys(monitor.SECOND_ORDER_GREEKS, 0.0)
             
             leg_results = []
             
-            for leg in self.bs_legs:
+            # Price every leg in one vectorized call: American tree for HK (early exercise), otherwise
+            # Black-Scholes with legs whose inputs haven't moved served from the cache
+            strikes = [leg['strike'] for leg in self.bs_legs]
+            times = [leg['dte'] / 365.0 for leg in self.bs_legs]
+            option_types = [leg['option_type'] for leg in self.bs_legs]
+            sigmas = self.bs_leg_volatilities()
+            american = monitor.uses_american_pricing(self.bs_market_var.get())
+            if american:
+                underlying = f"{self.bs_market_var.get()}.{self.bs_ticker_var.get().strip().upper()}"
+                all_greeks = monitor.american_greeks(S, strikes, times, r, sigmas, option_types, underlying=underlying)
+                model_text = f"American (binomial tree, {monitor.AMERICAN_TREE_STEPS} steps, dividend yield {monitor.dividend_yield(underlying):.2%})"
+            else:
+                all_greeks = monitor.greeks_cache.price_greeks(S, strikes, times, r, sigmas, option_types)
+                model_text = "Black-Scholes (European)"
+            
+            for i, leg in enumerate(self.bs_legs):
                 K = leg['strike']
-                T = leg['dte'] / 365.0  # Convert days to years
                 option_type = leg['option_type']
                 quantity = leg['quantity']
                 
-                # Calculate Greeks
-                greeks = self.calculate_bs_greeks(S, K, T, r, sigma, option_type)
+                greeks = {name: float(values[i]) for name, values in all_greeks.items()}
                 
                 # Store individual leg results
                 leg_result = {
                     'leg': leg,
                     'greeks': greeks,
+                    'volatility': sigmas[i],
                     'position_value': greeks['price'] * quantity * CONTRACT_MULTIPLIER
                 }
                 leg_results.append(leg_result)
@@ -2003,6 +2684,8 @@ class OptionsMonitorGUI:
                 total_vega += greeks['vega'] * quantity * CONTRACT_MULTIPLIER
                 total_theta += greeks['theta'] * quantity * CONTRACT_MULTIPLIER
                 total_rho += greeks['rho'] * quantity * CONTRACT_MULTIPLIER
+                for name in monitor.SECOND_ORDER_GREEKS:
+                    total_second_order[name] += greeks[name] * quantity * CONTRACT_MULTIPLIER
                 
                 # Add to tree view
                 self.bs_legs_tree.insert("", "end", values=(
@@ -2019,12 +2702,19 @@ class OptionsMonitorGUI:
                 ))
             
             # Display portfolio summary
+            price_source = ""
+            if self.bs_price_quote is not None and abs(round(self.bs_price_quote["price"], 2) - S) <= 0.005:
+                price_source = f" ({monitor.format_quote_age(self.bs_price_quote)})"
+            surface = self.active_bs_surface()
+            volatility_text = (f"SVI surface ({len(surface.smiles)} expiries, fitted {surface.age():.0f}s ago)"
+                               if surface is not None else f"{sigma:.2%}")
             portfolio_summary = f"""BLACK-SCHOLES PORTFOLIO ANALYSIS
 {'='*50}
 
 Market Parameters:
-  Stock Price: ${S:.2f}
-  Volatility: {sigma:.2%}
+  Model: {model_text}
+  Stock Price: ${S:.2f}{price_source}
+  Volatility: {volatility_text}
   Risk-free Rate: {r:.2%}
 
 Portfolio Summary:
@@ -2036,6 +2726,10 @@ Portfolio Greeks:
   Vega: {total_vega:,.2f} (${total_vega:,.2f} for 1% vol change)
   Theta: {total_theta:,.2f} (${total_theta:,.2f} per day)
   Rho: {total_rho:,.2f} (${total_rho:,.2f} for 1% rate change)
+  Vanna: {total_second_order['vanna']:,.2f} (delta change for 1% vol change)
+  Volga: {total_second_order['volga']:,.2f} (vega change for 1% vol change)
+  Charm: {total_second_order['charm']:,.2f} (delta change per day)
+  Speed: {total_second_order['speed']:,.4f} (gamma change for $1 move)
 
 Individual Legs:
 """
@@ -2048,14 +2742,21 @@ Individual Legs:
                 portfolio_summary += f"""
 Leg {i}: {leg['quantity']}x ${leg['strike']:.2f} {leg['option_type']} ({leg['dte']} DTE)
   Value: ${value:,.2f}
+  Volatility: {result['volatility']:.2%}
   Price: ${greeks['price']:.3f}
   Delta: {greeks['delta']:.4f}
   Gamma: {greeks['gamma']:.4f}
   Vega: {greeks['vega']:.4f}
   Theta: {greeks['theta']:.4f}
-  Rho: {greeks['rho']:.4f}"""
+  Rho: {greeks['rho']:.4f}
+  Vanna: {greeks['vanna']:.4f}  Volga: {greeks['volga']:.4f}  Charm: {greeks['charm']:.4f}  Speed: {greeks['speed']:.6f}"""
+                if leg.get('market_price') is not None:
+                    portfolio_summary += f"""
+  Market: ${leg['market_price']:.3f} (IV {leg['market_iv']:.2%}, {leg['option_code']})"""
             
             self.bs_portfolio_text.insert(tk.END, portfolio_summary)
+            self.refresh_scenario_window()
+            self.refresh_payoff_chart()
             
             # Auto-fetch market data if enabled and ticker is set
             if self.bs_auto_fetch_var.get() and self.bs_ticker_var.get().strip():
@@ -2069,32 +2770,222 @@ Leg {i}: {leg['quantity']}x ${leg['strike']:.2f} {leg['option_type']} ({leg['dte
     def auto_update_bs_data(self):
         """Auto-update market data if enabled."""
         if self.bs_auto_fetch_var.get() and self.bs_ticker_var.get().strip():
-            try:
-                # Silently fetch updated price
-                ticker = self.bs_ticker_var.get().strip().upper()
-                stock_yf_ticker = yf.Ticker(ticker)
-                stock_info = stock_yf_ticker.info
-                
-                current_price = 0.0
-                if 'currentPrice' in stock_info and stock_info['currentPrice'] is not None:
-                    current_price = stock_info['currentPrice']
-                elif 'regularMarketPrice' in stock_info and stock_info['regularMarketPrice'] is not None:
-                    current_price = stock_info['regularMarketPrice']
-                
-                if current_price > 0:
-                    old_price = float(self.bs_current_price_var.get())
-                    if abs(current_price - old_price) > 0.01:  # Only update if price changed significantly
-                        self.bs_current_price_var.set(f"{current_price:.2f}")
-                        self.calculate_bs_portfolio()  # Recalculate with new price
-                
-            except Exception:
-                pass  # Silently fail for auto-updates
+            # Silently fetch updated price on the worker (served from the cache while it is fresh)
+            symbol = self.bs_yahoo_symbol()
+            
+            def on_fetched(entries):
+                try:
+                    entry = entries.get(symbol)
+                    current_price = entry["price"] if entry else 0.0
+                    
+                    if current_price > 0:
+                        old_price = float(self.bs_current_price_var.get())
+                        if abs(current_price - old_price) > 0.01:  # Only update if price changed significantly
+                            self.bs_price_quote = entry
+                            self.bs_current_price_var.set(f"{current_price:.2f}")
+                            self.calculate_bs_portfolio()  # Recalculate with new price
+                except Exception:
+                    pass  # Silently fail for auto-updates
+            
+            self.fetcher.submit(monitor.underlying_price_cache.fetch, on_fetched, lambda error: None, [symbol])
+
+    def open_scenario_window(self):
+        """Open (or raise) the spot x vol scenario P&L matrix for the BS legs and live positions."""
+        if self.scenario_window is not None and self.scenario_window.winfo_exists():
+            self.scenario_window.lift()
+            self.refresh_scenario_window()
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("Scenario P&L Matrix")
+        window.geometry("1000x700")
+        self.scenario_window = window
+        
+        controls = ttk.Frame(window)
+        controls.pack(fill='x', padx=5, pady=5)
+        ttk.Label(controls, text="Days forward:").pack(side='left', padx=(0, 5))
+        days_combo = ttk.Combobox(controls, textvariable=self.scenario_days_var, state="readonly", width=6,
+                                  values=[str(days) for days in monitor.SCENARIO_DAYS_FORWARD])
+        days_combo.pack(side='left', padx=(0, 10))
+        days_combo.bind("<<ComboboxSelected>>", lambda event: self.show_scenario_matrix())
+        ttk.Checkbutton(controls, text="BS legs", variable=self.scenario_include_bs_var,
+                        command=self.refresh_scenario_window).pack(side='left', padx=5)
+        ttk.Checkbutton(controls, text="Live positions", variable=self.scenario_include_live_var,
+                        command=self.refresh_scenario_window).pack(side='left', padx=5)
+        ttk.Button(controls, text="Export CSV", command=self.export_scenario_matrix).pack(side='right', padx=5)
+        ttk.Label(window, textvariable=self.scenario_status_var).pack(fill='x', padx=5)
+        
+        # Rows: spot shift; columns: volatility shift
+        columns = ["Spot"] + [f"Vol {shift:+.0%}" for shift in monitor.SCENARIO_VOL_SHIFTS]
+        frame = ttk.Frame(window)
+        frame.pack(fill='both', expand=True, padx=5, pady=5)
+        self.scenario_tree = ttk.Treeview(frame, columns=columns, show="headings")
+        for col in columns:
+            self.scenario_tree.heading(col, text=col)
+            self.scenario_tree.column(col, width=80, anchor='e')
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.scenario_tree.yview)
+        self.scenario_tree.configure(yscrollcommand=scrollbar.set)
+        self.scenario_tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        
+        self.refresh_scenario_window()
+    
+    def scenario_legs(self):
+        """Scenario legs from the BS calculator legs and from the live positions' last monitor tick."""
+        legs = []
+        if self.scenario_include_bs_var.get() and self.bs_legs:
+            legs.extend(self.bs_scenario_legs())
+        if self.scenario_include_live_var.get():
+            legs.extend(self.live_position_legs())
+        return legs
+    
+    def live_position_legs(self, yahoo_symbol=None, with_cost=False):
+        """
+        Scenario legs for the live positions, priced from the last monitor tick. Optionally
+        only those on one underlying (Yahoo symbol) and with the entry cost as leg cost.
+        """
+        legs = []
+        quotes = self.last_tick_quotes
+        if quotes is None:
+            return legs
+        for position in self.positions:
+            cost = position['entry_cost'] if with_cost else None
+            if position.get("position_type", "OPTION") == "OPTION":
+                option_code = self.get_position_option_code(position)
+                greeks_data = quotes.get_option_greeks_data(option_code) if option_code else None
+                if not greeks_data or greeks_data['underlying_price'] <= 0 or greeks_data['volatility'] <= 0:
+                    continue
+                if yahoo_symbol and monitor.to_yahoo_symbol(greeks_data.get('underlying_code') or "") != yahoo_symbol:
+                    continue
+                legs.append(monitor.scenario_leg(
+                    greeks_data['underlying_price'], position['quantity'], K=greeks_data['strike_price'],
+                    T=max(0, greeks_data['days_to_expiry']) / 365.0, sigma=greeks_data['volatility'],
+                    option_type=greeks_data['option_type'], cost=cost, underlying=greeks_data.get('underlying_code')))
+            elif position.get("ticker"):
+                if yahoo_symbol and monitor.to_yahoo_symbol(position["ticker"]) != yahoo_symbol:
+                    continue
+                price = quotes.get_stock_price(position["ticker"])
+                if price > 0:
+                    legs.append(monitor.scenario_leg(price, position['quantity'], cost=cost, underlying=position["ticker"]))
+        return legs
+    
+    def refresh_scenario_window(self):
+        """Recompute the scenario grid if its window is open (called on every recalculation and tick)."""
+        if self.scenario_window is None or not self.scenario_window.winfo_exists():
+            return
+        try:
+            started = time.perf_counter()
+            legs = self.scenario_legs()
+            r = float(self.bs_risk_free_rate_var.get())
+            self.scenario_result = monitor.run_scenario_matrix(legs, r=r)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.scenario_status_var.set(f"{len(legs)} legs, {self.scenario_result['pnl'].size} scenarios in {elapsed_ms:.0f}ms | "
+                                         f"Model value now: ${self.scenario_result['base_value']:,.2f} | "
+                                         f"Updated {datetime.now().strftime('%H:%M:%S')}")
+        except ValueError as e:
+            self.scenario_status_var.set(f"Error: {e}")
+            return
+        self.show_scenario_matrix()
+    
+    def show_scenario_matrix(self):
+        """Fill the matrix with the P&L slice for the selected days forward."""
+        result = self.scenario_result
+        if result is None or self.scenario_window is None or not self.scenario_window.winfo_exists():
+            return
+        for item in self.scenario_tree.get_children():
+            self.scenario_tree.delete(item)
+        days = list(result["days_forward"])
+        selected = float(self.scenario_days_var.get() or 0)
+        pnl = result["pnl"][days.index(selected) if selected in days else 0]
+        for s, spot_shift in enumerate(result["spot_shifts"]):
+            row = [f"{spot_shift:+.0%}"] + [f"{pnl[v, s]:,.0f}" for v in range(len(result["vol_shifts"]))]
+            self.scenario_tree.insert("", "end", values=row)
+    
+    def refresh_payoff_chart(self):
+        """Recompute the P&L profile of the BS legs (or the live positions on the BS ticker) and redraw it."""
+        try:
+            days_forward = [int(days) for days in self.payoff_days_var.get().replace(",", " ").split()]
+            if self.payoff_source_var.get() == "Live positions":
+                symbol = self.bs_yahoo_symbol() if self.bs_ticker_var.get().strip() else None
+                legs = self.live_position_legs(symbol, with_cost=True)
+            else:
+                legs = self.bs_scenario_legs()
+            r = float(self.bs_risk_free_rate_var.get())
+        except ValueError as e:
+            self.payoff_summary_var.set(f"Error: {e}")
+            return
+        if not legs:
+            self.payoff_canvas.delete("all")
+            self.payoff_summary_var.set("No legs to plot")
+            return
+        profile = monitor.payoff_profile(legs, days_forward=days_forward, r=r)
+        expiry_curve = profile["curves"][-1]
+        format_bound = lambda value: "unlimited" if math.isinf(value) else f"{'-' if value < 0 else ''}${abs(value):,.0f}"
+        breakeven_text = ", ".join(f"${price:.2f}" for price in expiry_curve["breakevens"]) or "none"
+        self.payoff_summary_var.set(f"At expiry: breakevens {breakeven_text} | max profit {format_bound(expiry_curve['max_profit'])} | "
+                                    f"max loss {format_bound(expiry_curve['max_loss'])}")
+        self.draw_payoff_chart(profile, legs)
+    
+    def draw_payoff_chart(self, profile, legs):
+        """Draw the profile's curves around the strikes and spot, with the zero line and expiry breakevens."""
+        canvas = self.payoff_canvas
+        canvas.delete("all")
+        width = max(canvas.winfo_width(), 400)
+        height = max(canvas.winfo_height(), 200)
+        margin_left, margin_right, margin_y = 70, 10, 20
+        
+        levels = [leg["S"] for leg in legs] + [leg["K"] for leg in legs if leg["option_type"] != "Stock"]
+        low, high = 0.8 * min(levels), 1.2 * max(levels)
+        spot = profile["spot"]
+        visible = (spot >= low) & (spot <= high)
+        x_values = spot[visible]
+        curves = [(curve, curve["pnl"][visible]) for curve in profile["curves"]]
+        y_low = min(0.0, min(float(pnl.min()) for _, pnl in curves))
+        y_high = max(0.0, max(float(pnl.max()) for _, pnl in curves))
+        y_span = (y_high - y_low) or 1.0
+        
+        to_x = lambda price: margin_left + (price - low) / (high - low) * (width - margin_left - margin_right)
+        to_y = lambda pnl: margin_y + (y_high - pnl) / y_span * (height - 2 * margin_y)
+        
+        canvas.create_line(margin_left, to_y(0), width - margin_right, to_y(0), fill="gray")
+        for value in (y_low, y_high):
+            canvas.create_text(margin_left - 5, to_y(value), text=f"{value:,.0f}", anchor="e", font=("Courier", 8))
+        for price in (low, legs[0]["S"], high):
+            canvas.create_text(to_x(price), height - 5, text=f"{price:.0f}", anchor="s", font=("Courier", 8))
+        
+        colors = ["#1f77b4", "#2ca02c", "#9467bd", "#ff7f0e", "#8c564b"]
+        for i, (curve, pnl) in enumerate(curves):
+            is_expiry = i == len(curves) - 1
+            color = "#d62728" if is_expiry else colors[i % len(colors)]
+            points = [coord for price, value in zip(x_values, pnl) for coord in (to_x(price), to_y(value))]
+            if len(points) >= 4:
+                canvas.create_line(*points, fill=color, width=2 if is_expiry else 1)
+            canvas.create_text(width - margin_right, margin_y + 12 * i, text=curve["label"], fill=color, anchor="ne",
+                               font=("Courier", 8))
+        for price in profile["curves"][-1]["breakevens"]:
+            if low <= price <= high:
+                canvas.create_oval(to_x(price) - 3, to_y(0) - 3, to_x(price) + 3, to_y(0) + 3, outline="#d62728")
+    
+    def export_scenario_matrix(self):
+        if self.scenario_result is None:
+            messagebox.showwarning("Warning", "No scenario results to export")
+            return
+        path = filedialog.asksaveasfilename(parent=self.scenario_window, defaultextension=".csv",
+                                            initialfile=f"scenarios_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                                            filetypes=[("CSV files", "*.csv")])
+        if path:
+            monitor.export_scenario_matrix(self.scenario_result, path)
+            messagebox.showinfo("Exported", f"Scenario matrix saved to {path}")
 
 def main():
     # Use ttkbootstrap's Window for modern theming
     app = tb.Window(themename="flatly")  # Change 'flatly' to any other theme for a different look
     gui = OptionsMonitorGUI(app)
-    app.mainloop()
+    monitor.opend.connect()  # start reaching FutuOpenD in the background while the window opens
+    try:
+        app.mainloop()
+    finally:
+        monitor.opend.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,356 @@
+import ast
+import json
+import os
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Functions a rule may call, by name. register_function() adds more without touching the engine.
+FUNCTIONS: Dict[str, Callable] = {
+    "abs": np.abs,
+    "min": np.minimum,
+    "max": np.maximum,
+    "sqrt": np.sqrt,
+}
+
+_BINARY_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+_COMPARE_OPS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+SCOPES = ("portfolio", "spread", "leg")   # the scopes build_metric_table fills each tick
+_SCALAR_SCOPES = {"portfolio"}   # one row, broadcast against the rule's row scope
+
+
+def register_function(name: str, function: Callable) -> None:
+    """Make `function` callable from rule expressions (it receives NumPy column arrays)."""
+    FUNCTIONS[name] = function
+
+
+def _column(scope: str, metric: str) -> str:
+    return f"{scope}__{metric}"
+
+
+class _Compiler(ast.NodeTransformer):
+    """
+    Checks a parsed expression against the small rule grammar and rewrites it for
+    vectorized evaluation: `scope.metric` becomes one flat column name, and/or/not
+    and chained comparisons become element-wise NumPy calls.
+    """
+
+    def __init__(self):
+        self.metrics = []   # (scope, metric) in order of first use
+
+    def generic_visit(self, node):
+        raise ValueError(f"unsupported syntax: {ast.dump(node)[:60]}")
+
+    def visit_Expression(self, node):
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_Attribute(self, node):
+        if not isinstance(node.value, ast.Name):
+            raise ValueError("metrics are written scope.metric, e.g. spread.price")
+        if node.value.id not in SCOPES:
+            # A typo like spred.price would otherwise never have rows, and the rule would never fire
+            raise ValueError(f"unknown scope '{node.value.id}' in {node.value.id}.{node.attr} (scopes: {', '.join(SCOPES)})")
+        key = (node.value.id, node.attr)
+        if key not in self.metrics:
+            self.metrics.append(key)
+        return ast.copy_location(ast.Name(id=_column(*key), ctx=ast.Load()), node)
+
+    def visit_Name(self, node):
+        if node.id in ("True", "False"):
+            return ast.copy_location(ast.Constant(value=node.id == "True"), node)
+        raise ValueError(f"unknown name '{node.id}' (metrics are written scope.metric)")
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float, str, bool)):
+            raise ValueError(f"unsupported constant {node.value!r}")
+        return node
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, _BINARY_OPS):
+            raise ValueError(f"unsupported operator {type(node.op).__name__}")
+        node.left, node.right = self.visit(node.left), self.visit(node.right)
+        return node
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        if isinstance(node.op, ast.Not):
+            return self._call("__not", [operand], node)
+        if isinstance(node.op, (ast.USub, ast.UAdd)):
+            node.operand = operand
+            return node
+        raise ValueError(f"unsupported operator {type(node.op).__name__}")
+
+    def visit_BoolOp(self, node):
+        function = "__and" if isinstance(node.op, ast.And) else "__or"
+        values = [self.visit(value) for value in node.values]
+        result = values[0]
+        for value in values[1:]:
+            result = self._call(function, [result, value], node)
+        return result
+
+    def visit_Compare(self, node):
+        # a < b < c -> (a < b) & (b < c), element-wise
+        operands = [self.visit(node.left)] + [self.visit(comparator) for comparator in node.comparators]
+        parts = []
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            if not isinstance(op, _COMPARE_OPS):
+                raise ValueError(f"unsupported comparison {type(op).__name__}")
+            parts.append(ast.copy_location(ast.Compare(left=left, ops=[op], comparators=[right]), node))
+        result = parts[0]
+        for part in parts[1:]:
+            result = self._call("__and", [result, part], node)
+        return result
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+            raise ValueError(f"unknown function in {ast.unparse(node)} (available: {', '.join(sorted(FUNCTIONS))})")
+        return self._call(node.func.id, [self.visit(arg) for arg in node.args], node)
+
+    @staticmethod
+    def _call(name, args, node):
+        return ast.copy_location(ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[]), node)
+
+
+class Rule:
+    """
+    One alert rule: a boolean expression over `scope.metric` values, e.g.
+    `spread.price > 8.5 and portfolio.delta < -200`. Parsed and compiled once.
+    A rule uses at most one row scope (spread, leg, ...) and is checked for every row
+    of it each tick; portfolio metrics are single values shared by every row.
+    `message` is a str.format template over the same names ("{spread.name} at {spread.price:.2f}").
+    `release` is an optional expression that must hold before a fired rule re-arms
+    (hysteresis, e.g. `spread.price < 8.3`); by default it re-arms as soon as it stops holding.
+    """
+
+    def __init__(self, name: str, expression: str, message: str = "", enabled: bool = True, release: str = "", **options):
+        self.name = name
+        self.expression = expression
+        self.message = message
+        self.enabled = enabled
+        self.release = release
+        self.options = options   # extra keys from the rules file, kept for the alert state (cooldown etc.)
+        self.code, self.metrics = self._compile(expression)
+        self.release_code, release_metrics = self._compile(release) if release else (None, [])
+        self.scopes = list(dict.fromkeys(scope for scope, _ in self.metrics + release_metrics))
+        row_scopes = [scope for scope in self.scopes if scope not in _SCALAR_SCOPES]
+        if len(row_scopes) > 1:
+            raise ValueError(f"rule mixes row scopes {row_scopes}; use one of them plus portfolio")
+        self.row_scope = row_scopes[0] if row_scopes else "portfolio"
+
+    def _compile(self, expression: str):
+        compiler = _Compiler()
+        tree = compiler.visit(ast.parse(expression, mode="eval"))
+        ast.fix_missing_locations(tree)
+        return compile(tree, f"<rule {self.name}>", "eval"), compiler.metrics
+
+    def to_dict(self) -> Dict[str, Any]:
+        entry = {"name": self.name, "expression": self.expression, "message": self.message, "enabled": self.enabled}
+        if self.release:
+            entry["release"] = self.release
+        return {**entry, **self.options}
+
+    def __repr__(self):
+        return f"Rule({self.name!r}, {self.expression!r})"
+
+
+class MetricTable:
+    """
+    One tick's metrics, column-wise per scope: {"spread": {"name": array, "price": array, ...}}.
+    Rows are labelled (spread name, leg number) so alerts can say which row matched.
+    """
+
+    def __init__(self):
+        self.columns: Dict[str, Dict[str, np.ndarray]] = {}
+        self.labels: Dict[str, List[Any]] = {}
+
+    def add_scope(self, scope: str, rows: Sequence[Dict[str, Any]], label_key: Optional[str] = None) -> None:
+        """Add a scope from row dicts; every key becomes a column (missing values are NaN)."""
+        keys = list(dict.fromkeys(key for row in rows for key in row))
+        columns = {}
+        for key in keys:
+            values = [row.get(key, np.nan) for row in rows]
+            if all(isinstance(value, (int, float, np.number)) and not isinstance(value, bool) for value in values):
+                columns[key] = np.array(values, dtype=np.float64)
+            else:
+                columns[key] = np.array(values, dtype=object)
+        self.columns[scope] = columns
+        self.labels[scope] = [row.get(label_key, i) if label_key else i for i, row in enumerate(rows)]
+
+    def rows(self, scope: str) -> int:
+        return len(self.labels.get(scope, ()))
+
+    def namespace(self) -> Dict[str, Any]:
+        """Flat column namespace the compiled rules are evaluated in."""
+        namespace = {"__builtins__": {}, "__and": np.logical_and, "__or": np.logical_or, "__not": np.logical_not}
+        namespace.update(FUNCTIONS)
+        for scope, columns in self.columns.items():
+            namespace.update((_column(scope, metric), values) for metric, values in columns.items())
+        return namespace
+
+    def row(self, scope: str, index: int) -> SimpleNamespace:
+        return SimpleNamespace(**{metric: _plain(values[index]) for metric, values in self.columns[scope].items()})
+
+
+def _plain(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class RuleSet:
+    """
+    The loaded rules. levels() runs every enabled rule once per tick against the
+    whole metric table (one NumPy evaluation per rule, not per row) and returns the
+    rows where each rule holds.
+    """
+
+    def __init__(self, rules: Iterable[Rule] = ()):
+        self.rules: List[Rule] = list(rules)
+        self.errors: Dict[str, str] = {}   # rule name -> load error or last evaluation error
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, rule: Rule) -> None:
+        self.rules = [existing for existing in self.rules if existing.name != rule.name] + [rule]
+
+    def remove(self, name: str) -> None:
+        self.rules = [rule for rule in self.rules if rule.name != name]
+
+    def levels(self, table: MetricTable) -> List[Tuple[Rule, np.ndarray, Optional[np.ndarray]]]:
+        """
+        (rule, holds, released) per enabled rule: boolean arrays over the rule's row scope
+        (released is None for rules without a release expression). Rules over a scope with
+        no rows this tick are skipped; a rule naming a missing metric is skipped and its
+        error kept in self.errors.
+        """
+        namespace = table.namespace()
+        rows = {scope: len(labels) for scope, labels in table.labels.items()}
+        errors = self.errors
+        levels = []
+        with np.errstate(all="ignore"):
+            for rule in self.rules:
+                if not rule.enabled or not all(rows.get(scope) for scope in rule.scopes):
+                    continue
+                shape = (rows.get(rule.row_scope, 1),)
+                try:
+                    holds = eval(rule.code, namespace)
+                    released = eval(rule.release_code, namespace) if rule.release_code is not None else None
+                except NameError as e:
+                    errors[rule.name] = f"unknown metric: {str(e).split(chr(39))[1].replace('__', '.', 1)}"
+                    continue
+                except Exception as e:
+                    errors[rule.name] = str(e)
+                    continue
+                if errors:
+                    errors.pop(rule.name, None)
+                holds = np.broadcast_to(np.asarray(holds, dtype=bool), shape)
+                if released is not None:
+                    released = np.broadcast_to(np.asarray(released, dtype=bool), shape)
+                levels.append((rule, holds, released))
+        return levels
+
+    def evaluate(self, table: MetricTable) -> List[Dict[str, Any]]:
+        """Returns [{"rule", "label", "row", "message", "values"}] for every (rule, row) where the rule holds this tick."""
+        rows_cache: Dict[Any, SimpleNamespace] = {}
+        matches = []
+        for rule, holds, _ in self.levels(table):
+            if holds.any():
+                matches.extend(self.match(rule, table, int(index), rows_cache) for index in np.flatnonzero(holds))
+        return matches
+
+    @staticmethod
+    def match(rule: Rule, table: MetricTable, index: int, rows_cache: Optional[Dict[Any, SimpleNamespace]] = None) -> Dict[str, Any]:
+        """The match dict for one rule and row; rows_cache shares row lookups between matches of one tick."""
+        rows_cache = {} if rows_cache is None else rows_cache
+        scopes = {}
+        for scope in rule.scopes:
+            key = (scope, index if scope == rule.row_scope else 0)
+            if key not in rows_cache:
+                rows_cache[key] = table.row(*key)
+            scopes[scope] = rows_cache[key]
+        values = {f"{scope}.{metric}": getattr(scopes[scope], metric) for scope, metric in rule.metrics}
+        label = table.labels[rule.row_scope][index]
+        try:
+            message = rule.message.format(**scopes) if rule.message else ""
+        except (AttributeError, KeyError, ValueError, IndexError) as e:
+            message = f"(message error: {e})"
+        if not message:
+            message = f"{rule.expression}: " + ", ".join(f"{name}={_format_value(value)}" for name, value in values.items())
+        return {"rule": rule, "label": label, "row": index, "message": message, "values": values}
+
+
+def _format_value(value):
+    return f"{value:,.4g}" if isinstance(value, float) else str(value)
+
+
+def load_rules(path: str) -> RuleSet:
+    """
+    Read rules from a JSON list of {"name", "expression", "message", "enabled", ...}.
+    Invalid rules are skipped and reported, also in the rule set's errors; a missing file
+    gives an empty rule set.
+    """
+    rules = RuleSet()
+    if not path or not os.path.exists(path):
+        return rules
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not read alert rules from {path}: {e}")
+        return rules
+    for i, entry in enumerate(entries):
+        name = entry.get("name", f"rule {i + 1}")
+        try:
+            rules.add(Rule(**{"name": name, **entry}))
+        except (TypeError, ValueError, SyntaxError) as e:
+            print(f"Skipping alert rule {name!r}: {e}")
+            rules.errors[name] = str(e)
+    return rules
+
+
+def save_rules(rules: RuleSet, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump([rule.to_dict() for rule in rules.rules], f, indent=2)
+
+
+def benchmark(n_rules: int = 500, n_spreads: int = 50, n_legs: int = 200, ticks: int = 200, seed: int = 9) -> Dict[str, float]:
+    """500 rules over portfolio, 50 spreads and 200 legs: compile once, then evaluate per tick."""
+    rng = np.random.default_rng(seed)
+    # Thresholds sit in the tails, so (as in live use) only a few rules hold on any tick
+    templates = [
+        "spread.price > {a:.2f} and portfolio.delta < {b:.0f}",
+        "abs(spread.delta) >= {c:.3f} or spread.vanna > {d:.4f}",
+        "leg.pnl_pct < -{e:.0f} and leg.days_to_expiry <= 7",
+        "portfolio.pnl < -{f:.0f} or portfolio.vega > {g:.0f}",
+        "{h:.1f} < leg.iv * 100 < {i:.2f} and not leg.quantity > 0",
+    ]
+    started = time.perf_counter()
+    rules = RuleSet(Rule(f"r{k}", templates[k % len(templates)].format(
+        a=rng.uniform(11, 12), b=rng.uniform(-900, -500), c=rng.uniform(0.995, 1.0), d=rng.uniform(0.03, 0.05),
+        e=rng.uniform(120, 160), f=rng.uniform(6000, 8000), g=rng.uniform(590, 600), h=rng.uniform(89.5, 89.9), i=rng.uniform(89.95, 90)))
+        for k in range(n_rules))
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    def table():
+        metrics = MetricTable()
+        metrics.add_scope("portfolio", [{"pnl": rng.normal(0, 2000), "delta": rng.normal(0, 300), "vega": rng.uniform(0, 600)}])
+        metrics.add_scope("spread", [{"name": f"S{j}", "price": rng.uniform(0, 12), "delta": rng.uniform(-1, 1),
+                                      "vanna": rng.normal(0, 0.01)} for j in range(n_spreads)], "name")
+        metrics.add_scope("leg", [{"leg": j, "pnl_pct": rng.normal(0, 40), "days_to_expiry": int(rng.integers(0, 60)),
+                                   "iv": rng.uniform(0.1, 0.9), "quantity": int(rng.integers(-5, 6))} for j in range(n_legs)], "leg")
+        return metrics
+
+    tables = [table() for _ in range(ticks)]
+    started = time.perf_counter()
+    fired = sum(len(rules.evaluate(metrics)) for metrics in tables)
+    evaluate_ms = (time.perf_counter() - started) / ticks * 1000
+    print(f"Alert rules: {n_rules} rules compiled in {compile_ms:.0f}ms; evaluated against {n_spreads} spreads and "
+          f"{n_legs} legs in {evaluate_ms:.2f}ms per tick ({fired / ticks:,.0f} matches per tick)")
+    return {"compile_ms": compile_ms, "evaluate_ms": evaluate_ms}
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+
+ARMED, FIRED, COOLDOWN = "armed", "fired", "cooldown"
+
+DEFAULT_COOLDOWN_SECONDS = 900.0   # after firing, an alert stays quiet this long even if it re-triggers
+DEFAULT_HYSTERESIS = 0.02          # threshold alerts release only once back past the threshold by 2% of it
+DEFAULT_MIN_BAND = 0.01            # ...and by at least this much, so a threshold of 0 still has a band
+
+
+class AlertStateMachine:
+    """
+    Per-alert state so alerts fire on edges instead of on every tick a level holds.
+
+    armed --condition--> fired (notify) --released--> cooling down --cooldown over--> armed
+    (straight back to armed if the cooldown already passed while it was firing).
+
+    A fired alert stays fired while its condition holds and while the value sits inside the
+    hysteresis band; an alert that re-triggers while cooling down is held until the cooldown
+    ends, then fires once. States are keyed by strings ("spread:IC:price_upper") and saved to
+    `path` on every transition, so a restart does not re-send alerts that already went out.
+    """
+
+    def __init__(self, path: Optional[str] = None, cooldown: float = DEFAULT_COOLDOWN_SECONDS,
+                 hysteresis: float = DEFAULT_HYSTERESIS, min_band: float = DEFAULT_MIN_BAND,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.cooldown = cooldown
+        self.hysteresis = hysteresis
+        self.min_band = min_band
+        self.clock = clock
+        self.states: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.states = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read alert states from {self.path}: {e}")
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(self.states, f, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Could not save alert states to {self.path}: {e}")
+
+    def state(self, key: str) -> str:
+        return self.states.get(key, {}).get("state", ARMED)
+
+    def update(self, key: str, active: bool, released: Optional[bool] = None, now: Optional[float] = None,
+               cooldown: Optional[float] = None) -> bool:
+        """
+        Advance one alert by a tick. `active`: the alert condition holds; `released`: the
+        condition has let go far enough to re-arm (default: not active). Returns True only
+        when the alert should notify.
+        """
+        now = self.clock() if now is None else now
+        cooldown = self.cooldown if cooldown is None else cooldown
+        released = not active if released is None else released
+        with self._lock:
+            entry = self.states.get(key)
+            if entry is None and not active:
+                return False
+            entry = dict(entry) if entry else {"state": ARMED, "fired_at": None, "fires": 0}
+            state = entry["state"]
+            if state == COOLDOWN and now - entry["fired_at"] >= cooldown:
+                state = ARMED
+            notify = False
+            if state == ARMED and active:
+                state = FIRED
+                entry["fired_at"] = now
+                entry["fires"] += 1
+                notify = True
+            elif state == FIRED and released:
+                state = ARMED if now - entry["fired_at"] >= cooldown else COOLDOWN
+            if state != entry["state"] or key not in self.states:
+                entry["state"] = state
+                entry["changed_at"] = now
+                self.states[key] = entry
+                self.save()
+            return notify
+
+    def update_threshold(self, key: str, value: float, threshold: Optional[float], direction: str = "above",
+                         hysteresis: Optional[float] = None, cooldown: Optional[float] = None,
+                         now: Optional[float] = None, min_band: Optional[float] = None) -> bool:
+        """
+        update() for "value >= threshold" (direction "above") or "value <= threshold" ("below")
+        alerts. The alert releases once the value is back past the threshold by
+        hysteresis x |threshold|, but never by less than min_band. A threshold of None
+        forgets the alert.
+        """
+        if threshold is None:
+            self.forget(key)
+            return False
+        band = max(abs(threshold) * (self.hysteresis if hysteresis is None else hysteresis),
+                   self.min_band if min_band is None else min_band)
+        if direction == "above":
+            active, released = value >= threshold, value < threshold - band
+        else:
+            active, released = value <= threshold, value > threshold + band
+        return self.update(key, active, released, now, cooldown)
+
+    def pending_keys(self, prefix: str = "") -> List[str]:
+        """Keys starting with prefix that are fired or cooling down (everything else is armed)."""
+        with self._lock:
+            return [key for key, entry in self.states.items() if key.startswith(prefix) and entry["state"] != ARMED]
+
+    def fired_at(self, key: str) -> Optional[float]:
+        return self.states.get(key, {}).get("fired_at")
+
+    def forget(self, key: str) -> None:
+        with self._lock:
+            if self.states.pop(key, None) is not None:
+                self.save()
+
+    def reset(self, prefix: str = "") -> int:
+        """Re-arm every alert whose key starts with prefix. Returns how many were reset."""
+        with self._lock:
+            keys = [key for key in self.states if key.startswith(prefix)]
+            for key in keys:
+                del self.states[key]
+            if keys:
+                self.save()
+            return len(keys)
+
+    def forget_labels(self, prefix: str, labels: Iterable[Any]) -> int:
+        """Forget every alert under prefix keyed on one of labels ("rule:IC wide:3" has label 3). Returns the count."""
+        suffixes = tuple(f":{label}" for label in labels)
+        with self._lock:
+            keys = [key for key in self.states if key.startswith(prefix) and key.endswith(suffixes)] if suffixes else []
+            for key in keys:
+                del self.states[key]
+            if keys:
+                self.save()
+            return len(keys)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {FIRED: 0, COOLDOWN: 0}
+            for entry in self.states.values():
+                if entry["state"] in counts:
+                    counts[entry["state"]] += 1
+            return counts
+
+
+def edge_indices(times: Sequence[float], active: Iterable[bool], released: Optional[Iterable[bool]] = None,
+                 cooldown: float = DEFAULT_COOLDOWN_SECONDS) -> List[int]:
+    """Indices of a level series (checked at `times`, in seconds) where an alert would notify."""
+    machine = AlertStateMachine(cooldown=cooldown)
+    released = [None] * len(times) if released is None else released
+    return [i for i, (now, is_active, is_released) in enumerate(zip(times, active, released))
+            if machine.update("alert", bool(is_active), None if is_released is None else bool(is_released), now=float(now))]
+
+
+def threshold_edge_indices(times: Sequence[float], values: Sequence[float], threshold: float, direction: str = "above",
+                           hysteresis: float = DEFAULT_HYSTERESIS, cooldown: float = DEFAULT_COOLDOWN_SECONDS,
+                           min_band: float = DEFAULT_MIN_BAND) -> List[int]:
+    """edge_indices for a threshold alert, with the same hysteresis band as update_threshold."""
+    machine = AlertStateMachine(cooldown=cooldown, hysteresis=hysteresis, min_band=min_band)
+    return [i for i, (now, value) in enumerate(zip(times, values))
+            if machine.update_threshold("alert", float(value), threshold, direction, now=float(now))]
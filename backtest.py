@@ -0,0 +1,409 @@
+import argparse
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import tick_capture
+from portfolio_aggregator import PortfolioAggregator, combined_summary
+from alert_state import DEFAULT_COOLDOWN_SECONDS, DEFAULT_HYSTERESIS, DEFAULT_MIN_BAND, threshold_edge_indices
+
+
+CONTRACT_MULTIPLIER = 100  # same as futu_options_monitor.CONTRACT_MULTIPLIER
+STATE_FILE = "ui_state.json"
+
+
+def load_book(state_file: str = STATE_FILE) -> Dict[str, Any]:
+    """Read positions, spreads and portfolio thresholds from the GUI's saved session."""
+    with open(state_file) as f:
+        data = json.load(f)
+    monitor = data.get("monitor", {})
+
+    def _threshold(key):
+        value = str(monitor.get(key, "")).strip()
+        return float(value) if value else None
+
+    return {
+        "positions": data.get("positions", []),
+        "spreads": data.get("spreads", []),
+        "thresholds": {
+            "pnl_upper": _threshold("pnl_upper_threshold"),
+            "pnl_lower": _threshold("pnl_lower_threshold"),
+            "delta_upper": _threshold("delta_upper_threshold"),
+            "delta_lower": _threshold("delta_lower_threshold"),
+        },
+    }
+
+
+def load_quotes(days: List[str], underlyings: Optional[List[str]] = None,
+                root: str = tick_capture.TICK_CAPTURE_DIR) -> pd.DataFrame:
+    """Load captured quotes for some days, reading only the given underlyings' rows (each chunk once)."""
+    parts = [tick_capture.load_ticks(day, underlyings or None, root=root) for day in days]
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.DataFrame(columns=list(tick_capture.COLUMNS))
+    return pd.concat(parts, ignore_index=True)
+
+
+OPTION_UNDERLYING_PATTERN = re.compile(r"^([A-Z]+\.[A-Z0-9]+?)\d{6}[CP]\d+$")
+
+
+def _underlying_of(position: Dict[str, Any]) -> str:
+    """Futu code of a leg's underlying ("US.AAPL250117C150000" -> "US.AAPL")."""
+    if position.get("position_type", "OPTION") == "OPTION":
+        match = OPTION_UNDERLYING_PATTERN.match(position["option_code"])
+        return match.group(1) if match else ""
+    return _leg_key(position)
+
+
+def _leg_key(position: Dict[str, Any]) -> str:
+    if position.get("position_type", "OPTION") == "OPTION":
+        return position["option_code"]
+    ticker = position["ticker"]
+    return ticker if "." in ticker else f"US.{ticker}"
+
+
+def _as_of(times: np.ndarray, values: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    """Value of a (sorted) quote series as of every grid time; NaN before its first quote."""
+    idx = np.searchsorted(times, grid, side="right") - 1
+    out = values[np.clip(idx, 0, None)] if len(values) else np.full(len(grid), np.nan)
+    return np.where(idx >= 0, out, np.nan)
+
+
+def build_leg_matrices(quotes: pd.DataFrame, positions: List[Dict[str, Any]],
+                       tick_seconds: float = 1.0) -> Dict[str, Any]:
+    """
+    Put every leg on one virtual clock: grid times are the captured timestamps rounded
+    up to tick_seconds (overnight gaps are skipped, not filled), and each leg's last quote
+    as of each grid time fills a (ticks x legs) matrix per field. Stock legs use the
+    underlying price captured with their options and a delta of 1.
+    """
+    timestamps = quotes["timestamp"].to_numpy(dtype=np.float64)
+    grid = np.unique(np.floor(timestamps / tick_seconds) * tick_seconds + tick_seconds)
+    fields = ("last_price", "delta", "gamma", "vega", "theta", "rho", "underlying_price")
+    matrices = {field: np.full((len(grid), len(positions)), np.nan) for field in fields}
+
+    by_code = {code: group for code, group in quotes.groupby("code", sort=False)}
+    by_underlying = {code: group for code, group in quotes.groupby("underlying", sort=False)}
+    for j, position in enumerate(positions):
+        key = _leg_key(position)
+        if position.get("position_type", "OPTION") == "OPTION":
+            rows = by_code.get(key)
+            if rows is None:
+                continue
+            rows = rows.sort_values("timestamp", kind="stable")
+            times = rows["timestamp"].to_numpy()
+            for field in fields:
+                matrices[field][:, j] = _as_of(times, rows[field].to_numpy(dtype=np.float64), grid)
+        else:
+            rows = by_underlying.get(key)
+            if rows is None:
+                continue
+            rows = rows.sort_values("timestamp", kind="stable")
+            price = _as_of(rows["timestamp"].to_numpy(), rows["underlying_price"].to_numpy(dtype=np.float64), grid)
+            matrices["last_price"][:, j] = price
+            matrices["underlying_price"][:, j] = price
+            matrices["delta"][:, j] = np.where(np.isnan(price), np.nan, 1.0)
+            for field in ("gamma", "vega", "theta", "rho"):
+                matrices[field][:, j] = np.where(np.isnan(price), np.nan, 0.0)
+    return {"grid": grid, **matrices}
+
+
+def run_backtest(quotes: pd.DataFrame, positions: List[Dict[str, Any]],
+                 spreads: Optional[List[Dict[str, Any]]] = None,
+                 thresholds: Optional[Dict[str, Optional[float]]] = None,
+                 tick_seconds: float = 1.0, check_interval: float = 0.0,
+                 alert_cooldown: Optional[float] = DEFAULT_COOLDOWN_SECONDS,
+                 alert_hysteresis: float = DEFAULT_HYSTERESIS,
+                 alert_min_band: float = DEFAULT_MIN_BAND) -> Dict[str, Any]:
+    """
+    Replay captured quotes through the monitor's P&L, summary, spread and threshold logic
+    on a virtual clock, vectorized over all ticks at once.
+
+    The formulas follow calculate_and_display_combined_summary, check_portfolio_thresholds
+    and calculate_spread_metrics / check_spread_thresholds; verify_against_monitor checks
+    them against the real functions. Alerts are evaluated every check_interval seconds of
+    virtual time (the monitor's update interval; 0 = every tick), starting once every leg
+    has a quote. Like the monitor's alert state, an alert is reported when it fires, not at
+    every check it holds (alert_cooldown / alert_hysteresis / alert_min_band as in alert_state.py;
+    per-spread "cooldown"/"hysteresis"/"min_band" keys override them); alert_cooldown=None
+    reports every check.
+    Returns {"series": per-tick DataFrame, "alerts": DataFrame, "summary": dict}.
+    """
+    spreads = spreads or []
+    thresholds = thresholds or {}
+    started = time.perf_counter()
+    legs = build_leg_matrices(quotes, positions, tick_seconds)
+    grid = legs["grid"]
+
+    quantity = np.array([float(p["quantity"]) for p in positions])
+    # Legs without an entry cost have no P&L and no initial value, as in leg_contribution
+    has_cost = np.array([p.get("entry_cost") is not None for p in positions])
+    entry_cost = np.array([float(p.get("entry_cost") or 0.0) for p in positions])
+    is_option = np.array([p.get("position_type", "OPTION") == "OPTION" for p in positions])
+    multiplier = np.where(is_option, CONTRACT_MULTIPLIER, 1)
+
+    # Only ticks where every leg has a quote: the monitor's summary needs all legs too
+    complete = ~np.isnan(legs["last_price"]).any(axis=1)
+    grid = grid[complete]
+    legs = {field: matrix[complete] for field, matrix in legs.items() if field != "grid"}
+
+    price = legs["last_price"]
+    leg_pnl = np.where(has_cost, (price - entry_cost) * quantity * multiplier, 0.0)
+    delta_weight = np.where(is_option, quantity * CONTRACT_MULTIPLIER, quantity)
+    underlying = legs["underlying_price"]
+    underlying_valid = np.where(underlying > 0, underlying, 0.0)
+    underlying_count = (underlying > 0).sum(axis=1)
+    initial_value = float((np.abs(quantity) * entry_cost * multiplier).sum())
+
+    series = pd.DataFrame({
+        "time": pd.to_datetime(grid, unit="s", utc=True),
+        "timestamp": grid,
+        "portfolio_pnl": leg_pnl.sum(axis=1),
+        "portfolio_market_value": (price * quantity * multiplier).sum(axis=1),
+        "total_net_delta": (legs["delta"] * delta_weight).sum(axis=1),
+        "total_net_gamma": (legs["gamma"] * quantity).sum(axis=1) * CONTRACT_MULTIPLIER,
+        "total_net_vega": (legs["vega"] * quantity).sum(axis=1) * CONTRACT_MULTIPLIER,
+        "total_net_theta": (legs["theta"] * quantity).sum(axis=1) * CONTRACT_MULTIPLIER,
+        "total_net_rho": (legs["rho"] * quantity).sum(axis=1) * CONTRACT_MULTIPLIER,
+        "avg_underlying": np.divide(underlying_valid.sum(axis=1), underlying_count,
+                                    out=np.zeros(len(grid)), where=underlying_count > 0),
+    })
+    series["pnl_pct"] = series["portfolio_pnl"] / initial_value * 100 if initial_value > 0 else np.nan
+
+    leg_index = {p["leg_number"]: j for j, p in enumerate(positions)}
+    spread_values = {}
+    for spread in spreads:
+        columns = [leg_index.get(leg) for leg in spread["legs"]]
+        if None in columns or not all(is_option[j] for j in columns):
+            print(f"Skipping spread '{spread['name']}': legs missing from the book")
+            continue
+        sign = np.sign(quantity[columns])
+        spread_values[spread["name"]] = (price[:, columns] @ sign, legs["delta"][:, columns] @ sign)
+        series[f"spread:{spread['name']}:price"] = spread_values[spread["name"]][0]
+        series[f"spread:{spread['name']}:delta"] = spread_values[spread["name"]][1]
+
+    # Virtual-clock alert checks: the first tick, then every check_interval seconds
+    if check_interval > 0 and len(grid):
+        slots = np.floor((grid - grid[0]) / check_interval)
+        checks = np.flatnonzero(np.r_[True, slots[1:] != slots[:-1]])
+    else:
+        checks = np.arange(len(grid))
+    edges = None if alert_cooldown is None else {"cooldown": alert_cooldown, "hysteresis": alert_hysteresis,
+                                                 "min_band": alert_min_band}
+    alerts = _portfolio_alerts(series, checks, thresholds, edges)
+    for spread in spreads:
+        if spread["name"] in spread_values:
+            spread_edges = edges and {key: spread[key] if spread.get(key) is not None else value for key, value in edges.items()}
+            alerts.extend(_spread_alerts(series, checks, spread, *spread_values[spread["name"]], spread_edges))
+    alerts_df = pd.DataFrame(alerts, columns=["time", "alert_type", "name", "value", "threshold", "message"])
+    alerts_df = alerts_df.sort_values("time", kind="stable").reset_index(drop=True)
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "ticks": len(grid), "legs": len(positions), "checks": len(checks), "alerts": len(alerts_df),
+        "start": series["time"].iloc[0] if len(series) else None,
+        "end": series["time"].iloc[-1] if len(series) else None,
+        "final_pnl": float(series["portfolio_pnl"].iloc[-1]) if len(series) else 0.0,
+        "min_pnl": float(series["portfolio_pnl"].min()) if len(series) else 0.0,
+        "max_pnl": float(series["portfolio_pnl"].max()) if len(series) else 0.0,
+        "alerts_by_type": alerts_df["alert_type"].value_counts().to_dict(),
+        "elapsed_seconds": elapsed,
+    }
+    return {"series": series, "alerts": alerts_df, "summary": summary}
+
+
+def _fired(times: np.ndarray, values: np.ndarray, threshold: float, direction: str,
+           edges: Optional[Dict[str, float]]) -> np.ndarray:
+    """Check indices that raise an alert: every check the level holds, or only where the alert state fires."""
+    if edges is None:
+        compare = np.greater_equal if direction == "above" else np.less_equal
+        return np.flatnonzero(compare(values, threshold))
+    return np.array(threshold_edge_indices(times, values, threshold, direction, **edges), dtype=np.intp)
+
+
+def _portfolio_alerts(series: pd.DataFrame, checks: np.ndarray, thresholds: Dict[str, Optional[float]],
+                      edges: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    """Alerts check_portfolio_thresholds would raise at the check ticks."""
+    alerts = []
+    checked = series.iloc[checks]
+    times = checked["timestamp"].to_numpy()
+    rules = [
+        ("portfolio_pnl_upper", "pnl_pct", thresholds.get("pnl_upper"), "above"),
+        ("portfolio_pnl_lower", "pnl_pct", thresholds.get("pnl_lower"), "below"),
+        ("portfolio_delta_upper", "total_net_delta", thresholds.get("delta_upper"), "above"),
+        ("portfolio_delta_lower", "total_net_delta", thresholds.get("delta_lower"), "below"),
+    ]
+    for alert_type, column, threshold, direction in rules:
+        if threshold is None:
+            continue
+        fired = checked.iloc[_fired(times, checked[column].to_numpy(), threshold, direction, edges)]
+        for row in fired.itertuples(index=False):
+            value = getattr(row, column)
+            if column == "pnl_pct":
+                message = f"Portfolio P&L reached {value:.1f}% (${row.portfolio_pnl:,.2f})"
+            else:
+                message = f"Portfolio delta ({value:,.2f}) crossed threshold {threshold}"
+            alerts.append({"time": row.time, "alert_type": alert_type, "name": "portfolio",
+                           "value": value, "threshold": threshold, "message": message})
+    return alerts
+
+
+def _spread_alerts(series: pd.DataFrame, checks: np.ndarray, spread: Dict[str, Any],
+                   spread_price: np.ndarray, spread_delta: np.ndarray,
+                   edges: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    """Alerts check_spread_thresholds would raise at the check ticks."""
+    alerts = []
+    times = series["time"].to_numpy()[checks]
+    seconds = series["timestamp"].to_numpy()[checks]
+    price = spread_price[checks]
+    delta = spread_delta[checks]
+    # The monitor compares against the delta seen at the previous check (0 before the first)
+    delta_change = np.abs(delta - np.r_[0.0, delta[:-1]])
+    rules = [
+        ("spread_price_upper", np.abs(price), spread.get("target_price_upper"), "above"),
+        ("spread_price_lower", np.abs(price), spread.get("target_price_lower"), "below"),
+        ("spread_delta_change", delta_change, spread.get("delta_threshold"), "above"),
+    ]
+    for alert_type, values, threshold, direction in rules:
+        if threshold is None:
+            continue
+        for i in _fired(seconds, values, threshold, direction, edges):
+            label = "Debit" if price[i] > 0 else "Credit"
+            if alert_type == "spread_delta_change":
+                message = f"Delta change: {values[i]:.1f} (threshold: {threshold:.1f})"
+            else:
+                message = f"Price ${values[i]:.3f} {label} per spread vs target ${threshold:.3f}"
+            alerts.append({"time": pd.Timestamp(times[i]), "alert_type": alert_type, "name": spread["name"],
+                           "value": float(values[i]), "threshold": threshold, "message": message})
+    return alerts
+
+
+def verify_against_monitor(quotes: pd.DataFrame, positions: List[Dict[str, Any]],
+                           report: Dict[str, Any], samples: int = 5, tick_seconds: float = 1.0) -> float:
+    """
+    Recompute a few ticks with the monitor's PortfolioAggregator (the
+    calculate_and_display_combined_summary math) and return the largest absolute
+    difference in P&L or total delta versus the backtest. Like the GUI, the first sample
+    adds every leg and later samples re-price only the codes whose quotes moved.
+    """
+    legs = build_leg_matrices(quotes, positions, tick_seconds)
+    series = report["series"]
+    fields = ("delta", "gamma", "vega", "theta", "rho", "last_price", "underlying_price")
+    aggregator = PortfolioAggregator(CONTRACT_MULTIPLIER)
+    worst, previous = 0.0, None
+    for k in np.linspace(0, len(series) - 1, min(samples, len(series))).astype(int):
+        i = int(np.searchsorted(legs["grid"], series["timestamp"].iloc[k]))
+        positions_data = []
+        for j, position in enumerate(positions):
+            greeks = {field: float(legs[field][i, j]) for field in ("delta", "gamma", "vega", "theta", "rho")}
+            greeks["current_option_price"] = float(legs["last_price"][i, j])
+            greeks["underlying_price"] = float(legs["underlying_price"][i, j])
+            if position.get("position_type", "OPTION") == "OPTION":
+                greeks["option_code"] = position["option_code"]
+            else:
+                greeks["ticker"] = position["ticker"]
+            positions_data.append({"leg_number": position["leg_number"], "greeks_data": greeks,
+                                   "quantity": position["quantity"], "entry_cost": position.get("entry_cost")})
+        if previous is None:
+            summary = combined_summary(positions_data, aggregator)
+        else:
+            moved = np.flatnonzero(np.any([legs[field][i] != legs[field][previous] for field in fields], axis=0))
+            by_code = {}
+            for j in moved:
+                greeks = positions_data[j]["greeks_data"]
+                by_code[greeks.get("option_code") or greeks["ticker"]] = greeks
+            aggregator.update_codes(by_code, by_code.get)
+            summary = aggregator.summary()
+        previous = i
+        worst = max(worst, abs(summary["portfolio_pnl"] - series["portfolio_pnl"].iloc[k]),
+                    abs(summary["total_net_delta"] - series["total_net_delta"].iloc[k]))
+    return worst
+
+
+def print_report(report: Dict[str, Any], max_alerts: int = 20) -> None:
+    summary = report["summary"]
+    print("\n--- Backtest Summary ---")
+    print(f"  Period: {summary['start']} to {summary['end']}")
+    print(f"  Ticks: {summary['ticks']:,} x {summary['legs']} legs, alert checks: {summary['checks']:,}")
+    print(f"  P&L: final ${summary['final_pnl']:,.2f}, min ${summary['min_pnl']:,.2f}, max ${summary['max_pnl']:,.2f}")
+    print(f"  Alerts fired: {summary['alerts']:,} {summary['alerts_by_type']}")
+    print(f"  Elapsed: {summary['elapsed_seconds']:.2f}s")
+    alerts = report["alerts"]
+    if len(alerts):
+        print(f"\n--- First {min(max_alerts, len(alerts))} Alerts ---")
+        for row in alerts.head(max_alerts).itertuples(index=False):
+            print(f"  {row.time:%Y-%m-%d %H:%M:%S} {row.alert_type} [{row.name}] {row.message}")
+
+
+def synthetic_day(n_legs: int = 50, n_ticks: int = 23400, seed: int = 0, start: float = 1.7e9):
+    """
+    A trading day of 1-second quotes for n_legs options on 5 underlyings, plus a matching
+    book. Every seventh leg has no entry cost, so verify_against_monitor covers that case.
+    """
+    rng = np.random.default_rng(seed)
+    underlyings = [f"US.SYN{k}" for k in range(5)]
+    times = start + np.arange(n_ticks, dtype=np.float64)
+    spot = 100 * np.exp(np.cumsum(rng.normal(0, 0.0002, (n_ticks, len(underlyings))), axis=0))
+    frames, positions = [], []
+    for leg in range(n_legs):
+        u = leg % len(underlyings)
+        strike = 90 + 5 * (leg // len(underlyings))
+        moneyness = spot[:, u] - strike
+        last_price = np.maximum(moneyness, 0) + 2.0 + rng.normal(0, 0.01, n_ticks)
+        delta = 1 / (1 + np.exp(-moneyness / 5))
+        frames.append(pd.DataFrame({
+            "code": f"{underlyings[u]}261218C{strike * 1000}", "underlying": underlyings[u],
+            "timestamp": times, "last_price": last_price, "implied_volatility": 0.3,
+            "delta": delta, "gamma": 0.02, "vega": 0.1, "theta": -0.05, "rho": 0.02,
+            "underlying_price": spot[:, u]}))
+        positions.append({"position_type": "OPTION", "option_code": f"{underlyings[u]}261218C{strike * 1000}",
+                          "quantity": 1 if leg % 2 == 0 else -1,
+                          "entry_cost": None if leg % 7 == 6 else float(last_price[0]),
+                          "leg_number": leg + 1})
+    spreads = [{"name": f"Spread {k}", "legs": [k + 1, k + 2], "target_price_upper": 15.0,
+                "target_price_lower": 0.5, "delta_threshold": 0.2} for k in range(0, 10, 2)]
+    thresholds = {"pnl_upper": 5.0, "pnl_lower": -5.0, "delta_upper": 300.0, "delta_lower": -300.0}
+    return pd.concat(frames, ignore_index=True), positions, spreads, thresholds
+
+
+def benchmark(n_legs: int = 50, n_ticks: int = 23400) -> Dict[str, Any]:
+    """Backtest a synthetic full day of 1-second ticks for an n_legs book and time it."""
+    quotes, positions, spreads, thresholds = synthetic_day(n_legs, n_ticks)
+    report = run_backtest(quotes, positions, spreads, thresholds, check_interval=15)
+    worst = verify_against_monitor(quotes, positions, report)
+    print(f"Backtest benchmark: {n_ticks:,} ticks x {n_legs} legs ({len(quotes):,} quotes) in "
+          f"{report['summary']['elapsed_seconds']:.2f}s; {report['summary']['alerts']:,} alerts; "
+          f"max difference vs monitor summary {worst:.2e}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured quotes through the monitor's P&L and alert logic.")
+    parser.add_argument("days", nargs="*", help="captured days (YYYY-MM-DD); default: all")
+    parser.add_argument("--root", default=tick_capture.TICK_CAPTURE_DIR, help="tick capture directory")
+    parser.add_argument("--state", default=STATE_FILE, help="saved GUI session with positions, spreads and thresholds")
+    parser.add_argument("--tick", type=float, default=1.0, help="virtual clock step in seconds")
+    parser.add_argument("--interval", type=float, default=15.0, help="monitor update interval for alert checks (seconds)")
+    parser.add_argument("--cooldown", type=float, default=DEFAULT_COOLDOWN_SECONDS, help="alert cooldown in seconds")
+    parser.add_argument("--level-alerts", action="store_true", help="report every check an alert holds, not just when it fires")
+    parser.add_argument("--out", help="write the P&L/greeks series and alerts to <out>_series.csv and <out>_alerts.csv")
+    parser.add_argument("--benchmark", action="store_true", help="run the synthetic 50-leg full-day benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+    else:
+        book = load_book(args.state)
+        days = args.days or tick_capture.list_days(args.root)
+        underlyings = sorted({_underlying_of(p) for p in book["positions"]} - {""})
+        report = run_backtest(load_quotes(days, underlyings, root=args.root), book["positions"], book["spreads"],
+                              book["thresholds"], args.tick, args.interval,
+                              alert_cooldown=None if args.level_alerts else args.cooldown)
+        print_report(report)
+        if args.out:
+            report["series"].to_csv(f"{args.out}_series.csv", index=False)
+            report["alerts"].to_csv(f"{args.out}_alerts.csv", index=False)
@@ -14,16 +14,32 @@
 # ----------------------------------------------------
 
 import time
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timezone, timedelta
 import yfinance as yf
 import math # For Black-Scholes calculations
-from telegram import Bot
-from telegram.error import TelegramError
-import asyncio
+import random
+import re
 import json
 from pathlib import Path
 import os
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict
+import atexit
+from tick_capture import TickRecorder
+from vol_surface import VolSurfaceCache
+import var_engine
+from portfolio_aggregator import (PortfolioAggregator, FIELDS as AGGREGATE_FIELDS, leg_inputs, leg_contribution, combined_summary,
+                                  leg_key)
+from alert_rules import MetricTable, Rule, RuleSet, load_rules
+from alert_state import AlertStateMachine
+from notifier import TelegramNotifier
+from bs_engine import (norm_cdf, bs_price, bs_greeks_scalar, GreeksCache, scenario_pnl, payoff_curves, breakevens,
+                       american_price, american_price_greeks, SECOND_ORDER_GREEKS,
+                       implied_volatility as bs_implied_volatility)
 
 # --- Configuration ---
 CONTRACT_MULTIPLIER = 100 
@@ -36,6 +52,15 @@ ENABLE_TELEGRAM = os.getenv("ENABLE_TELEGRAM", "false").lower() in ("1", "true",
 if ENABLE_TELEGRAM and (not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID):
     print("Telegram enabled but BOT token or CHAT ID missing; disabling notifications.")
     ENABLE_TELEGRAM = False
+# Alerts go out from a background worker (see notifier.py): alerts raised within
+# TELEGRAM_COALESCE_SECONDS are sent as one message, at most one message per
+# TELEGRAM_MIN_INTERVAL seconds, with retry/backoff. TELEGRAM_API_URL points the bot
+# at another Bot API endpoint, e.g. a local notifier.FakeTelegramServer for testing.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+TELEGRAM_QUEUE_SIZE = int(os.getenv("TELEGRAM_QUEUE_SIZE", "1000"))
+TELEGRAM_COALESCE_SECONDS = float(os.getenv("TELEGRAM_COALESCE_SECONDS", "0.5"))
+TELEGRAM_MIN_INTERVAL = float(os.getenv("TELEGRAM_MIN_INTERVAL", "1.0"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "5"))
 
 # Data saving configuration
 ALERTS_DIR = "alerts_history"
@@ -49,6 +74,74 @@ DEFAULT_SPREAD_TARGET_PRICE_UPPER = None  # Default upper target price (None = n
 DEFAULT_SPREAD_TARGET_PRICE_LOWER = None  # Default lower target price (None = no limit)
 DEFAULT_SPREAD_DELTA_THRESHOLD = 10   # Default spread delta threshold
 
+# Underlying price cache: seconds a Yahoo price is reused before refetching, per market
+UNDERLYING_PRICE_TTL = {
+    "US": float(os.getenv("UNDERLYING_TTL_US", "30")),
+    "HK": float(os.getenv("UNDERLYING_TTL_HK", "30")),
+}
+UNDERLYING_CACHE_MAX_ENTRIES = int(os.getenv("UNDERLYING_CACHE_MAX_ENTRIES", "256"))
+
+# Futu accepts at most 400 codes per get_market_snapshot call
+SNAPSHOT_MAX_CODES_PER_CALL = int(os.getenv("FUTU_SNAPSHOT_MAX_CODES", "400"))
+# ...and at most 60 snapshot calls per rolling 30 seconds
+SNAPSHOT_CALLS_PER_WINDOW = int(os.getenv("FUTU_SNAPSHOT_CALLS_PER_WINDOW", "60"))
+SNAPSHOT_WINDOW_SECONDS = float(os.getenv("FUTU_SNAPSHOT_WINDOW_SECONDS", "30"))
+
+# Option chains: seconds a loaded chain is reused, default expiry window, and Futu's limits
+# on get_option_chain (10 calls per 30 s, at most 30 days of expiries per call)
+OPTION_CHAIN_TTL = float(os.getenv("OPTION_CHAIN_TTL", "300"))
+OPTION_CHAIN_DEFAULT_DAYS = int(os.getenv("OPTION_CHAIN_DEFAULT_DAYS", "60"))
+OPTION_CHAIN_CALLS_PER_WINDOW = 10
+OPTION_CHAIN_MAX_DAYS_PER_CALL = 30
+
+# Greeks cache shared by the monitor's theoretical pricing and the BS calculator: legs whose
+# inputs moved less than these tolerances are not repriced (spot relative, vol absolute, time in minutes)
+GREEKS_CACHE_MAX_ENTRIES = int(os.getenv("GREEKS_CACHE_MAX_ENTRIES", "4096"))
+GREEKS_CACHE_SPOT_TOLERANCE = float(os.getenv("GREEKS_CACHE_SPOT_TOLERANCE", "0.0001"))
+GREEKS_CACHE_VOL_TOLERANCE = float(os.getenv("GREEKS_CACHE_VOL_TOLERANCE", "0.0001"))
+GREEKS_CACHE_TIME_TOLERANCE_MINUTES = float(os.getenv("GREEKS_CACHE_TIME_TOLERANCE_MINUTES", "1"))
+
+# American pricing: markets whose stock options are American-style (HK) are priced on a binomial
+# tree instead of Black-Scholes, with optional continuous dividend yields per underlying
+AMERICAN_PRICING_MARKETS = {market.strip().upper() for market in os.getenv("AMERICAN_PRICING_MARKETS", "HK").split(",") if market.strip()}
+AMERICAN_TREE_STEPS = int(os.getenv("AMERICAN_TREE_STEPS", "200"))
+# e.g. DIVIDEND_YIELDS="HK.00005=0.06,HK.00700=0.01"
+DIVIDEND_YIELDS = {code.strip().upper(): float(value) for code, _, value in
+                   (item.partition("=") for item in os.getenv("DIVIDEND_YIELDS", "").split(",") if "=" in item)}
+
+# Scenario risk matrix: spot shifts (relative) x volatility shifts (relative) x days forward
+SCENARIO_SPOT_SHIFTS = [round(-0.20 + 0.01 * i, 2) for i in range(41)]   # -20% .. +20%
+SCENARIO_VOL_SHIFTS = [round(-0.50 + 0.10 * i, 2) for i in range(11)]    # -50% .. +50%
+SCENARIO_DAYS_FORWARD = [0, 1, 7, 14, 30]
+
+# Monte Carlo VaR / expected shortfall of the live positions (shown on the Monitor tab).
+# Underlyings move as correlated GBM at their legs' average IV (stock-only underlyings use the fallback)
+VAR_PATHS = int(os.getenv("VAR_PATHS", "100000"))
+VAR_HORIZON_DAYS = float(os.getenv("VAR_HORIZON_DAYS", "1"))
+VAR_CORRELATION = float(os.getenv("VAR_CORRELATION", "0.5"))  # between every pair of underlyings
+VAR_FALLBACK_VOL = float(os.getenv("VAR_FALLBACK_VOL", "0.30"))
+VAR_WORKERS = int(os.getenv("VAR_WORKERS", "0"))  # processes; 0 = one per CPU
+VAR_INTERVAL_SECONDS = float(os.getenv("VAR_INTERVAL_SECONDS", "300"))  # re-run VaR for an unchanged book at most this often
+VAR_SPOT_MOVE = float(os.getenv("VAR_SPOT_MOVE", "0.005"))  # ...or sooner once an underlying moves this much (0.5%)
+
+# Payoff / P&L curves: dates (days from today) drawn besides expiry, and underlying grid density
+PAYOFF_DAYS_FORWARD = [0, 7]
+PAYOFF_GRID_POINTS = 2001
+
+# Alert rules: expressions over portfolio, spread and leg metrics (see alert_rules.py), e.g.
+# [{"name": "IC wide", "expression": "spread.price > 8.5 and portfolio.delta < -200"}]
+ALERT_RULES_FILE = os.getenv("ALERT_RULES_FILE", "alert_rules.json")
+
+# Alert state (see alert_state.py): alerts notify once when they trigger, not on every tick.
+# A fired alert re-arms once its value is back past the threshold by ALERT_HYSTERESIS x threshold
+# (at least ALERT_MIN_BAND, so a threshold of 0 does not chatter), and stays quiet for
+# ALERT_COOLDOWN_SECONDS after firing. Per-spread "cooldown"/"hysteresis"/"min_band" keys and
+# per-rule "cooldown" keys override these. States survive restarts in ALERT_STATE_FILE.
+ALERT_STATE_FILE = os.getenv("ALERT_STATE_FILE", "alert_state.json")
+ALERT_COOLDOWN_SECONDS = float(os.getenv("ALERT_COOLDOWN_SECONDS", "900"))
+ALERT_HYSTERESIS = float(os.getenv("ALERT_HYSTERESIS", "0.02"))
+ALERT_MIN_BAND = float(os.getenv("ALERT_MIN_BAND", "0.01"))
+
 # Track previous values for change detection
 previous_values = {
     'total_pnl': 0,
@@ -56,9 +149,27 @@ previous_values = {
     'spreads': {}  # Will store previous values for each spread
 }
 
+# Market data provider: "live" (Futu + Yahoo), "replay" (a recorded file) or "synthetic"
+MARKET_DATA_PROVIDER = os.getenv("MARKET_DATA_PROVIDER", "live").lower()
+MARKET_DATA_REPLAY_FILE = os.getenv("MARKET_DATA_REPLAY_FILE", "")
+MARKET_DATA_RECORD_FILE = os.getenv("MARKET_DATA_RECORD_FILE", "")  # record live quotes for later replay
+SYNTHETIC_SEED = int(os.getenv("SYNTHETIC_SEED", "0"))
+
+# Tick capture: directory for the columnar quote recorder (empty disables capture)
+TICK_CAPTURE_DIR = os.getenv("TICK_CAPTURE_DIR", "")
+
 # --- Futu API Connection ---
+HOST = os.getenv('FUTU_HOST', '127.0.0.1')
+PORT = int(os.getenv('FUTU_PORT', '11111'))
+OPEND_HEALTH_CHECK_SECONDS = float(os.getenv("OPEND_HEALTH_CHECK_SECONDS", "30"))
+OPEND_RECONNECT_BACKOFF_INITIAL = 2.0   # seconds a new context gets before it may be replaced
+OPEND_RECONNECT_BACKOFF_MAX = 60.0      # cap for the exponential backoff
+OPEND_HEALTH_CHECK_TIMEOUT = float(os.getenv("OPEND_HEALTH_CHECK_TIMEOUT", "5"))  # seconds to wait for get_global_state
+
+FUTU_AVAILABLE = False
 try:
     from futu import *
+    FUTU_AVAILABLE = True
     if 'RET_OK' not in globals():
         RET_OK = 0
     # Ensure OptionType exists even if partially imported
@@ -68,27 +179,19 @@ try:
         class OptionType:  # type: ignore
             CALL = 1
             PUT = 2
-
-    HOST = os.getenv('FUTU_HOST', '127.0.0.1')
-    PORT = int(os.getenv('FUTU_PORT', '11111'))
     try:
-        quote_ctx = OpenQuoteContext(host=HOST, port=PORT)
-        if quote_ctx:
-            print(f"Successfully connected to FutuOpenD at {HOST}:{PORT}")
-        else:
-            print(f"Failed to connect to FutuOpenD at {HOST}:{PORT}. Continuing without live quotes.")
-            quote_ctx = None
-    except Exception as e:
-        print(f"Failed to initialize Futu OpenQuoteContext: {e}")
-        print("Continuing without live quotes. Some features will be limited.")
-        quote_ctx = None
+        _ = SubType.QUOTE
+    except (NameError, AttributeError):
+        class SubType:  # type: ignore
+            QUOTE = "QUOTE"
 except ImportError:
     print("Futu API library not found. Continuing without live quotes. To enable: pip install futu-api")
     RET_OK = 0
     class OptionType:  # type: ignore
         CALL = 1
         PUT = 2
-    quote_ctx = None
+    class SubType:  # type: ignore
+        QUOTE = "QUOTE"
 except Exception as e:
     print(f"Unexpected error during Futu setup: {e}")
     print("Continuing without live quotes. Some features will be limited.")
@@ -97,12 +200,306 @@ except Exception as e:
         class OptionType:  # type: ignore
             CALL = 1
             PUT = 2
-    quote_ctx = None
+    if 'SubType' not in globals():
+        class SubType:  # type: ignore
+            QUOTE = "QUOTE"
+
+class OpenDConnection:
+    """
+    Owns the Futu quote context so a long-running monitor survives OpenD restarts.
+    The context connects asynchronously on first use (nothing blocks waiting for OpenD);
+    health checks run every OPEND_HEALTH_CHECK_SECONDS and after failed requests, a dead
+    context is replaced with exponential backoff, and push handlers and subscriptions are
+    replayed on every new connection. It can be passed anywhere a quote context is expected
+    for snapshots and push subscriptions (e.g. QuoteStream).
+
+    The lock only guards this object's state: no call that can block on OpenD (health probe,
+    subscribe, close) is made while holding it.
+    """
+
+    def __init__(self, host=HOST, port=PORT, context_factory=None,
+                 health_check_seconds=OPEND_HEALTH_CHECK_SECONDS,
+                 backoff_initial=OPEND_RECONNECT_BACKOFF_INITIAL,
+                 backoff_max=OPEND_RECONNECT_BACKOFF_MAX,
+                 health_check_timeout=OPEND_HEALTH_CHECK_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.context_factory = context_factory
+        self.health_check_seconds = health_check_seconds
+        self.health_check_timeout = health_check_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.quote_ctx = None
+        self.state = "disconnected" if context_factory else "unavailable"
+        self.reconnect_count = 0
+        self.last_error = None
+        self.handlers = {}  # handler class name -> handler (a context keeps one handler per kind)
+        self.subscriptions = {}  # code -> set of subtypes
+        self._next_retry_at = 0.0
+        self._retry_attempts = 0  # reconnects since the last healthy check; drives the backoff
+        self._last_check_at = 0.0
+        self._needs_replay = False
+        self._conn_id = None
+        self._lock = threading.RLock()
+        self._probe_lock = threading.Lock()  # one health probe at a time
+        self._probe_thread = None
+        self._stop = threading.Event()
+        self._health_thread = None
+
+    @property
+    def available(self):
+        return self.context_factory is not None
+
+    def connect(self):
+        """Create a fresh quote context (closing any previous one) and start health checks."""
+        if not self.available:
+            return None
+        with self._lock:
+            if self.state == "closed":
+                return None
+            old_ctx, self.quote_ctx = self.quote_ctx, None
+            try:
+                # is_async_connect: the constructor returns at once, OpenD is reached in the background
+                self.quote_ctx = self.context_factory()
+                for handler in self.handlers.values():
+                    self.quote_ctx.set_handler(handler)
+                self.state = "connecting"
+                self._needs_replay = True
+                self._conn_id = None
+                print(f"Connecting to FutuOpenD at {self.host}:{self.port}...")
+            except Exception as e:
+                self.quote_ctx = None
+                self.state = "disconnected"
+                self.last_error = str(e)
+                print(f"Failed to initialize Futu OpenQuoteContext: {e}")
+            self._last_check_at = 0.0
+            # Give the new context until the backoff delay passes before it may be replaced
+            delay = min(self.backoff_max, self.backoff_initial * 2 ** self._retry_attempts)
+            self._next_retry_at = time.time() + delay
+            quote_ctx = self.quote_ctx
+        self._close_context(old_ctx)
+        self._start_health_thread()
+        return quote_ctx
+
+    @staticmethod
+    def _close_context(quote_ctx):
+        if quote_ctx is not None:
+            try:
+                quote_ctx.close()
+            except Exception as e:
+                print(f"Error closing Futu quote context: {e}")
+
+    def _start_health_thread(self):
+        with self._lock:
+            if self._health_thread is not None or self.health_check_seconds <= 0:
+                return
+            def run():
+                while not self._stop.wait(min(self.health_check_seconds, 5.0)):
+                    self.ensure_connected()
+            self._health_thread = threading.Thread(target=run, name="opend-health", daemon=True)
+            self._health_thread.start()
+
+    def health_check(self):
+        """
+        True if the context is ready and answers get_global_state within
+        health_check_timeout seconds. A context that is not READY (OpenD down, still
+        connecting) fails without a request; the request itself runs on a daemon thread
+        so a hung OpenD costs the caller at most the timeout.
+        """
+        with self._lock:
+            quote_ctx = self.quote_ctx
+        if quote_ctx is None:
+            return False
+        status = getattr(quote_ctx, "status", None)   # futu ContextStatus: START, CONNECTING, READY, ...
+        if status is not None and status != "READY":
+            ok, error = False, f"quote context {str(status).lower()}"
+        else:
+            ok, error = self._probe(quote_ctx)
+        conn_id_getter = getattr(quote_ctx, "get_sync_conn_id", None)
+        conn_id = conn_id_getter() if ok and conn_id_getter else None
+        with self._lock:
+            self._last_check_at = time.time()
+            if quote_ctx is not self.quote_ctx:
+                return False  # replaced while probing
+            if not ok:
+                self.last_error = error
+                return False
+            # The context reconnects on its own after short drops; a new connection id means
+            # OpenD forgot our subscriptions, so replay them.
+            if conn_id != self._conn_id:
+                self._needs_replay = self._needs_replay or self._conn_id is not None
+                self._conn_id = conn_id
+            return True
+
+    def _probe(self, quote_ctx):
+        """get_global_state with a timeout. Returns (ok, error)."""
+        if not self._probe_lock.acquire(blocking=False):
+            return self.state == "connected", self.last_error  # another thread is probing right now
+        try:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return False, "previous health check still waiting for FutuOpenD"
+            reply = []
+            def run():
+                try:
+                    reply.append(quote_ctx.get_global_state())
+                except Exception as e:
+                    reply.append((-1, str(e)))
+            self._probe_thread = threading.Thread(target=run, name="opend-probe", daemon=True)
+            self._probe_thread.start()
+            self._probe_thread.join(self.health_check_timeout)
+        finally:
+            self._probe_lock.release()
+        if not reply:
+            return False, f"no answer to health check within {self.health_check_timeout:g}s"
+        ret, data = reply[0]
+        return ret == RET_OK, None if ret == RET_OK else str(data)
+
+    def ensure_connected(self, force_check=False):
+        """
+        Return a healthy quote context, or None. Connects on first use; health is re-checked
+        when due (or forced); an unhealthy context is replaced once its backoff delay has
+        passed. Never sleeps, and waits at most health_check_timeout for OpenD.
+        """
+        if not self.available:
+            return None
+        with self._lock:
+            if self.state == "closed":
+                return None
+            connect = self.quote_ctx is None and time.time() >= self._next_retry_at
+        if connect:
+            self.connect()
+        with self._lock:
+            due = force_check or self.state != "connected" or \
+                time.time() - self._last_check_at >= self.health_check_seconds
+            if not due:
+                return self.quote_ctx
+        healthy = self.health_check()
+        reconnect = False
+        with self._lock:
+            if self.state == "closed":
+                return None
+            if healthy:
+                if self.state != "connected":
+                    print(f"FutuOpenD connected at {self.host}:{self.port}")
+                self.state = "connected"
+                self._retry_attempts = 0
+                quote_ctx, replay = self.quote_ctx, self._needs_replay
+            else:
+                if self.state == "connected":
+                    print(f"Lost connection to FutuOpenD: {self.last_error}")
+                    self.state = "reconnecting"
+                if time.time() >= self._next_retry_at:
+                    self.reconnect_count += 1
+                    self._retry_attempts += 1
+                    print(f"Reconnecting to FutuOpenD (reconnect #{self.reconnect_count})")
+                    self.state = "reconnecting"
+                    reconnect = True
+        if reconnect:
+            self.connect()
+        if not healthy:
+            return None
+        if replay:
+            self._replay_subscriptions(quote_ctx)
+        return quote_ctx
+
+    def _replay_subscriptions(self, quote_ctx):
+        with self._lock:
+            by_subtypes = {}
+            for code, subtypes in self.subscriptions.items():
+                by_subtypes.setdefault(tuple(sorted(subtypes, key=str)), []).append(code)
+        for subtypes, codes in by_subtypes.items():
+            ret, err = quote_ctx.subscribe(codes, list(subtypes), subscribe_push=True)
+            if ret != RET_OK:
+                print(f"Failed to re-subscribe {len(codes)} code(s) after reconnect: {err}")
+                return
+        if by_subtypes:
+            print(f"Re-subscribed {sum(len(codes) for codes in by_subtypes.values())} code(s) after reconnect")
+        with self._lock:
+            if quote_ctx is self.quote_ctx:
+                self._needs_replay = False
+
+    def get_market_snapshot(self, code_list):
+        """Same contract as OpenQuoteContext.get_market_snapshot, with a health check on failure."""
+        quote_ctx = self.ensure_connected()
+        if quote_ctx is None:
+            return -1, f"FutuOpenD not connected ({self.state})"
+        ret, data = quote_ctx.get_market_snapshot(code_list)
+        if ret != RET_OK:
+            self.ensure_connected(force_check=True)
+        return ret, data
+
+    def get_option_chain(self, code, start=None, end=None):
+        """Same contract as OpenQuoteContext.get_option_chain, with a health check on failure."""
+        quote_ctx = self.ensure_connected()
+        if quote_ctx is None:
+            return -1, f"FutuOpenD not connected ({self.state})"
+        ret, data = quote_ctx.get_option_chain(code, start=start, end=end)
+        if ret != RET_OK:
+            self.ensure_connected(force_check=True)
+        return ret, data
+
+    def set_handler(self, handler):
+        with self._lock:
+            self.handlers[type(handler).__name__] = handler
+            if self.quote_ctx is not None:
+                return self.quote_ctx.set_handler(handler)
+        return RET_OK
+
+    def subscribe(self, code_list, subtype_list, subscribe_push=True):
+        """Record the subscription (replayed after reconnects) and apply it if connected."""
+        with self._lock:
+            for code in code_list:
+                self.subscriptions.setdefault(code, set()).update(subtype_list)
+        quote_ctx = self.ensure_connected()
+        if quote_ctx is None:
+            return RET_OK, "pending until FutuOpenD reconnects"
+        return quote_ctx.subscribe(code_list, subtype_list, subscribe_push=subscribe_push)
+
+    def unsubscribe(self, code_list, subtype_list):
+        with self._lock:
+            for code in code_list:
+                remaining = self.subscriptions.get(code, set()) - set(subtype_list)
+                if remaining:
+                    self.subscriptions[code] = remaining
+                else:
+                    self.subscriptions.pop(code, None)
+            quote_ctx = self.quote_ctx if self.state == "connected" else None
+        if quote_ctx is None:
+            return RET_OK, None
+        return quote_ctx.unsubscribe(code_list, subtype_list)
+
+    def status(self):
+        """Connection state and counters for display."""
+        return {"state": self.state, "host": self.host, "port": self.port,
+                "reconnect_count": self.reconnect_count, "last_error": self.last_error,
+                "subscriptions": len(self.subscriptions)}
+
+    def close(self):
+        """Stop health checks and close the context (lets the Futu threads exit)."""
+        self._stop.set()
+        with self._lock:
+            self.state = "closed"
+            quote_ctx, self.quote_ctx = self.quote_ctx, None
+        self._close_context(quote_ctx)
+
+def _open_quote_context():
+    return OpenQuoteContext(host=HOST, port=PORT, is_async_connect=True)
+
+# Connects on first use (or from the GUI's main()), so importing this module opens no connection
+opend = OpenDConnection(HOST, PORT, context_factory=_open_quote_context if FUTU_AVAILABLE else None)
 
 # --- Black-Scholes Model ---
+# Pricing is done by the vectorized engine in bs_engine.py; these wrappers keep the scalar API.
 def N(x):
     """ Cumulative standard normal distribution function. """
-    return (1.0 + math.erf(x / math.sqrt(2.0))) / 2.0
+    return float(norm_cdf(x))
+
+alert_state = AlertStateMachine(ALERT_STATE_FILE, cooldown=ALERT_COOLDOWN_SECONDS, hysteresis=ALERT_HYSTERESIS,
+                                min_band=ALERT_MIN_BAND)
+
+greeks_cache = GreeksCache(max_entries=GREEKS_CACHE_MAX_ENTRIES, spot_tolerance=GREEKS_CACHE_SPOT_TOLERANCE,
+                           vol_tolerance=GREEKS_CACHE_VOL_TOLERANCE,
+                           time_tolerance=GREEKS_CACHE_TIME_TOLERANCE_MINUTES / (365.0 * 24 * 60))
 
 def black_scholes_price(S, K, T, r, sigma, option_type='call'):
     """
@@ -114,63 +511,157 @@ def black_scholes_price(S, K, T, r, sigma, option_type='call'):
     sigma: Volatility (annualized)
     option_type: 'call' or 'put'
     """
-    if T <= 0: # Option expired or at expiration
-        if option_type.lower() == 'call':
-            return max(0, S - K)
-        elif option_type.lower() == 'put':
-            return max(0, K - S)
-        else:
+    if option_type.lower() not in ('call', 'put'):
+        if T <= 0 or sigma <= 0:
             return 0.0
-    
-    if sigma <= 0: # Volatility cannot be zero or negative for BS
+        raise ValueError("Option type must be 'call' or 'put'")
+    if T > 0 and sigma <= 0: # Volatility cannot be zero or negative for BS
         print(f"Warning: Sigma (volatility) is {sigma} for S={S}, K={K}, T={T}. Returning intrinsic value.")
-        if option_type.lower() == 'call':
-            return max(0, S - K)
-        elif option_type.lower() == 'put':
-            return max(0, K - S)
-        else:
-            return 0.0
+    return greeks_cache.greeks(S, K, T, r, sigma, option_type)["price"]
 
-    d1 = (math.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * math.sqrt(T))
-    d2 = d1 - sigma * math.sqrt(T)
+def black_scholes_greeks(S, K, T, r, sigma, option_type='call'):
+    """
+    Black-Scholes price and Greeks in the units Futu reports: vega and rho per 1%,
+    theta per calendar day. Returns a dict with price, delta, gamma, vega, theta, rho.
+    """
+    return bs_greeks_scalar(S, K, T, r, sigma, option_type)
 
-    if option_type.lower() == 'call':
-        price = S * N(d1) - K * math.exp(-r * T) * N(d2)
-    elif option_type.lower() == 'put':
-        price = K * math.exp(-r * T) * N(-d2) - S * N(-d1)
-    else:
-        raise ValueError("Option type must be 'call' or 'put'")
-    return max(0, price) # Price cannot be negative
+def uses_american_pricing(market):
+    """True if options of this market ("US"/"HK") are priced as American."""
+    return (market or "").upper() in AMERICAN_PRICING_MARKETS
 
-# --- Data Fetching Function ---
-def get_real_option_data(option_futu_code, underlying_prices_cache):
-    if not quote_ctx:
-        print("Error: FutuOpenD connection not established.")
-        return None
+def dividend_yield(underlying):
+    """Configured continuous dividend yield of an underlying Futu code (0 if none)."""
+    return DIVIDEND_YIELDS.get((underlying or "").upper(), 0.0)
 
-    ret_option, data_option_df = quote_ctx.get_market_snapshot([option_futu_code])
-    if ret_option != RET_OK or data_option_df.empty:
-        print(f"Error fetching option snapshot for {option_futu_code} from Futu: {ret_option} - {data_option_df}")
-        return None
-    
-    # Add proper error handling for DataFrame access
-    try:
-        if not isinstance(data_option_df, pd.DataFrame) or data_option_df.empty:
-            print(f"Error: Invalid or empty data for {option_futu_code}")
-            return None
-        option_snapshot = data_option_df.iloc[0]
-    except (IndexError, AttributeError) as e:
-        print(f"Error accessing data for {option_futu_code}: {e}")
+def american_greeks(S, K, T, r, sigma, option_type, underlying=None):
+    """American price and Greeks (arrays broadcast like bs_price_greeks) on an AMERICAN_TREE_STEPS tree."""
+    return american_price_greeks(S, K, T, r, sigma, option_type, q=dividend_yield(underlying), steps=AMERICAN_TREE_STEPS)
+
+def theoretical_option_price(S, K, T, r, sigma, option_type, underlying=None):
+    """Model price of one option: American tree for AMERICAN_PRICING_MARKETS, else (cached) Black-Scholes."""
+    if underlying and uses_american_pricing(underlying.split('.')[0]):
+        return float(american_price(S, K, T, r, sigma, option_type, q=dividend_yield(underlying), steps=AMERICAN_TREE_STEPS))
+    return black_scholes_price(S, K, T, r, sigma, option_type)
+
+# --- Scenario Analysis ---
+def scenario_leg(S, quantity, K=0.0, T=0.0, sigma=0.0, option_type="Stock", multiplier=None, cost=None,
+                 underlying=None):
+    """
+    One leg for run_scenario_matrix, payoff_profile and run_portfolio_var. Stock legs only
+    need S and quantity. cost is the entry price per share (None: today's model value, i.e.
+    P&L from now on); underlying (Futu code) groups legs for the VaR simulation.
+    """
+    if multiplier is None:
+        multiplier = 1 if option_type == "Stock" else CONTRACT_MULTIPLIER
+    return {"S": S, "K": K, "T": T, "sigma": sigma, "option_type": option_type,
+            "quantity": quantity, "multiplier": multiplier, "cost": cost, "underlying": underlying}
+
+def run_scenario_matrix(legs, spot_shifts=SCENARIO_SPOT_SHIFTS, vol_shifts=SCENARIO_VOL_SHIFTS,
+                        days_forward=SCENARIO_DAYS_FORWARD, r=RISK_FREE_RATE):
+    """
+    P&L of a book of scenario_leg()s over a spot x vol x days-forward grid. Every option
+    leg is repriced in one vectorized evaluation; stock legs move with spot only. Each
+    leg's spot is shifted by the same percentage. Returns bs_engine.scenario_pnl's dict.
+    """
+    options = [leg for leg in legs if leg["option_type"] != "Stock"]
+    result = scenario_pnl(
+        [leg["S"] for leg in options], [leg["K"] for leg in options], [leg["T"] for leg in options], r,
+        [leg["sigma"] for leg in options], [leg["option_type"] for leg in options],
+        [leg["quantity"] for leg in options], spot_shifts, vol_shifts, days_forward,
+        multiplier=[leg["multiplier"] for leg in options])
+    for leg in legs:
+        if leg["option_type"] == "Stock":
+            result["pnl"] = result["pnl"] + leg["S"] * leg["quantity"] * leg["multiplier"] * result["spot_shifts"]
+            result["base_value"] += leg["S"] * leg["quantity"] * leg["multiplier"]
+    result["legs"] = len(legs)
+    return result
+
+def payoff_profile(legs, days_forward=PAYOFF_DAYS_FORWARD, spot_grid=None, points=PAYOFF_GRID_POINTS, r=RISK_FREE_RATE):
+    """
+    P&L curves of a book of scenario_leg()s on one underlying over a dense price grid:
+    one curve per entry of days_forward plus one at the nearest expiry (the payoff
+    diagram when all legs share that expiry), all computed in one array pass. The default
+    grid runs from 0 to twice the highest strike/spot and contains every strike, so
+    expiry kinks and breakevens are exact.
+
+    Returns {"spot": grid, "curves": [{"label", "days", "pnl", "breakevens", "max_profit",
+    "max_loss"}, ...]}. max_profit / max_loss are inf / -inf when the P&L is unbounded as
+    the underlying rises (net long / short calls and stock).
+    """
+    options = [leg for leg in legs if leg["option_type"] != "Stock"]
+    stocks = [leg for leg in legs if leg["option_type"] == "Stock"]
+    if spot_grid is None:
+        levels = [leg["S"] for leg in legs] + [leg["K"] for leg in options]
+        spot_grid = np.union1d(np.linspace(0.0, 2.0 * max(levels, default=1.0), points), [leg["K"] for leg in options])
+    spot_grid = np.asarray(spot_grid, dtype=float)
+
+    expiry_days = min((leg["T"] for leg in options), default=0.0) * 365.0
+    horizons = [(f"T+{days}", days) for days in days_forward if days < expiry_days]
+    horizons.append((f"Expiry (T+{expiry_days:.0f})", expiry_days))
+
+    costs = [leg["cost"] if leg["cost"] is not None else float(bs_price(leg["S"], leg["K"], leg["T"], r, leg["sigma"], leg["option_type"]))
+             for leg in options]
+    pnl = payoff_curves([leg["K"] for leg in options], [leg["T"] for leg in options], r,
+                        [leg["sigma"] for leg in options], [leg["option_type"] for leg in options],
+                        [leg["quantity"] for leg in options], costs, spot_grid,
+                        [days / 365.0 for _, days in horizons], multiplier=[leg["multiplier"] for leg in options])
+    for leg in stocks:
+        cost = leg["cost"] if leg["cost"] is not None else leg["S"]
+        pnl = pnl + (spot_grid - cost) * leg["quantity"] * leg["multiplier"]
+
+    # Slope as the underlying rises without bound: every call and share counts fully
+    upside_slope = sum(leg["quantity"] * leg["multiplier"] for leg in legs
+                       if leg["option_type"] == "Stock" or str(leg["option_type"]).lower().startswith("c"))
+    curves = []
+    for (label, days), curve in zip(horizons, pnl):
+        curves.append({"label": label, "days": days, "pnl": curve,
+                       "breakevens": breakevens(spot_grid, curve).tolist(),
+                       "max_profit": float("inf") if upside_slope > 0 else float(curve.max()),
+                       "max_loss": float("-inf") if upside_slope < 0 else float(curve.min())})
+    return {"spot": spot_grid, "curves": curves}
+
+def run_portfolio_var(legs, paths=VAR_PATHS, horizon_days=VAR_HORIZON_DAYS, correlation=VAR_CORRELATION,
+                      r=RISK_FREE_RATE, workers=VAR_WORKERS):
+    """
+    Monte Carlo VaR / expected shortfall (95% and 99%) of scenario_leg()s that carry an
+    underlying, fully repricing every option leg on each path (see var_engine.py).
+    Returns None when there are no legs.
+    """
+    legs = [dict(leg, underlying=leg["underlying"] or "?") for leg in legs]
+    if not legs:
         return None
+    underlying_vols = {}
+    for underlying in {leg["underlying"] for leg in legs}:
+        ivs = [leg["sigma"] for leg in legs if leg["underlying"] == underlying and leg["option_type"] != "Stock" and leg["sigma"] > 0]
+        underlying_vols[underlying] = sum(ivs) / len(ivs) if ivs else VAR_FALLBACK_VOL
+    return var_engine.portfolio_var(legs, underlying_vols, correlation=correlation, r=r, paths=paths,
+                                    horizon_days=horizon_days, workers=workers or None)
+
+def export_scenario_matrix(result, path):
+    """Write a scenario result to CSV, one row per (days forward, vol shift, spot shift) cell."""
+    days, vols, spots = result["pnl"].shape
+    frame = pd.DataFrame({
+        "days_forward": [result["days_forward"][d] for d in range(days) for _ in range(vols * spots)],
+        "vol_shift": [result["vol_shifts"][v] for _ in range(days) for v in range(vols) for _ in range(spots)],
+        "spot_shift": [result["spot_shifts"][s] for _ in range(days * vols) for s in range(spots)],
+        "pnl": result["pnl"].ravel(),
+    })
+    frame.to_csv(path, index=False)
+    return path
+
+# --- Data Fetching Function ---
+def _chunked(items, size):
+    """Yield successive lists of at most `size` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def parse_option_snapshot(option_snapshot):
+    """Convert one row of a Futu market snapshot into a plain option quote record."""
+    def _num(field):
+        value = option_snapshot.get(field, 0.0)
+        return float(value) if pd.notna(value) else 0.0
 
-    option_price = option_snapshot.get('last_price', 0.0)
-    strike_price = option_snapshot.get('option_strike_price', 0.0)
-    implied_volatility = option_snapshot.get('option_implied_volatility', 0.0) / 100.0 if pd.notna(option_snapshot.get('option_implied_volatility')) else 0.0
-    delta = option_snapshot.get('option_delta', 0.0)
-    gamma = option_snapshot.get('option_gamma', 0.0)
-    vega = option_snapshot.get('option_vega', 0.0)
-    theta = option_snapshot.get('option_theta', 0.0)
-    rho = option_snapshot.get('option_rho', 0.0)
     option_type_val = option_snapshot.get('option_type', -1)
     option_type_str = "Unknown"
     if option_type_val == OptionType.CALL: option_type_str = 'Call'
@@ -185,75 +676,1367 @@ def get_real_option_data(option_futu_code, underlying_prices_cache):
             days_to_expiry = (expiry_date - datetime.now()).days
         except ValueError: days_to_expiry = -1
 
+    stock_owner = option_snapshot.get('stock_owner', None)
+    return {
+        "option_code": option_snapshot.get('code'),
+        "last_price": _num('last_price'),
+        "strike_price": _num('option_strike_price'),
+        "implied_volatility": _num('option_implied_volatility') / 100.0,
+        "delta": _num('option_delta'),
+        "gamma": _num('option_gamma'),
+        "vega": _num('option_vega'),
+        "theta": _num('option_theta'),
+        "rho": _num('option_rho'),
+        "option_type": option_type_str,
+        "days_to_expiry": days_to_expiry,
+        "stock_owner": stock_owner if isinstance(stock_owner, str) and stock_owner else None,
+    }
+
+def _fetch_snapshot_chunk(codes, records, snapshot_call, rejected=None):
+    """
+    Fetch one chunk of snapshots into `records`, halving the chunk if Futu rejects it.
+    Codes Futu rejects on their own (invalid or expired) are added to the `rejected` set.
+    """
+    ret, data_df = snapshot_call(codes)
+    if ret == RET_OK and isinstance(data_df, pd.DataFrame) and not data_df.empty:
+        for _, row in data_df.iterrows():
+            record = parse_option_snapshot(row)
+            if record["option_code"]:
+                records[record["option_code"]] = record
+        return 1
+    if len(codes) == 1 or _is_rate_limit_error(data_df):
+        print(f"Error fetching option snapshot for {', '.join(codes[:3])}{'...' if len(codes) > 3 else ''} from Futu: {ret} - {data_df}")
+        if len(codes) == 1 and ret != RET_OK and rejected is not None and not _is_rate_limit_error(data_df):
+            rejected.add(codes[0])
+        return 1
+    # One bad code fails the whole request; split so the valid codes still come back.
+    middle = len(codes) // 2
+    return 1 + _fetch_snapshot_chunk(codes[:middle], records, snapshot_call, rejected) + \
+        _fetch_snapshot_chunk(codes[middle:], records, snapshot_call, rejected)
+
+def _is_rate_limit_error(message):
+    """True if a Futu error message says the snapshot quota was exceeded."""
+    text = str(message).lower()
+    return "frequen" in text or "频率" in text or "too many" in text
+
+class SnapshotScheduler:
+    """
+    Token-bucket gate for Futu snapshot calls. Every get_market_snapshot goes through
+    `call`, which waits for a token (SNAPSHOT_CALLS_PER_WINDOW per SNAPSHOT_WINDOW_SECONDS),
+    so the GUI tick, the BS tab and the CLI can share one quota without Futu rejecting
+    requests. `request` de-duplicates codes, chunks them to SNAPSHOT_MAX_CODES_PER_CALL and
+    coalesces codes another thread is already fetching onto that thread's result. Codes Futu
+    rejects on their own (invalid, expired) are left out of requests for rejected_ttl seconds,
+    so one bad code does not split every tick's chunk again.
+    """
+
+    def __init__(self, calls_per_window=SNAPSHOT_CALLS_PER_WINDOW,
+                 window_seconds=SNAPSHOT_WINDOW_SECONDS,
+                 max_codes_per_call=SNAPSHOT_MAX_CODES_PER_CALL,
+                 snapshot_fn=None, clock=time.monotonic, sleep=time.sleep, rejected_ttl=OPTION_CHAIN_TTL):
+        self.capacity = max(1, calls_per_window)
+        self.refill_per_second = self.capacity / window_seconds
+        self.max_codes_per_call = max_codes_per_call
+        self.snapshot_fn = snapshot_fn
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(self.capacity)
+        self._refilled_at = clock()
+        self._bucket_lock = threading.Lock()  # held while waiting, so callers queue in turn
+        self._inflight = {}  # option code -> Future of its record
+        self._inflight_lock = threading.Lock()
+        self.rejected_ttl = rejected_ttl
+        self._rejected = {}  # option code -> clock() when it may be requested again
+        self.calls = 0
+        self.coalesced_codes = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+        self._local = threading.local()  # per-thread wait total for request() reporting
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._refilled_at) * self.refill_per_second)
+        self._refilled_at = now
+
+    def acquire(self):
+        """Block until a snapshot call is allowed; returns the seconds spent waiting."""
+        with self._bucket_lock:
+            started = self.clock()
+            self._refill()
+            while self.tokens < 1:
+                self.sleep((1 - self.tokens) / self.refill_per_second)
+                self._refill()
+            self.tokens -= 1
+            waited = self.clock() - started
+            self.calls += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.last_wait = waited
+            self._local.waited = getattr(self._local, "waited", 0.0) + waited
+            return waited
+
+    def call(self, codes):
+        """One paced get_market_snapshot call; retried once if Futu still reports a quota error."""
+        snapshot_fn = self.snapshot_fn or opend.get_market_snapshot
+        self.acquire()
+        ret, data = snapshot_fn(codes)
+        if ret != RET_OK and _is_rate_limit_error(data):
+            with self._bucket_lock:
+                self.tokens = 0.0  # Futu disagrees with our count; wait a full token
+                self._refilled_at = self.clock()
+            self.acquire()
+            ret, data = snapshot_fn(codes)
+        return ret, data
+
+    def request(self, option_codes):
+        """Fetch snapshots for `option_codes`; returns {code: record} for the codes that came back."""
+        unique_codes = list(dict.fromkeys(code for code in option_codes if code))
+        futures, owned = {}, []
+        with self._inflight_lock:
+            now = self.clock()
+            self._rejected = {code: until for code, until in self._rejected.items() if until > now}
+            skipped = [code for code in unique_codes if code in self._rejected]
+            if skipped:
+                unique_codes = [code for code in unique_codes if code not in self._rejected]
+            for code in unique_codes:
+                future = self._inflight.get(code)
+                if future is None:
+                    future = Future()
+                    self._inflight[code] = future
+                    owned.append(code)
+                else:
+                    self.coalesced_codes += 1
+                futures[code] = future
+
+        started = self.clock()
+        self._local.waited = 0.0
+        records, calls, rejected = {}, 0, set()
+        try:
+            for chunk in _chunked(owned, self.max_codes_per_call):
+                try:
+                    calls += _fetch_snapshot_chunk(chunk, records, self.call, rejected)
+                except Exception as e:
+                    print(f"Error fetching option snapshots from Futu: {e}")
+        finally:
+            with self._inflight_lock:
+                until = self.clock() + self.rejected_ttl
+                self._rejected.update((code, until) for code in rejected)
+                for code in owned:
+                    self._inflight.pop(code, None)
+                    futures[code].set_result(records.get(code))
+
+        results = {}
+        for code, future in futures.items():
+            try:
+                record = future.result(timeout=SNAPSHOT_WINDOW_SECONDS * 2)
+            except Exception:
+                record = None
+            if record is not None:
+                results[code] = record
+        if unique_codes or skipped:
+            shared = len(unique_codes) - len(owned)
+            print(f"Fetched {len(results)}/{len(unique_codes)} option snapshots in {calls} Futu call(s)"
+                  f"{f', {shared} shared with another request' if shared else ''}"
+                  f"{f', {len(skipped)} skipped as rejected earlier' if skipped else ''}"
+                  f" (waited {self._local.waited:.1f}s for quota, {self.clock() - started:.1f}s total)")
+        return results
+
+    def status(self):
+        """Quota usage for display."""
+        with self._inflight_lock:
+            inflight = len(self._inflight)
+            now = self.clock()
+            rejected = sum(until > now for until in self._rejected.values())
+        # Read without the bucket lock: a queued caller may be holding it while it sleeps
+        tokens = min(self.capacity, self.tokens + (self.clock() - self._refilled_at) * self.refill_per_second)
+        return {"tokens": int(tokens), "capacity": self.capacity, "calls": self.calls,
+                "last_wait": self.last_wait, "max_wait": self.max_wait,
+                "avg_wait": self.total_wait / self.calls if self.calls else 0.0,
+                "coalesced_codes": self.coalesced_codes, "inflight_codes": inflight, "rejected_codes": rejected}
+
+snapshot_scheduler = SnapshotScheduler()
+# Same token bucket, used only through acquire(), for Futu's separate option chain quota
+option_chain_limiter = SnapshotScheduler(calls_per_window=OPTION_CHAIN_CALLS_PER_WINDOW)
+
+def get_option_snapshots(option_codes):
+    """
+    Fetch market snapshots for many option codes in as few Futu calls as possible.
+    Requests go through snapshot_scheduler, which paces calls under the Futu quota,
+    splits them into chunks of SNAPSHOT_MAX_CODES_PER_CALL and shares codes already in flight.
+    Returns a dict mapping option code -> parsed quote record (see parse_option_snapshot).
+    Codes that could not be fetched are missing from the result.
+    """
+    if not opend.available:
+        print("Error: FutuOpenD connection not established.")
+        return {}
+    return snapshot_scheduler.request(option_codes)
+
+def to_yahoo_symbol(code):
+    """Map a Futu-style code ("US.AAPL", "HK.00700") or bare ticker to its Yahoo Finance symbol."""
+    parts = code.split('.')
+    if len(parts) == 2 and parts[0] in ("US", "HK"):
+        market, ticker = parts
+        if market == "HK" and ticker.isdigit():
+            return f"{int(ticker):04d}.HK"
+        return ticker
+    return code
+
+def _latest_close(history, ticker_symbol):
+    """Return (price, timestamp) of the last non-empty close for one ticker in a yf.download frame."""
+    if isinstance(history.columns, pd.MultiIndex):
+        if ticker_symbol not in history.columns.get_level_values(0):
+            return 0.0, None
+        closes = history[ticker_symbol]['Close']
+    else:
+        closes = history['Close']
+    closes = closes.dropna()
+    if closes.empty:
+        return 0.0, None
+    timestamp = pd.Timestamp(closes.index[-1])
+    timestamp = timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+    return float(closes.iloc[-1]), timestamp.to_pydatetime()
+
+def get_underlying_prices(ticker_symbols):
+    """
+    Fetch latest prices for many Yahoo tickers with one batched download of today's
+    1-minute bars, instead of pulling each ticker's full `.info` metadata.
+    Tickers missing from the batch fall back to `fast_info.last_price`.
+    Returns a dict mapping ticker -> {'price', 'timestamp' (UTC), 'source'}; failed tickers are omitted.
+    """
+    symbols = list(dict.fromkeys(sym for sym in ticker_symbols if sym))
+    results = {}
+    if not symbols:
+        return results
+
+    print(f"  Fetching underlying prices for {', '.join(symbols)} from Yahoo Finance...")
+    try:
+        history = yf.download(symbols, period="1d", interval="1m", group_by="ticker",
+                              progress=False, threads=True, auto_adjust=False)
+        if isinstance(history, pd.DataFrame) and not history.empty:
+            for ticker_symbol in symbols:
+                price, timestamp = _latest_close(history, ticker_symbol)
+                if price > 0:
+                    results[ticker_symbol] = {"price": price, "timestamp": timestamp, "source": "yahoo-batch"}
+    except Exception as e:
+        print(f"    Error in batched Yahoo Finance download: {e}")
+
+    for ticker_symbol in symbols:
+        if ticker_symbol in results:
+            continue
+        try:
+            price = yf.Ticker(ticker_symbol).fast_info['last_price']
+            if price is not None and pd.notna(price) and price > 0:
+                results[ticker_symbol] = {"price": float(price), "timestamp": datetime.now(timezone.utc), "source": "yahoo-fast-info"}
+            else: print(f"    Failed to get a valid price for {ticker_symbol} from Yahoo Finance.")
+        except Exception as e: print(f"    Error fetching underlying price for {ticker_symbol} from Yahoo Finance: {e}")
+    return results
+
+# --- Market Data Providers ---
+OPTION_CODE_PATTERN = re.compile(r"^(US|HK)\.([A-Z0-9]+?)(\d{6})([CP])(\d+)$")
+
+def parse_option_code(option_code):
+    """
+    Split a Futu option code ("US.AAPL250117C150000") into its parts.
+    Returns a dict with market, underlying (Futu code), expiry (date), option_type
+    ("Call"/"Put") and strike_price, or None if the code does not match.
+    """
+    match = OPTION_CODE_PATTERN.match(option_code or "")
+    if not match:
+        return None
+    market, ticker, expiry, option_type, strike = match.groups()
+    return {"market": market, "underlying": f"{market}.{ticker}",
+            "expiry": datetime.strptime(expiry, "%y%m%d").date(),
+            "option_type": "Call" if option_type == "C" else "Put",
+            "strike_price": int(strike) / 1000.0}
+
+class MarketDataProvider:
+    """
+    Source of normalized quotes. get_option_quotes returns {code: record} in the
+    parse_option_snapshot shape; get_underlying_prices returns {yahoo ticker:
+    {'price', 'timestamp' (UTC), 'source'}} like get_underlying_prices. Missing
+    codes are left out. get_option_chain lists the contracts of one underlying (Futu code)
+    expiring between two dates as {option_code, expiry (date), strike_price, option_type}.
+    push_source is a quote push source for QuoteStream, or None.
+    underlying_ttl_seconds overrides the underlying cache TTL (None keeps the config).
+    Reads never move the market; replayed and simulated providers move to their next
+    tick only on advance(), which the monitor tick calls once.
+    """
+    name = "none"
+    push_source = None
+    underlying_ttl_seconds = None
+
+    def advance(self):
+        """Move to the next tick. Live providers have nothing to do."""
+        pass
+
+    def get_option_quotes(self, option_codes):
+        return {}
+
+    def get_underlying_prices(self, ticker_symbols):
+        return {}
+
+    def get_option_chain(self, underlying, start, end):
+        return []
+
+    def close(self):
+        pass
+
+class FutuProvider(MarketDataProvider):
+    """Option quotes from FutuOpenD snapshots (paced by snapshot_scheduler)."""
+    name = "futu"
+
+    @property
+    def push_source(self):
+        return opend if opend.available else None
+
+    def get_option_quotes(self, option_codes):
+        return get_option_snapshots(option_codes)
+
+    def get_option_chain(self, underlying, start, end):
+        return get_option_chain_contracts(underlying, start, end)
+
+class YahooProvider(MarketDataProvider):
+    """Underlying prices from Yahoo Finance (batched download)."""
+    name = "yahoo"
+
+    def get_underlying_prices(self, ticker_symbols):
+        return get_underlying_prices(ticker_symbols)
+
+class LiveProvider(MarketDataProvider):
+    """Options from one provider and underlyings from another; Futu + Yahoo by default."""
+
+    def __init__(self, option_provider=None, underlying_provider=None):
+        self.option_provider = option_provider or FutuProvider()
+        self.underlying_provider = underlying_provider or YahooProvider()
+        self.name = f"live ({self.option_provider.name} + {self.underlying_provider.name})"
+
+    @property
+    def push_source(self):
+        return self.option_provider.push_source
+
+    def advance(self):
+        self.option_provider.advance()
+        self.underlying_provider.advance()
+
+    def get_option_quotes(self, option_codes):
+        return self.option_provider.get_option_quotes(option_codes)
+
+    def get_underlying_prices(self, ticker_symbols):
+        return self.underlying_provider.get_underlying_prices(ticker_symbols)
+
+    def get_option_chain(self, underlying, start, end):
+        return self.option_provider.get_option_chain(underlying, start, end)
+
+class RecordingProvider(MarketDataProvider):
+    """
+    Passes every call through to another provider and appends the results to a
+    JSON-lines file (one frame per call) that ReplayProvider can play back.
+    """
+
+    def __init__(self, provider, path):
+        self.provider = provider
+        self.path = Path(path)
+        self.name = f"{provider.name}, recording to {self.path.name}"
+        self.underlying_ttl_seconds = provider.underlying_ttl_seconds
+        self._lock = threading.Lock()
+
+    @property
+    def push_source(self):
+        return self.provider.push_source
+
+    def advance(self):
+        self.provider.advance()
+
+    def _write(self, kind, data):
+        frame = {"time": datetime.now(timezone.utc).isoformat(), "kind": kind, "data": data}
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(frame, default=str) + "\n")
+
+    def get_option_quotes(self, option_codes):
+        quotes = self.provider.get_option_quotes(option_codes)
+        self._write("options", quotes)
+        return quotes
+
+    def get_underlying_prices(self, ticker_symbols):
+        prices = self.provider.get_underlying_prices(ticker_symbols)
+        self._write("underlyings", {sym: dict(quote, timestamp=quote["timestamp"].isoformat())
+                                    for sym, quote in prices.items()})
+        return prices
+
+    def get_option_chain(self, underlying, start, end):
+        return self.provider.get_option_chain(underlying, start, end)
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Plays back a file written by RecordingProvider. Each recorded option frame starts a
+    tick, and the underlyings recorded after it belong to the same tick; advance() moves
+    to the next one (reads before the first advance() see the first tick). Quotes carry
+    forward until a later frame replaces them. At the end of the file the last tick
+    repeats, or playback restarts if loop=True.
+    """
+    underlying_ttl_seconds = 0.0  # every tick must see that tick's recorded prices
+
+    def __init__(self, path, loop=False):
+        self.path = Path(path)
+        self.name = f"replay ({self.path.name})"
+        self.loop = loop
+        self.ticks = []  # list of (option quotes, underlying quotes) as of each tick
+        self.tick_index = -1
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        options, underlyings = {}, {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                frame = json.loads(line)
+                if frame["kind"] == "options":
+                    if options or self.ticks:
+                        self.ticks.append((dict(options), dict(underlyings)))
+                    options.update(frame["data"])
+                elif frame["kind"] == "underlyings":
+                    for sym, quote in frame["data"].items():
+                        underlyings[sym] = dict(quote, timestamp=datetime.fromisoformat(quote["timestamp"]))
+        if options or underlyings:
+            self.ticks.append((options, underlyings))
+        print(f"Loaded {len(self.ticks)} recorded tick(s) from {self.path}")
+
+    def advance(self):
+        with self._lock:
+            if not self.ticks:
+                return
+            self.tick_index += 1
+            if self.tick_index >= len(self.ticks):
+                self.tick_index = 0 if self.loop else len(self.ticks) - 1
+
+    def _current(self):
+        with self._lock:
+            if not self.ticks:
+                return {}, {}
+            return self.ticks[max(0, self.tick_index)]
+
+    def get_option_quotes(self, option_codes):
+        options, _ = self._current()
+        return {code: dict(options[code]) for code in option_codes if code in options}
+
+    def get_underlying_prices(self, ticker_symbols):
+        _, underlyings = self._current()
+        return {sym: dict(underlyings[sym], source="replay") for sym in ticker_symbols if sym in underlyings}
+
+    def get_option_chain(self, underlying, start, end):
+        """Contracts of the underlying that appear anywhere in the recording."""
+        codes = {code for options, _ in self.ticks for code in options}
+        return _chain_contracts_from_codes(codes, underlying, start, end)
+
+class SyntheticProvider(MarketDataProvider):
+    """
+    Deterministic generated market: every underlying follows a seeded geometric Brownian
+    motion, and option quotes are Black-Scholes prices and Greeks at a flat volatility.
+    Each advance() moves the market on by step_seconds of simulated time.
+    Any parseable option code works; underlyings start at spot_prices or default_spot.
+    """
+    name = "synthetic"
+    underlying_ttl_seconds = 0.0
+
+    def __init__(self, seed=SYNTHETIC_SEED, spot_prices=None, default_spot=100.0,
+                 volatility=0.30, drift=0.0, step_seconds=60.0, start_time=None):
+        self.rng = random.Random(seed)
+        self.spots = dict(spot_prices or {})  # Yahoo ticker -> current price
+        self.default_spot = default_spot
+        self.volatility = volatility
+        self.drift = drift
+        self.step_seconds = step_seconds
+        self.now = start_time or datetime.now(timezone.utc)
+        self.ticks = 0
+        self._lock = threading.Lock()
+
+    def _spot(self, ticker_symbol):
+        return self.spots.setdefault(ticker_symbol, self.default_spot)
+
+    def advance(self):
+        with self._lock:
+            self.step()
+
+    def step(self):
+        """Advance simulated time by one step and move every known underlying (hold the lock)."""
+        dt = self.step_seconds / (365.0 * 24 * 3600)
+        for ticker_symbol in sorted(self.spots):
+            shock = self.rng.gauss(0.0, 1.0)
+            self.spots[ticker_symbol] *= math.exp((self.drift - 0.5 * self.volatility ** 2) * dt
+                                                  + self.volatility * math.sqrt(dt) * shock)
+        self.now += timedelta(seconds=self.step_seconds)
+        self.ticks += 1
+
+    def get_option_quotes(self, option_codes):
+        with self._lock:
+            quotes = {}
+            for option_code in dict.fromkeys(option_codes):
+                parsed = parse_option_code(option_code)
+                if parsed is None:
+                    continue
+                S = self._spot(to_yahoo_symbol(parsed["underlying"]))
+                days_to_expiry = (parsed["expiry"] - self.now.date()).days
+                greeks = black_scholes_greeks(S, parsed["strike_price"], max(0, days_to_expiry) / 365.0,
+                                              RISK_FREE_RATE, self.volatility, parsed["option_type"])
+                quotes[option_code] = {
+                    "option_code": option_code, "last_price": greeks["price"],
+                    "strike_price": parsed["strike_price"], "implied_volatility": self.volatility,
+                    "delta": greeks["delta"], "gamma": greeks["gamma"], "vega": greeks["vega"],
+                    "theta": greeks["theta"], "rho": greeks["rho"], "option_type": parsed["option_type"],
+                    "days_to_expiry": days_to_expiry, "stock_owner": parsed["underlying"],
+                }
+            return quotes
+
+    def get_underlying_prices(self, ticker_symbols):
+        with self._lock:
+            return {sym: {"price": self._spot(sym), "timestamp": self.now, "source": "synthetic"}
+                    for sym in dict.fromkeys(ticker_symbols) if sym}
+
+    def get_option_chain(self, underlying, start, end):
+        """Weekly (Friday) expiries with strikes every ~2.5% within 20% of the current spot."""
+        market, ticker = underlying.split(".", 1)
+        with self._lock:
+            spot = self._spot(to_yahoo_symbol(underlying))
+        step = max(0.5, round(spot * 0.025 * 2) / 2)
+        strikes = [round(spot / step) * step + k * step for k in range(-8, 9)]
+        codes = []
+        expiry = start + timedelta(days=(4 - start.weekday()) % 7)
+        while expiry <= end:
+            for strike in strikes:
+                if strike > 0:
+                    for option_type in ("C", "P"):
+                        codes.append(f"{market}.{ticker}{expiry:%y%m%d}{option_type}{int(round(strike * 1000))}")
+            expiry += timedelta(days=7)
+        return _chain_contracts_from_codes(codes, underlying, start, end)
+
+def create_market_data_provider(kind=MARKET_DATA_PROVIDER, replay_file=MARKET_DATA_REPLAY_FILE,
+                                record_file=MARKET_DATA_RECORD_FILE):
+    """Build the provider selected by MARKET_DATA_PROVIDER (falls back to live)."""
+    if kind == "synthetic":
+        provider = SyntheticProvider()
+    elif kind == "replay":
+        try:
+            provider = ReplayProvider(replay_file)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load replay file '{replay_file}': {e}. Using live market data.")
+            provider = LiveProvider()
+    else:
+        if kind != "live":
+            print(f"Unknown MARKET_DATA_PROVIDER '{kind}'. Using live market data.")
+        provider = LiveProvider()
+    if record_file:
+        provider = RecordingProvider(provider, record_file)
+    return provider
+
+# --- Underlying Price Cache ---
+class UnderlyingPriceCache:
+    """
+    Process-wide cache of underlying prices (from market_data_provider) shared by the monitor and the BS calculator.
+    Entries expire after the TTL of their market (US/HK); the least recently used entry is
+    evicted once max_entries is reached. Every entry keeps the quote's source and timestamp.
+    """
+
+    def __init__(self, ttl_seconds=None, max_entries=UNDERLYING_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = dict(ttl_seconds or UNDERLYING_PRICE_TTL)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def market_of(ticker_symbol):
+        return "HK" if ticker_symbol.upper().endswith(".HK") else "US"
+
+    @staticmethod
+    def age(entry):
+        """Seconds since the quote's own timestamp (how old the price data is)."""
+        return max(0.0, (datetime.now(timezone.utc) - entry["timestamp"]).total_seconds())
+
+    def get(self, ticker_symbol):
+        """Return the cached entry if it is still within its market's TTL, else None."""
+        with self._lock:
+            entry = self._entries.get(ticker_symbol)
+            if entry is None:
+                return None
+            ttl = self.ttl_seconds.get(self.market_of(ticker_symbol), 0.0)
+            if time.time() - entry["fetched_at"] > ttl:
+                del self._entries[ticker_symbol]
+                return None
+            self._entries.move_to_end(ticker_symbol)
+            return dict(entry)
+
+    def put(self, ticker_symbol, quote):
+        """Store a quote from get_underlying_prices and return the cache entry."""
+        entry = {"price": quote["price"], "timestamp": quote["timestamp"],
+                 "source": quote["source"], "fetched_at": time.time()}
+        with self._lock:
+            self._entries[ticker_symbol] = entry
+            self._entries.move_to_end(ticker_symbol)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return dict(entry)
+
+    def fetch(self, ticker_symbols):
+        """Return entries for all tickers, fetching only the missing or expired ones in one batch."""
+        entries = {}
+        missing = []
+        for ticker_symbol in dict.fromkeys(sym for sym in ticker_symbols if sym):
+            entry = self.get(ticker_symbol)
+            if entry is None:
+                missing.append(ticker_symbol)
+            else:
+                entries[ticker_symbol] = entry
+        if missing:
+            for ticker_symbol, quote in market_data_provider.get_underlying_prices(missing).items():
+                entries[ticker_symbol] = self.put(ticker_symbol, quote)
+        return entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+underlying_price_cache = UnderlyingPriceCache()
+
+market_data_provider = MarketDataProvider()
+provider_caches = []  # caches of provider data, cleared when the provider changes
+
+def register_provider_cache(cache):
+    """Have set_market_data_provider clear `cache` (anything with clear()) on every switch."""
+    provider_caches.append(cache)
+    return cache
+
+register_provider_cache(underlying_price_cache)
+
+def set_market_data_provider(provider):
+    """Switch every quote consumer (monitor, BS calculator, CLI) to another provider."""
+    global market_data_provider
+    old_provider, market_data_provider = market_data_provider, provider
+    if provider.underlying_ttl_seconds is None:
+        underlying_price_cache.ttl_seconds = dict(UNDERLYING_PRICE_TTL)
+    else:
+        underlying_price_cache.ttl_seconds = {market: provider.underlying_ttl_seconds for market in UNDERLYING_PRICE_TTL}
+    for cache in provider_caches:
+        cache.clear()
+    if old_provider is not provider:
+        old_provider.close()
+    print(f"Market data provider: {provider.name}")
+    return provider
+
+set_market_data_provider(create_market_data_provider())
+
+# --- Option Chain ---
+def _chain_contracts_from_codes(option_codes, underlying, start, end):
+    """Chain contract records for the codes of `underlying` expiring within [start, end]."""
+    contracts = []
+    for option_code in option_codes:
+        parsed = parse_option_code(option_code)
+        if parsed and parsed["underlying"] == underlying and start <= parsed["expiry"] <= end:
+            contracts.append({"option_code": option_code, "expiry": parsed["expiry"],
+                              "strike_price": parsed["strike_price"], "option_type": parsed["option_type"]})
+    return contracts
+
+def get_option_chain_contracts(underlying, start, end):
+    """
+    List every option contract of `underlying` (Futu code, e.g. "US.AAPL") expiring between
+    the start and end dates from OpenD. Futu caps each get_option_chain call at 30 days of
+    expiries and 10 calls per 30 s, so the range is split and paced by option_chain_limiter.
+    """
+    if not opend.available:
+        print("Error: FutuOpenD connection not established.")
+        return []
+    contracts = []
+    window_start = start
+    while window_start <= end:
+        window_end = min(end, window_start + timedelta(days=OPTION_CHAIN_MAX_DAYS_PER_CALL - 1))
+        option_chain_limiter.acquire()
+        ret, data = opend.get_option_chain(underlying, start=window_start.strftime("%Y-%m-%d"),
+                                           end=window_end.strftime("%Y-%m-%d"))
+        if ret == RET_OK and isinstance(data, pd.DataFrame):
+            for _, row in data.iterrows():
+                try:
+                    expiry = datetime.strptime(str(row['strike_time'])[:10], "%Y-%m-%d").date()
+                except ValueError:
+                    continue
+                contracts.append({
+                    "option_code": row['code'], "expiry": expiry,
+                    "strike_price": float(row['strike_price']),
+                    "option_type": "Call" if row['option_type'] == OptionType.CALL else "Put",
+                })
+        else:
+            print(f"Error fetching option chain for {underlying} ({window_start} to {window_end}): {ret} - {data}")
+        window_start = window_end + timedelta(days=1)
+    return contracts
+
+class OptionChain:
+    """
+    One underlying's option chain with the latest quote of every contract, indexed by
+    (expiry, strike, type) for instant lookups from the GUI and the BS calculator.
+    `table` is a DataFrame sorted by that index for slicing; get() is a dict lookup.
+    """
+    QUOTE_FIELDS = ("last_price", "implied_volatility", "iv_source", "delta", "gamma", "vega", "theta", "rho")
+
+    def __init__(self, underlying, contracts, quotes=None, start=None, end=None):
+        self.underlying = underlying
+        self.start = start
+        self.end = end
+        self.loaded_at = time.time()
+        quotes = quotes or {}
+        rows = []
+        for contract in contracts:
+            quote = quotes.get(contract["option_code"], {})
+            row = dict(contract, **{field: quote.get(field) for field in self.QUOTE_FIELDS})
+            if quote:
+                row["iv_source"] = quote.get("iv_source", "futu")
+            rows.append(row)
+        self._by_key = {(row["expiry"], row["strike_price"], row["option_type"]): row for row in rows}
+        self._by_code = {row["option_code"]: row for row in rows}
+        columns = ["option_code", "expiry", "strike_price", "option_type", *self.QUOTE_FIELDS]
+        self.table = pd.DataFrame(rows, columns=columns).set_index(
+            ["expiry", "strike_price", "option_type"]).sort_index()
+
+    def __len__(self):
+        return len(self._by_code)
+
+    @property
+    def codes(self):
+        return list(self._by_code)
+
+    def expiries(self):
+        return sorted({key[0] for key in self._by_key})
+
+    def strikes(self, expiry, option_type=None):
+        return sorted({strike for (exp, strike, kind) in self._by_key
+                       if exp == expiry and (option_type is None or kind == option_type)})
+
+    def get(self, expiry, strike_price, option_type):
+        """Contract record (code plus quote fields) or None. option_type is "Call" or "Put"."""
+        row = self._by_key.get((expiry, float(strike_price), option_type))
+        return dict(row) if row else None
+
+    def get_by_code(self, option_code):
+        row = self._by_code.get(option_code)
+        return dict(row) if row else None
+
+    def nearest_expiry(self, target_date):
+        """Listed expiry closest to target_date (ties go to the later one), or None."""
+        expiries = self.expiries()
+        if not expiries:
+            return None
+        return min(expiries, key=lambda expiry: (abs((expiry - target_date).days), -expiry.toordinal()))
+
+    def age(self):
+        return time.time() - self.loaded_at
+
+class OptionChainCache:
+    """
+    Loaded chains keyed by (underlying, start, end), reused for OPTION_CHAIN_TTL seconds so
+    repeated lookups don't go back to OpenD. Least recently used chains are evicted first.
+    """
+
+    def __init__(self, ttl_seconds=OPTION_CHAIN_TTL, max_entries=32):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._chains = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, underlying, start, end):
+        with self._lock:
+            chain = self._chains.get((underlying, start, end))
+            if chain is None:
+                return None
+            if chain.age() > self.ttl_seconds:
+                del self._chains[(underlying, start, end)]
+                return None
+            self._chains.move_to_end((underlying, start, end))
+            return chain
+
+    def put(self, chain):
+        with self._lock:
+            self._chains[(chain.underlying, chain.start, chain.end)] = chain
+            self._chains.move_to_end((chain.underlying, chain.start, chain.end))
+            while len(self._chains) > self.max_entries:
+                self._chains.popitem(last=False)
+        return chain
+
+    def find(self, underlying, expiry=None):
+        """Freshest unexpired cached chain of `underlying` (covering `expiry` if given), or None."""
+        with self._lock:
+            candidates = [chain for (code, _, _), chain in self._chains.items()
+                          if code == underlying and chain.age() <= self.ttl_seconds
+                          and (expiry is None or chain.start <= expiry <= chain.end)]
+        return max(candidates, key=lambda chain: chain.loaded_at) if candidates else None
+
+    def clear(self):
+        with self._lock:
+            self._chains.clear()
+
+option_chain_cache = register_provider_cache(OptionChainCache())
+
+def load_option_chain(underlying, start=None, end=None, with_quotes=True, force=False):
+    """
+    Load the option chain of `underlying` (Futu code) for expiries between start and end
+    (default: today through OPTION_CHAIN_DEFAULT_DAYS), snapshot every contract in batched
+    calls, and cache the resulting OptionChain for OPTION_CHAIN_TTL seconds.
+    """
+    start = start or datetime.now().date()
+    end = end or start + timedelta(days=OPTION_CHAIN_DEFAULT_DAYS)
+    if not force:
+        chain = option_chain_cache.get(underlying, start, end)
+        if chain is not None:
+            return chain
+    contracts = market_data_provider.get_option_chain(underlying, start, end)
+    quotes = market_data_provider.get_option_quotes([c["option_code"] for c in contracts]) if with_quotes and contracts else {}
+    if quotes:
+        ticker_symbol = to_yahoo_symbol(underlying)
+        entry = underlying_price_cache.fetch([ticker_symbol]).get(ticker_symbol)
+        if entry:
+            quotes = fill_missing_implied_volatility(quotes, {ticker_symbol: entry["price"]})
+    chain = OptionChain(underlying, contracts, quotes, start, end)
+    print(f"Loaded option chain for {underlying}: {len(chain)} contracts, {len(chain.expiries())} expiries, {len(quotes)} quoted")
+    return option_chain_cache.put(chain)
+
+# --- Volatility Surface ---
+# SVI smiles per expiry fitted from loaded chains (see vol_surface.py); refit only when the chain's
+# IVs or the spot moved beyond vol_surface.REFIT_* tolerances
+vol_surface_cache = VolSurfaceCache()
+
+def load_vol_surface(underlying, chain=None):
+    """
+    Return the fitted volatility surface of `underlying` (Futu code), loading its option chain
+    (cached) if none is given. Returns None if there is no underlying price to fit around.
+    """
+    chain = chain or load_option_chain(underlying)
+    ticker_symbol = to_yahoo_symbol(underlying)
+    entry = underlying_price_cache.fetch([ticker_symbol]).get(ticker_symbol)
+    if not entry:
+        print(f"No underlying price for {underlying}; cannot fit a volatility surface")
+        return None
+    fits = vol_surface_cache.fits
+    surface = vol_surface_cache.get(chain, entry["price"], RISK_FREE_RATE)
+    if vol_surface_cache.fits != fits:
+        print(f"Fitted volatility surface for {underlying}: {len(surface.smiles)} expiries")
+    return surface
+
+def format_quote_age(entry):
+    """Describe where a cached price came from and how old it is, e.g. "yahoo-batch, 42s old"."""
+    age = UnderlyingPriceCache.age(entry)
+    age_text = f"{age:.0f}s" if age < 120 else f"{age / 60:.0f}m" if age < 7200 else f"{age / 3600:.1f}h"
+    return f"{entry['source']}, {age_text} old"
+
+def format_quote_time(entry):
+    """Describe where a cached price came from and when it was quoted, e.g. "yahoo-batch, as of 14:03:12"."""
+    return f"{entry['source']}, as of {entry['timestamp'].astimezone().strftime('%H:%M:%S')}"
+
+def fetch_yahoo_price(ticker_symbol):
+    """Return the latest price for one ticker via the shared cache. Returns 0.0 if unavailable."""
+    entry = underlying_price_cache.fetch([ticker_symbol]).get(ticker_symbol)
+    return entry["price"] if entry else 0.0
+
+def get_underlying_price(ticker_symbol, underlying_prices_cache):
+    """Return the Yahoo price for a ticker, fetching it only if it is not already in the cache."""
+    if ticker_symbol in underlying_prices_cache:
+        return underlying_prices_cache[ticker_symbol]
+    price = fetch_yahoo_price(ticker_symbol)
+    if price > 0:
+        underlying_prices_cache[ticker_symbol] = price
+    return price
+
+# --- Implied Volatility Solver ---
+# Last solved IV per option code, used to warm-start the next tick's solve
+solved_iv_cache = {}
+
+def fill_missing_implied_volatility(option_quotes, underlying_prices):
+    """
+    Solve IV from the market price, in one batch, for every quote Futu sent without one
+    (implied_volatility <= 0). `underlying_prices` maps Yahoo ticker -> price. Returns a new
+    dict: solved quotes are copies with the solved IV and "iv_source" = "solved"; others are
+    returned unchanged. Legs that cannot be solved (no underlying price, price outside the
+    no-arbitrage bounds, expiry today) keep IV 0.
+    """
+    candidates = []
+    for code, quote in option_quotes.items():
+        if quote.get("implied_volatility", 0) > 0 or quote.get("last_price", 0) <= 0:
+            continue
+        if quote.get("strike_price", 0) <= 0 or quote.get("days_to_expiry", 0) <= 0 or quote.get("option_type") == "Unknown":
+            continue
+        underlying_price = underlying_prices.get(to_yahoo_symbol(quote["stock_owner"])) if quote.get("stock_owner") else None
+        if underlying_price and underlying_price > 0:
+            candidates.append((code, quote, underlying_price))
+    if not candidates:
+        return option_quotes
+
+    codes = [code for code, _, _ in candidates]
+    sigma, converged = bs_implied_volatility(
+        price=[quote["last_price"] for _, quote, _ in candidates],
+        S=[underlying_price for _, _, underlying_price in candidates],
+        K=[quote["strike_price"] for _, quote, _ in candidates],
+        T=[quote["days_to_expiry"] / 365.0 for _, quote, _ in candidates],
+        r=RISK_FREE_RATE,
+        option_type=[quote["option_type"] for _, quote, _ in candidates],
+        initial=[solved_iv_cache.get(code, float('nan')) for code in codes])
+
+    filled = dict(option_quotes)
+    for (code, quote, _), iv, ok in zip(candidates, sigma, converged):
+        if ok:
+            filled[code] = dict(quote, implied_volatility=float(iv), iv_source="solved")
+            solved_iv_cache[code] = float(iv)
+        else:
+            print(f"  Could not solve IV for {code} from price {quote['last_price']}")
+    return filled
+
+def build_option_greeks_data(option_futu_code, option_quote, underlying_prices_cache, theoretical_price=None):
+    """
+    Combine a parsed option quote with the Yahoo underlying price and the theoretical price
+    (American tree for HK options, Black-Scholes otherwise). Pass theoretical_price if it
+    was already computed in a batch (TickQuoteStore.price_american_legs).
+    """
+    option_price = option_quote["last_price"]
+    strike_price = option_quote["strike_price"]
+    implied_volatility = option_quote["implied_volatility"]
+    option_type_str = option_quote["option_type"]
+    days_to_expiry = option_quote["days_to_expiry"]
+
     actual_underlying_price = 0.0
-    underlying_stock_code_from_futu = option_snapshot.get('stock_owner', None)
+    underlying_stock_code_from_futu = option_quote["stock_owner"]
     if underlying_stock_code_from_futu:
-        ticker_symbol_parts = underlying_stock_code_from_futu.split('.')
-        ticker_symbol = ticker_symbol_parts[-1] if len(ticker_symbol_parts) > 0 else None
+        ticker_symbol = to_yahoo_symbol(underlying_stock_code_from_futu)
         if ticker_symbol:
-            if ticker_symbol in underlying_prices_cache:
-                actual_underlying_price = underlying_prices_cache[ticker_symbol]
-            else:
-                print(f"  Fetching underlying price for {ticker_symbol} from Yahoo Finance...")
-                try:
-                    stock_yf_ticker = yf.Ticker(ticker_symbol)
-                    stock_info = stock_yf_ticker.info
-                    if 'currentPrice' in stock_info and stock_info['currentPrice'] is not None:
-                        actual_underlying_price = stock_info['currentPrice']
-                    elif 'regularMarketPrice' in stock_info and stock_info['regularMarketPrice'] is not None:
-                        actual_underlying_price = stock_info['regularMarketPrice']
-                    elif 'previousClose' in stock_info and stock_info['previousClose'] is not None:
-                        actual_underlying_price = stock_info['previousClose']
-                        print(f"    (Using previous close for {ticker_symbol} from Yahoo Finance: ${actual_underlying_price:.2f})")
-                    else:
-                        hist = stock_yf_ticker.history(period="1d", interval="1m")
-                        if isinstance(hist, pd.DataFrame) and not hist.empty:
-                            actual_underlying_price = hist['Close'].iloc[-1]
-                            print(f"    (Using last 1m history close for {ticker_symbol} from Yahoo Finance: ${actual_underlying_price:.2f})")
-                        else: print(f"    Could not find price for {ticker_symbol} from Yahoo Finance info or history.")
-                    if actual_underlying_price > 0:
-                        print(f"    Successfully fetched underlying price for {ticker_symbol} from Yahoo Finance: ${actual_underlying_price:.2f}")
-                        underlying_prices_cache[ticker_symbol] = actual_underlying_price
-                    else: print(f"    Failed to get a valid price for {ticker_symbol} from Yahoo Finance.")
-                except Exception as e: print(f"    Error fetching underlying price for {ticker_symbol} from Yahoo Finance: {e}")
+            actual_underlying_price = get_underlying_price(ticker_symbol, underlying_prices_cache)
         else: print(f"  Warning: Could not extract ticker from '{underlying_stock_code_from_futu}'")
     else: print(f"  Warning: No 'stock_owner' for {option_futu_code}.")
 
+    if implied_volatility <= 0 and actual_underlying_price > 0:
+        option_quote = fill_missing_implied_volatility({option_futu_code: option_quote}, {ticker_symbol: actual_underlying_price})[option_futu_code]
+        implied_volatility = option_quote["implied_volatility"]
+
     theoretical_bs_price = 0.0
+    second_order = dict.fromkeys(SECOND_ORDER_GREEKS, 0.0)
+    pricing_model = "american" if uses_american_pricing(option_futu_code.split('.')[0]) else "black-scholes"
     if actual_underlying_price > 0 and strike_price > 0 and implied_volatility > 0 and option_type_str != "Unknown":
         T_years = max(0, days_to_expiry / 365.0) 
-        theoretical_bs_price = black_scholes_price(
-            S=actual_underlying_price, K=strike_price, T=T_years,
-            r=RISK_FREE_RATE, sigma=implied_volatility, option_type=option_type_str
-        )
+        # One (cached) Black-Scholes pass gives the BS price and the second-order Greeks together;
+        # Futu only reports first-order Greeks
+        model = greeks_cache.greeks(actual_underlying_price, strike_price, T_years, RISK_FREE_RATE,
+                                    implied_volatility, option_type_str)
+        second_order = {name: model[name] for name in SECOND_ORDER_GREEKS}
+        if theoretical_price is not None:
+            theoretical_bs_price = theoretical_price
+        elif pricing_model == "american":
+            theoretical_bs_price = theoretical_option_price(
+                S=actual_underlying_price, K=strike_price, T=T_years,
+                r=RISK_FREE_RATE, sigma=implied_volatility, option_type=option_type_str,
+                underlying=underlying_stock_code_from_futu or option_futu_code
+            )
+        else:
+            theoretical_bs_price = model["price"]
+    elif theoretical_price is not None:
+        theoretical_bs_price = theoretical_price
     else:
         print(f"  Skipping BS calculation for {option_futu_code} due to missing inputs (Underlying: {actual_underlying_price}, IV: {implied_volatility})")
 
-    return {"option_code": option_futu_code,"underlying_price": actual_underlying_price, 
+    return {"option_code": option_futu_code, "underlying_code": underlying_stock_code_from_futu,
+            "underlying_price": actual_underlying_price, 
             "strike_price": strike_price, "current_option_price": option_price, 
-            "volatility": implied_volatility, "interest_rate": RISK_FREE_RATE, 
+            "volatility": implied_volatility, "iv_source": option_quote.get("iv_source", "futu"),
+            "interest_rate": RISK_FREE_RATE, 
             "days_to_expiry": days_to_expiry, "option_type": option_type_str, 
-            "delta": delta, "gamma": gamma, "vega": vega, "theta": theta, "rho": rho,
-            "theoretical_price_bs": theoretical_bs_price}
+            "delta": option_quote["delta"], "gamma": option_quote["gamma"], "vega": option_quote["vega"],
+            "theta": option_quote["theta"], "rho": option_quote["rho"], **second_order,
+            "theoretical_price_bs": theoretical_bs_price, "pricing_model": pricing_model}
+
+def get_real_option_data_batch(option_codes, underlying_prices_cache):
+    """
+    Fetch every option leg of a portfolio with batched snapshot calls.
+    Returns a dict mapping option code -> greeks data (same shape as get_real_option_data).
+    """
+    quotes = TickQuoteStore(underlying_prices=underlying_prices_cache)
+    quotes.prefetch_options(option_codes)
+    quotes.prefetch_underlyings(quotes.underlying_symbols())
+    quotes.solve_missing_iv()
+    quotes.price_american_legs()
+    return {code: quotes.get_option_greeks_data(code) for code in quotes.option_quotes}
+
+def get_real_option_data(option_futu_code, underlying_prices_cache):
+    snapshots = market_data_provider.get_option_quotes([option_futu_code])
+    if option_futu_code not in snapshots:
+        return None
+    return build_option_greeks_data(option_futu_code, snapshots[option_futu_code], underlying_prices_cache)
+
+# --- Tick Capture ---
+# Every monitor tick's option quotes are buffered here and written to disk by a
+# background thread (see tick_capture.py; read back with tick_capture.load_ticks)
+tick_recorder = TickRecorder(TICK_CAPTURE_DIR) if TICK_CAPTURE_DIR else None
+if tick_recorder is not None:
+    atexit.register(tick_recorder.close)
+
+# --- Tick Quote Store ---
+class TickQuoteStore:
+    """
+    Quotes for a single monitor tick. Each option code and each Yahoo ticker is
+    fetched at most once; the leg display, portfolio summary, spread metrics and
+    threshold checks all read from the same store. Create a new store per tick.
+    """
+
+    def __init__(self, option_quotes=None, underlying_prices=None):
+        # option code -> parsed snapshot record; seed with streamed quotes to skip snapshot calls
+        self.option_quotes = dict(option_quotes) if option_quotes else {}
+        self.option_greeks_data = {}  # option code -> greeks data (with underlying and BS price)
+        self.theoretical_prices = {}  # option code -> American price from price_american_legs
+        # Yahoo ticker -> price used this tick (prices themselves are cached across ticks by underlying_price_cache)
+        self.underlying_prices = underlying_prices if underlying_prices is not None else {}
+        self.underlying_quotes = {}   # Yahoo ticker -> underlying_price_cache entry used this tick
+        self.missing_option_codes = set()
+        self.missing_underlyings = set()  # tickers already tried this tick without a price
+
+    def prefetch_options(self, option_codes):
+        """Fetch every option code not yet in the store with batched snapshot calls."""
+        missing = [code for code in dict.fromkeys(option_codes)
+                   if code and code not in self.option_quotes and code not in self.missing_option_codes]
+        if not missing:
+            return
+        fetched = market_data_provider.get_option_quotes(missing)
+        self.option_quotes.update(fetched)
+        self.missing_option_codes.update(code for code in missing if code not in fetched)
+
+    def underlying_symbols(self, stock_tickers=()):
+        """Distinct Yahoo symbols of the fetched options' underlyings plus any stock tickers."""
+        codes = [quote["stock_owner"] for quote in self.option_quotes.values() if quote.get("stock_owner")]
+        return list(dict.fromkeys(to_yahoo_symbol(code) for code in list(codes) + list(stock_tickers)))
+
+    def prefetch_underlyings(self, ticker_symbols):
+        """Load every Yahoo ticker not yet in the store from the shared cache (one batch for misses)."""
+        missing = [sym for sym in dict.fromkeys(ticker_symbols)
+                   if sym and sym not in self.underlying_prices and sym not in self.missing_underlyings]
+        if not missing:
+            return
+        fetched = underlying_price_cache.fetch(missing)
+        self.underlying_quotes.update(fetched)
+        for ticker_symbol, entry in fetched.items():
+            self.underlying_prices[ticker_symbol] = entry["price"]
+        self.missing_underlyings.update(sym for sym in missing if sym not in fetched)
+
+    def solve_missing_iv(self):
+        """Batch-solve IV for every fetched option quote that arrived without one."""
+        self.option_quotes = fill_missing_implied_volatility(self.option_quotes, self.underlying_prices)
+
+    def price_american_legs(self):
+        """Price every American-style (HK) option in the store on one batched binomial tree."""
+        legs = []
+        for code, quote in self.option_quotes.items():
+            if code in self.theoretical_prices or not uses_american_pricing(code.split('.')[0]):
+                continue
+            underlying = quote.get("stock_owner")
+            S = self.underlying_prices.get(to_yahoo_symbol(underlying)) if underlying else None
+            if S and S > 0 and quote["strike_price"] > 0 and quote["implied_volatility"] > 0 and quote["option_type"] != "Unknown":
+                legs.append((code, quote, S, dividend_yield(underlying)))
+        if not legs:
+            return
+        prices = american_price([S for _, _, S, _ in legs], [quote["strike_price"] for _, quote, _, _ in legs],
+                                [max(0, quote["days_to_expiry"]) / 365.0 for _, quote, _, _ in legs], RISK_FREE_RATE,
+                                [quote["implied_volatility"] for _, quote, _, _ in legs],
+                                [quote["option_type"] for _, quote, _, _ in legs],
+                                q=[q for _, _, _, q in legs], steps=AMERICAN_TREE_STEPS)
+        self.theoretical_prices.update((code, float(price)) for (code, _, _, _), price in zip(legs, prices))
+
+    def apply_option_quotes(self, option_quotes):
+        """
+        Swap in pushed records for option codes already in the store and re-derive only those
+        codes (IV solve, American price, greeks data) from the underlying prices already loaded,
+        so no network calls are made. Returns the codes applied; any others need a full tick.
+        """
+        pushed = {}
+        for code, record in option_quotes.items():
+            underlying = record.get("stock_owner")
+            if code in self.option_quotes and underlying and to_yahoo_symbol(underlying) in self.underlying_prices:
+                pushed[code] = record
+        if not pushed:
+            return []
+        self.option_quotes.update(fill_missing_implied_volatility(pushed, self.underlying_prices))
+        for code in pushed:
+            self.option_greeks_data.pop(code, None)
+            self.theoretical_prices.pop(code, None)
+        self.price_american_legs()
+        for code in pushed:
+            self.get_option_greeks_data(code)
+        if tick_recorder is not None:
+            tick_recorder.record_greeks(self.option_greeks_data.get(code) for code in pushed)
+        return list(pushed)
+
+    def get_underlying_quote(self, code):
+        """Return the cache entry (price, timestamp, source) for a Futu code or Yahoo ticker, if loaded."""
+        ticker_symbol = to_yahoo_symbol(code)
+        if ticker_symbol not in self.underlying_quotes:
+            self.prefetch_underlyings([ticker_symbol])
+        return self.underlying_quotes.get(ticker_symbol)
+
+    def get_option_quote(self, option_code):
+        """Return the parsed snapshot record for an option code, or None if unavailable."""
+        self.prefetch_options([option_code])
+        return self.option_quotes.get(option_code)
+
+    def get_option_greeks_data(self, option_code):
+        """Return greeks data for an option code (same shape as get_real_option_data)."""
+        if option_code not in self.option_greeks_data:
+            option_quote = self.get_option_quote(option_code)
+            if option_quote is None:
+                return None
+            self.option_greeks_data[option_code] = build_option_greeks_data(
+                option_code, option_quote, self.underlying_prices, self.theoretical_prices.get(option_code))
+        return self.option_greeks_data[option_code]
+
+    def get_stock_price(self, ticker):
+        """Return the Yahoo price for a stock ticker ("US.AAPL" or "AAPL"); 0.0 if unavailable."""
+        entry = self.get_underlying_quote(ticker)
+        return entry["price"] if entry else 0.0
+
+def load_tick_quotes(option_codes, stock_tickers=(), option_quotes=None):
+    """
+    Build a TickQuoteStore holding every quote one monitor tick needs: option snapshots
+    (or streamed quotes), underlying and stock prices, and the per-leg greeks data.
+    Does all the network I/O up front, so it can run on a worker thread. Moves replayed
+    and simulated market data on by one tick first.
+    """
+    market_data_provider.advance()
+    quotes = TickQuoteStore(option_quotes)
+    quotes.prefetch_options(option_codes)
+    quotes.prefetch_underlyings(quotes.underlying_symbols(stock_tickers))
+    quotes.solve_missing_iv()
+    quotes.price_american_legs()
+    for option_code in option_codes:
+        quotes.get_option_greeks_data(option_code)
+    if tick_recorder is not None:
+        tick_recorder.record_greeks(quotes.option_greeks_data.values())
+    return quotes
+
+# --- Background Fetching ---
+class BackgroundFetcher:
+    """
+    Runs blocking market-data jobs on worker threads so the Tk event loop never waits on
+    Futu or Yahoo. Finished jobs are queued; the UI thread calls drain() from an `after`
+    timer, which runs each job's callback on the UI thread.
+    """
+
+    def __init__(self, max_workers=2, name="market-data"):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.results = queue.Queue()
+
+    def submit(self, job, on_done, on_error=None, *args, **kwargs):
+        """Run job(*args, **kwargs) on a worker; on_done(result) or on_error(exc) runs in drain()."""
+        future = self.executor.submit(job, *args, **kwargs)
+        future.add_done_callback(lambda done: self.results.put((done, on_done, on_error)))
+        return future
+
+    def drain(self):
+        """Run the callbacks of every finished job. Call this from the UI thread only."""
+        handled = 0
+        while True:
+            try:
+                future, on_done, on_error = self.results.get_nowait()
+            except queue.Empty:
+                return handled
+            handled += 1
+            error = future.exception()
+            try:
+                if error is None:
+                    on_done(future.result())
+                elif on_error is not None:
+                    on_error(error)
+                else:
+                    print(f"Background fetch failed: {error}")
+            except Exception as e:
+                print(f"Error handling background fetch result: {e}")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# --- Streaming Quotes (OpenD push) ---
+# Quote push columns -> option quote record fields (see parse_option_snapshot)
+PUSH_QUOTE_FIELDS = {
+    'last_price': 'last_price',
+    'strike_price': 'strike_price',
+    'delta': 'delta',
+    'gamma': 'gamma',
+    'vega': 'vega',
+    'theta': 'theta',
+    'rho': 'rho',
+}
+
+def parse_option_quote_push(row):
+    """Extract the option quote fields present in one row of a quote push."""
+    fields = {}
+    for push_field, record_field in PUSH_QUOTE_FIELDS.items():
+        value = row.get(push_field)
+        if value is not None and pd.notna(value):
+            fields[record_field] = float(value)
+    implied_volatility = row.get('implied_volatility')
+    if implied_volatility is not None and pd.notna(implied_volatility):
+        fields['implied_volatility'] = float(implied_volatility) / 100.0
+    for static_field in ('stock_owner', 'option_type', 'days_to_expiry'):
+        value = row.get(static_field)
+        if value is not None and not (isinstance(value, float) and pd.isna(value)):
+            fields[static_field] = value
+    return fields
+
+def _empty_option_record(option_code):
+    return {"option_code": option_code, "last_price": 0.0, "strike_price": 0.0,
+            "implied_volatility": 0.0, "delta": 0.0, "gamma": 0.0, "vega": 0.0,
+            "theta": 0.0, "rho": 0.0, "option_type": "Unknown", "days_to_expiry": 0,
+            "stock_owner": None}
+
+def _make_quote_push_handler(stream):
+    """Build a quote push handler that forwards parsed rows to `stream`."""
+    handler_base = globals().get('StockQuoteHandlerBase', object)
+
+    class OptionQuotePushHandler(handler_base):
+        def on_recv_rsp(self, rsp_pb):
+            ret_code, data = super().on_recv_rsp(rsp_pb)
+            if ret_code == RET_OK:
+                self.on_quote_rows(data)
+            else:
+                print(f"Quote push error: {data}")
+            return ret_code, data
+
+        def on_quote_rows(self, data):
+            stream.apply_quote_rows(data)
+
+    return OptionQuotePushHandler()
+
+class QuoteStream:
+    """
+    Latest-quote table kept current by OpenD quote pushes instead of polling.
+    `push_source` is an OpenQuoteContext (or FakeQuotePushSource for local runs).
+    Pushes arrive on Futu's callback thread; consumers either register a listener
+    or call consume_changes() from their own thread to see which codes changed.
+    """
+
+    def __init__(self, push_source, initial_snapshot=get_option_snapshots):
+        self.push_source = push_source
+        self.initial_snapshot = initial_snapshot
+        self.latest_quotes = {}
+        self.subscribed_codes = set()
+        self.listeners = []
+        self._changed_codes = set()
+        self._lock = threading.Lock()
+        self._set_codes_lock = threading.Lock()
+        self.handler = _make_quote_push_handler(self)
+        self.push_source.set_handler(self.handler)
+
+    def set_codes(self, option_codes):
+        """
+        Subscribe to new codes and unsubscribe codes no longer held. Blocks on OpenD (and
+        the initial snapshot), so the GUI runs it on a worker; calls are serialized.
+        """
+        wanted = {code for code in option_codes if code}
+        with self._set_codes_lock:
+            added = sorted(wanted - self.subscribed_codes)
+            removed = sorted(self.subscribed_codes - wanted)
+            if removed:
+                ret, err = self.push_source.unsubscribe(removed, [SubType.QUOTE])
+                if ret != RET_OK:
+                    print(f"Failed to unsubscribe {removed}: {err}")
+                with self._lock:
+                    self.subscribed_codes.difference_update(removed)
+                    for code in removed:
+                        self.latest_quotes.pop(code, None)
+            if added:
+                if self.initial_snapshot is not None:
+                    # Pushes only carry the changing fields; seed strike, type and expiry from a snapshot
+                    initial_quotes = self.initial_snapshot(added)
+                    with self._lock:
+                        self.latest_quotes.update(initial_quotes)
+                        self._changed_codes.update(initial_quotes)
+                ret, err = self.push_source.subscribe(added, [SubType.QUOTE], subscribe_push=True)
+                if ret != RET_OK:
+                    print(f"Failed to subscribe {added}: {err}")
+                else:
+                    with self._lock:
+                        self.subscribed_codes.update(added)
+            return added, removed
+
+    def stop(self):
+        """Drop every subscription."""
+        self.set_codes([])
+
+    def apply_quote_rows(self, data):
+        """Merge pushed rows into the latest-quote table and notify on real changes."""
+        changed = set()
+        with self._lock:
+            for _, row in data.iterrows():
+                code = row.get('code')
+                if code not in self.subscribed_codes:
+                    continue
+                current = self.latest_quotes.get(code) or _empty_option_record(code)
+                updated = dict(current)
+                updated.update(parse_option_quote_push(row))
+                if updated != current:
+                    self.latest_quotes[code] = updated
+                    changed.add(code)
+            self._changed_codes.update(changed)
+        if changed:
+            for listener in list(self.listeners):
+                try:
+                    listener(changed)
+                except Exception as e:
+                    print(f"Quote stream listener error: {e}")
+        return changed
+
+    def consume_changes(self):
+        """Return the codes changed since the last call and reset the change set."""
+        with self._lock:
+            changed, self._changed_codes = self._changed_codes, set()
+        return changed
+
+    def get_quotes(self, codes=None):
+        """Return a copy of the latest-quote table, or of just the given codes that are in it."""
+        with self._lock:
+            if codes is None:
+                return {code: dict(record) for code, record in self.latest_quotes.items()}
+            return {code: dict(self.latest_quotes[code]) for code in codes if code in self.latest_quotes}
+
+class FakeQuotePushSource:
+    """
+    In-process stand-in for OpenD's quote push, for running QuoteStream without OpenD.
+    Call push(code, last_price=..., delta=...) to deliver a quote to the handler.
+    """
+
+    def __init__(self):
+        self.handler = None
+        self.subscribed_codes = set()
+
+    def set_handler(self, handler):
+        self.handler = handler
+        return RET_OK
+
+    def subscribe(self, code_list, subtype_list, subscribe_push=True):
+        self.subscribed_codes.update(code_list)
+        return RET_OK, None
+
+    def unsubscribe(self, code_list, subtype_list):
+        self.subscribed_codes.difference_update(code_list)
+        return RET_OK, None
+
+    def push(self, code, **fields):
+        """Deliver one quote row; ignored unless the code is subscribed."""
+        if self.handler is None or code not in self.subscribed_codes:
+            return
+        self.handler.on_quote_rows(pd.DataFrame([{'code': code, **fields}]))
 
 # --- Combined Greeks Calculation and Display ---
-def calculate_and_display_combined_summary(positions_data_list):
+def calculate_and_display_combined_summary(positions_data_list, aggregator=None):
+    """
+    Print each leg and the combined portfolio totals. The totals come from a
+    PortfolioAggregator keyed by leg number; pass a long-lived `aggregator` to
+    reuse it across ticks so only legs whose quotes changed are re-added.
+    """
     if not positions_data_list: print("No data for combined summary."); return None 
+    aggregator = aggregator if aggregator is not None else PortfolioAggregator(CONTRACT_MULTIPLIER)
+    summary = combined_summary(positions_data_list, aggregator)
 
-    net_delta_per_share_equivalent = 0.0
-    net_gamma_per_share_equivalent = 0.0
-    net_vega_per_share_equivalent = 0.0
-    net_theta_per_share_equivalent = 0.0
-    net_rho_per_share_equivalent = 0.0
-    
-    total_market_value, total_theoretical_bs_value, total_pnl = 0.0, 0.0, 0.0
-    underlying_price_sum, underlying_price_count = 0.0, 0
-    
-    total_delta_options = 0.0
-    total_delta_stocks = 0.0
-    
     print("\n--- Individual Leg Data & P&L (Raw API Values & BS Price) ---")
-    for item in positions_data_list:
+    for index, item in enumerate(positions_data_list):
         greeks_data, quantity, entry_cost = item['greeks_data'], item['quantity'], item['entry_cost']
         # Use option_code for options, ticker for stocks, or 'STOCK' as fallback
         leg_label = greeks_data.get('option_code') or greeks_data.get('ticker') or 'STOCK'
@@ -262,14 +2045,12 @@ def calculate_and_display_combined_summary(positions_data_list):
         print(f"  Leg: {leg_label}, Qty: {quantity}, Entry Cost/Share: ${entry_cost:.3f}")
         
         current_market_price = greeks_data['current_option_price']
-        leg_pnl = 0.0
+        leg_pnl = aggregator.leg_pnl(leg_key(item, index))
         if entry_cost is not None: 
             if quantity > 0: 
-                leg_pnl = (current_market_price - entry_cost) * quantity * multiplier
                 print(f"    Long position P&L calculation:")
                 print(f"    (Current: ${current_market_price:.3f} - Entry: ${entry_cost:.3f}) × Qty: {quantity} × Multiplier: {multiplier} = ${leg_pnl:,.2f}")
             else: 
-                leg_pnl = (entry_cost - current_market_price) * abs(quantity) * multiplier
                 print(f"    Short position P&L calculation:")
                 print(f"    (Entry: ${entry_cost:.3f} - Current: ${current_market_price:.3f}) × |Qty: {quantity}| × Multiplier: {multiplier} = ${leg_pnl:,.2f}")
 
@@ -277,61 +2058,143 @@ def calculate_and_display_combined_summary(positions_data_list):
         underlying_price_display = f"${greeks_data['underlying_price']:.2f} (Yahoo)" if 'underlying_price' in greeks_data and greeks_data['underlying_price'] > 0 else "N/A"
         theoretical_bs = greeks_data.get('theoretical_price_bs', 0.0)
         iv = greeks_data.get('volatility', 0.0)
-        print(f"    Market OptPrice: ${current_market_price:.3f}, BS OptPrice: ${theoretical_bs:.3f}, Leg P&L: ${leg_pnl:,.2f}")
-        print(f"    IV: {iv:.2%}, Underlying: {underlying_price_display}")
+        model_label = "American" if greeks_data.get('pricing_model') == "american" else "BS"
+        print(f"    Market OptPrice: ${current_market_price:.3f}, {model_label} OptPrice: ${theoretical_bs:.3f}, Leg P&L: ${leg_pnl:,.2f}")
+        iv_note = " (solved from price)" if greeks_data.get('iv_source') == "solved" else ""
+        print(f"    IV: {iv:.2%}{iv_note}, Underlying: {underlying_price_display}")
         print(f"    API Delta: {greeks_data['delta']:.4f}, API Gamma: {greeks_data['gamma']:.4f}, API Vega: {greeks_data['vega']:.4f}, API Theta: {greeks_data['theta']:.4f}, API Rho: {greeks_data['rho']:.4f}")
+        if 'vanna' in greeks_data:
+            print(f"    Model Vanna: {greeks_data['vanna']:.4f}, Volga: {greeks_data['volga']:.4f}, Charm: {greeks_data['charm']:.4f}, Speed: {greeks_data['speed']:.6f}")
 
-        net_delta_per_share_equivalent += greeks_data['delta'] * quantity
-        net_gamma_per_share_equivalent += greeks_data['gamma'] * quantity
-        net_vega_per_share_equivalent  += greeks_data['vega']  * quantity
-        net_theta_per_share_equivalent += greeks_data['theta'] * quantity
-        net_rho_per_share_equivalent   += greeks_data['rho']   * quantity
-        
-        total_market_value += current_market_price * quantity * multiplier
-        total_theoretical_bs_value += theoretical_bs * quantity * multiplier
-        total_pnl += leg_pnl
-
-        if is_option:
-            total_delta_options += greeks_data['delta'] * quantity * CONTRACT_MULTIPLIER
-        else:
-            total_delta_stocks += greeks_data['delta'] * quantity
-
-        if 'underlying_price' in greeks_data and greeks_data['underlying_price'] > 0:
-            underlying_price_sum += greeks_data['underlying_price']
-            underlying_price_count +=1
-    avg_underlying_price = underlying_price_sum / underlying_price_count if underlying_price_count > 0 else 0.0
+    print_combined_summary(summary)
+    return summary
 
+def print_combined_summary(summary):
+    """Print the portfolio totals of a PortfolioAggregator.summary()."""
+    avg_underlying_price = summary['avg_underlying']
     print("\n--- Combined Portfolio Summary ---")
     if avg_underlying_price > 0: print(f"  Average Underlying Price (Yahoo Finance): ${avg_underlying_price:.2f}")
     else: print(f"  Underlying Stock Price: Not fetched or N/A (Yahoo Finance).")
-    print(f"  Total Market Value of Positions: ${total_market_value:,.2f}")
-    print(f"  Total Theoretical BS Value:      ${total_theoretical_bs_value:,.2f}")
-    diff_value = total_market_value - total_theoretical_bs_value
+    print(f"  Total Market Value of Positions: ${summary['portfolio_market_value']:,.2f}")
+    print(f"  Total Theoretical BS Value:      ${summary['portfolio_bs_value']:,.2f}")
+    diff_value = summary['portfolio_market_value'] - summary['portfolio_bs_value']
     print(f"  Difference (Market - BS):        ${diff_value:,.2f}")
-    print(f"  Total P&L (based on entry costs): ${total_pnl:,.2f}")
-    print(f"  Net Delta (per-share equiv.): {net_delta_per_share_equivalent:,.4f}")
-    print(f"  Total Delta (options): {total_delta_options:,.2f}")
-    print(f"  Total Delta (stocks): {total_delta_stocks:,.2f}")
-    print(f"  Total Delta (all): {total_delta_options + total_delta_stocks:,.2f}")
-    print(f"  Net Gamma (per-share equiv.): {net_gamma_per_share_equivalent:,.4f} (Total Gamma: {net_gamma_per_share_equivalent * CONTRACT_MULTIPLIER:,.2f})")
-    print(f"  Net Vega  (per-share equiv.): {net_vega_per_share_equivalent:,.4f} (Total Vega: {net_vega_per_share_equivalent * CONTRACT_MULTIPLIER:,.2f})")
-    print(f"  Net Theta (per-share equiv.): {net_theta_per_share_equivalent:,.4f} (Total Theta: {net_theta_per_share_equivalent * CONTRACT_MULTIPLIER:,.2f})")
-    print(f"  Net Rho   (per-share equiv.): {net_rho_per_share_equivalent:,.4f} (Total Rho: {net_rho_per_share_equivalent * CONTRACT_MULTIPLIER:,.2f})")
+    print(f"  Total P&L (based on entry costs): ${summary['portfolio_pnl']:,.2f}")
+    print(f"  Net Delta (per-share equiv.): {summary['net_delta_per_share_equiv']:,.4f}")
+    print(f"  Total Delta (options): {summary['total_delta_options']:,.2f}")
+    print(f"  Total Delta (stocks): {summary['total_delta_stocks']:,.2f}")
+    print(f"  Total Delta (all): {summary['total_net_delta']:,.2f}")
+    for greek in ("gamma", "vega", "theta", "rho"):
+        per_share = summary[f'net_{greek}_per_share_equiv']
+        print(f"  Net {greek.capitalize():<5} (per-share equiv.): {per_share:,.4f} (Total {greek.capitalize()}: {per_share * CONTRACT_MULTIPLIER:,.2f})")
+    for greek in SECOND_ORDER_GREEKS:
+        per_share = summary[f'net_{greek}_per_share_equiv']
+        print(f"  Net {greek.capitalize():<5} (per-share equiv.): {per_share:,.6f} (Total {greek.capitalize()}: {per_share * CONTRACT_MULTIPLIER:,.4f})")
     print("-----------------------------------")
-    
-    return {
-            "net_delta_per_share_equiv": net_delta_per_share_equivalent,
-            "net_gamma_per_share_equiv": net_gamma_per_share_equivalent,
-            "net_vega_per_share_equiv": net_vega_per_share_equivalent,
-            "net_theta_per_share_equiv": net_theta_per_share_equivalent,
-            "net_rho_per_share_equiv": net_rho_per_share_equivalent,
-            "total_net_delta": total_delta_options + total_delta_stocks,
-            "total_net_gamma": net_gamma_per_share_equivalent * CONTRACT_MULTIPLIER,
-            "portfolio_market_value": total_market_value, 
-            "portfolio_bs_value": total_theoretical_bs_value,
-            "portfolio_pnl": total_pnl,
-            "avg_underlying": avg_underlying_price
+
+# --- Alert Rules ---
+def portfolio_metric_row(summary, var_result=None):
+    """Portfolio-scope metrics for alert rules (portfolio.pnl, portfolio.delta, ...); Greeks are position totals."""
+    initial_value = summary.get('initial_value', 0.0)
+    row = {
+        "pnl": summary['portfolio_pnl'],
+        "pnl_pct": summary['portfolio_pnl'] / initial_value * 100 if initial_value > 0 else float("nan"),
+        "market_value": summary['portfolio_market_value'],
+        "bs_value": summary['portfolio_bs_value'],
+        "delta": summary['total_net_delta'],
+        "avg_underlying": summary['avg_underlying'],
+        "initial_value": initial_value,
+        "legs": summary.get('legs', 0),
+    }
+    for greek in ("gamma", "vega", "theta", "rho") + SECOND_ORDER_GREEKS:
+        row[greek] = summary.get(f'net_{greek}_per_share_equiv', 0.0) * CONTRACT_MULTIPLIER
+    if var_result:
+        for level in var_result["var"]:
+            row[f"var_{level * 100:.0f}"] = var_result["var"][level]
+            row[f"es_{level * 100:.0f}"] = var_result["es"][level]
+    return row
+
+def spread_metric_row(spread_metrics, previous=None):
+    """Spread-scope metrics for alert rules (spread.name, spread.price, spread.delta_change, ...)."""
+    row = {name: spread_metrics[name] for name in ("name", "price", "delta") + SECOND_ORDER_GREEKS if name in spread_metrics}
+    row["abs_price"] = abs(spread_metrics['price'])
+    row["delta_change"] = abs(spread_metrics['delta'] - (previous or {}).get('delta', 0))
+    return row
+
+def leg_metric_row(leg_number, greeks_data, quantity, entry_cost):
+    """Leg-scope metrics for alert rules (leg.leg, leg.code, leg.pnl, leg.pnl_pct, leg.iv, ...)."""
+    contribution = dict(zip(AGGREGATE_FIELDS, leg_contribution(leg_inputs(greeks_data, quantity, entry_cost), CONTRACT_MULTIPLIER)))
+    row = {
+        "leg": leg_number,
+        "code": greeks_data.get('option_code') or greeks_data.get('ticker') or '',
+        "quantity": quantity,
+        "price": greeks_data['current_option_price'],
+        "entry_cost": entry_cost if entry_cost is not None else float("nan"),
+        "pnl": contribution["pnl"],
+        "pnl_pct": contribution["pnl"] / contribution["initial_value"] * 100 if contribution["initial_value"] > 0 else float("nan"),
+        "model_price": greeks_data.get('theoretical_price_bs', float("nan")),
+        "iv": greeks_data.get('volatility', float("nan")),
+        "underlying": greeks_data.get('underlying_price', float("nan")),
+        "days_to_expiry": greeks_data.get('days_to_expiry', float("nan")),
     }
+    for greek in ("delta", "gamma", "vega", "theta", "rho") + SECOND_ORDER_GREEKS:
+        row[greek] = greeks_data.get(greek, 0.0)
+    return row
+
+def build_metric_table(summary, spread_metrics_list=(), positions_data=(), var_result=None, previous_spreads=None):
+    """
+    One tick's MetricTable for the alert rules: the portfolio summary, every spread's
+    metrics (previous_spreads: last tick's {'name': {'delta': ..}} for delta_change) and
+    every leg in positions_data (items with leg_number, greeks_data, quantity, entry_cost).
+    """
+    previous_spreads = previous_spreads or {}
+    table = MetricTable()
+    table.add_scope("portfolio", [portfolio_metric_row(summary, var_result)])
+    table.add_scope("spread", [spread_metric_row(metrics, previous_spreads.get(metrics['name']))
+                               for metrics in spread_metrics_list], "name")
+    table.add_scope("leg", [leg_metric_row(item.get('leg_number', i + 1), item['greeks_data'], item['quantity'], item['entry_cost'])
+                            for i, item in enumerate(positions_data)], "leg")
+    return table
+
+def check_alert_rules(rules, table, state=None):
+    """
+    Evaluate every rule against the tick's metric table. Returns a match per (rule, row)
+    that holds, with match["notify"] True only where the alert state just fired it;
+    those are notified and saved.
+    """
+    state = alert_state if state is None else state
+    rows_cache = {}
+    matches = []
+    for rule, holds, released in rules.levels(table):
+        prefix = f"rule:{rule.name}:"
+        labels = table.labels[rule.row_scope]
+        rows = set(np.flatnonzero(holds).tolist())
+        pending = state.pending_keys(prefix)
+        if pending:
+            # Fired/cooling rows must see this tick too, so they can release and re-arm
+            index_of = {f"{prefix}{label}": i for i, label in enumerate(labels)}
+            rows.update(index_of[key] for key in pending if key in index_of)
+        for i in sorted(rows):
+            notify = state.update(f"{prefix}{labels[i]}", bool(holds[i]), None if released is None else bool(released[i]),
+                                  cooldown=rule.options.get("cooldown"))
+            if holds[i]:
+                match = rules.match(rule, table, i, rows_cache)
+                match["notify"] = notify
+                matches.append(match)
+    fired = [match for match in matches if match["notify"]]
+    for match in fired:
+        send_notification(f"Rule Alert - {rule_match_title(match)}", match["message"])
+    if fired:
+        # One file per tick for all new alerts (save_alert_data names files by the second)
+        save_alert_data('rules', {'matches': [
+            {'rule': match["rule"].name, 'expression': match["rule"].expression, 'scope': match["rule"].row_scope,
+             'label': match["label"], 'values': match["values"], 'message': match["message"]} for match in fired]})
+    return matches
+
+def rule_match_title(match):
+    """Rule name plus the spread/leg it matched on ("IC wide [spread Iron Condor]")."""
+    rule = match["rule"]
+    return f"{rule.name} [{rule.row_scope} {match['label']}]" if rule.row_scope != "portfolio" else rule.name
 
 def save_alert_data(alert_type, alert_data):
     """Save alert data to a JSON file."""
@@ -362,26 +2225,34 @@ def save_spreads_config(spreads):
         json.dump(spreads, f, indent=2)
     print(f"Spread configurations saved to {SPREADS_FILE}")
 
-def calculate_spread_metrics(spread, positions):
-    """Calculate metrics for a specific spread."""
-    spread_legs_data = []
+def calculate_spread_metrics(spread, positions, quotes=None):
+    """Calculate metrics for a specific spread. Pass the tick's TickQuoteStore to reuse its quotes."""
+    if quotes is None:
+        quotes = TickQuoteStore()
+    leg_positions = []
     for leg_num in spread['legs']:
         # Find the position with matching leg number
         leg_position = next((pos for pos in positions if pos['leg_number'] == leg_num), None)
         if leg_position is None:
             return None
-        
+        leg_positions.append(leg_position)
+    quotes.prefetch_options([pos['option_code'] for pos in leg_positions])
+
+    spread_legs_data = []
+    for leg_position in leg_positions:
         # Get current market data for the leg
         option_code = leg_position['option_code']
-        ret_option, data_option_df = quote_ctx.get_market_snapshot([option_code])
-        if ret_option != RET_OK or data_option_df.empty:
+        option_quote = quotes.get_option_quote(option_code)
+        if option_quote is None:
             return None
         
-        # Extract market data
+        # Extract market data (second-order Greeks come from the leg's model pass)
+        greeks_data = quotes.get_option_greeks_data(option_code) or {}
         market_data = {
             'option_code': option_code,
-            'current_option_price': data_option_df.iloc[0].get('last_price', 0.0),
-            'delta': data_option_df.iloc[0].get('option_delta', 0.0)
+            'current_option_price': option_quote['last_price'],
+            'delta': option_quote['delta'],
+            **{name: greeks_data.get(name, 0.0) for name in SECOND_ORDER_GREEKS}
         }
         
         # Combine position and market data
@@ -393,6 +2264,7 @@ def calculate_spread_metrics(spread, positions):
     # Calculate combined metrics
     spread_price = 0
     spread_delta = 0
+    spread_second_order = dict.fromkeys(SECOND_ORDER_GREEKS, 0.0)
     leg_details = []
     
     for leg_data in spread_legs_data:
@@ -413,6 +2285,8 @@ def calculate_spread_metrics(spread, positions):
         
         spread_price += leg_contribution
         spread_delta += delta_contribution
+        for name in SECOND_ORDER_GREEKS:
+            spread_second_order[name] += market_data[name] * (quantity / abs(quantity)) if quantity != 0 else 0
         
         leg_details.append({
             'code': market_data['option_code'],
@@ -427,6 +2301,7 @@ def calculate_spread_metrics(spread, positions):
         'name': spread['name'],
         'price': spread_price,
         'delta': spread_delta,
+        **spread_second_order,
         'legs': leg_details,
         'timestamp': datetime.now().isoformat()
     }
@@ -517,16 +2392,18 @@ def check_spread_thresholds(spread_metrics, spread_config):
     
     alerts = []
     
-    # Check if price is outside target range
-    if spread_config['target_price_upper'] is not None and abs(current_price) >= spread_config['target_price_upper']:
+    # Check if price is outside target range; each alert notifies only when its state fires
+    overrides = {'hysteresis': spread_config.get('hysteresis'), 'cooldown': spread_config.get('cooldown'),
+                 'min_band': spread_config.get('min_band')}
+    if alert_state.update_threshold(f"spread:{spread_id}:price_upper", abs(current_price), spread_config['target_price_upper'], "above", **overrides):
         price_label = "Debit" if current_price > 0 else "Credit"
         alerts.append(f"Price ${abs(current_price):.3f} {price_label} per spread reached or exceeded upper target ${spread_config['target_price_upper']:.3f}")
     
-    if spread_config['target_price_lower'] is not None and abs(current_price) <= spread_config['target_price_lower']:
+    if alert_state.update_threshold(f"spread:{spread_id}:price_lower", abs(current_price), spread_config['target_price_lower'], "below", **overrides):
         price_label = "Debit" if current_price > 0 else "Credit"
         alerts.append(f"Price ${abs(current_price):.3f} {price_label} per spread reached or fell below lower target ${spread_config['target_price_lower']:.3f}")
     
-    if delta_change >= spread_config['delta_threshold']:
+    if alert_state.update_threshold(f"spread:{spread_id}:delta_change", delta_change, spread_config['delta_threshold'], "above", **overrides):
         alerts.append(f"Delta change: {delta_change:.1f} (threshold: {spread_config['delta_threshold']:.1f})")
     
     if alerts:
@@ -569,8 +2446,24 @@ def check_spread_thresholds(spread_metrics, spread_config):
         'delta': current_delta
     }
 
+# --- Notifications ---
+# One long-lived Telegram worker for the whole session; started on the first alert
+telegram_notifier = None
+telegram_notifier_lock = threading.Lock()
+
+def get_telegram_notifier():
+    global telegram_notifier
+    with telegram_notifier_lock:
+        if telegram_notifier is None:
+            telegram_notifier = TelegramNotifier(
+                TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, base_url=TELEGRAM_API_URL or None,
+                queue_size=TELEGRAM_QUEUE_SIZE, coalesce_seconds=TELEGRAM_COALESCE_SECONDS,
+                min_interval=TELEGRAM_MIN_INTERVAL, max_retries=TELEGRAM_MAX_RETRIES)
+            atexit.register(telegram_notifier.close)
+        return telegram_notifier
+
 def send_notification(title, message):
-    """Send notification to both console and Telegram if enabled."""
+    """Send notification to the console and, if enabled, queue it for Telegram (never blocks on the network)."""
     # Always print to console
     print(f"\nALERT: {title}")
     print(message)
@@ -578,26 +2471,7 @@ def send_notification(title, message):
     # Send to Telegram if enabled
     if ENABLE_TELEGRAM:
         try:
-            # Format message for Telegram (using markdown)
-            telegram_message = f"*{title}*\n\n{message}"
-            
-            # Create and run async function to send message
-            async def send_telegram():
-                try:
-                    bot = Bot(token=TELEGRAM_BOT_TOKEN)
-                    await bot.send_message(
-                        chat_id=TELEGRAM_CHAT_ID,
-                        text=telegram_message,
-                        parse_mode='Markdown'
-                    )
-                    print("Telegram notification sent successfully")
-                except TelegramError as te:
-                    print(f"Failed to send Telegram notification: {te}")
-                except Exception as e:
-                    print(f"Unexpected error sending Telegram notification: {e}")
-            
-            # Run the async function
-            asyncio.run(send_telegram())
+            get_telegram_notifier().notify(title, message)
         except Exception as e:
             print(f"Error in Telegram notification system: {e}")
             print("Continuing with console notifications only") 
\ No newline at end of file
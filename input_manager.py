@@ -31,6 +31,7 @@ class InputManager:
                     "current_price": gui.bs_current_price_var.get(),
                     "volatility": gui.bs_volatility_var.get(),
                     "risk_free_rate": gui.bs_risk_free_rate_var.get(),
+                    "max_quote_age": gui.bs_max_quote_age_var.get(),
                     "legs": getattr(gui, "bs_legs", []),
                 },
             }
@@ -59,6 +60,8 @@ class InputManager:
                 gui.update_legs_listbox()
             if hasattr(gui, "refresh_spreads_tree"):
                 gui.refresh_spreads_tree()
+            if hasattr(gui, "sync_stream_subscriptions"):
+                gui.sync_stream_subscriptions()
 
             # Restore monitoring thresholds
             monitor = data.get("monitor", {})
@@ -77,6 +80,7 @@ class InputManager:
             gui.bs_current_price_var.set(bs.get("current_price", gui.bs_current_price_var.get()))
             gui.bs_volatility_var.set(bs.get("volatility", gui.bs_volatility_var.get()))
             gui.bs_risk_free_rate_var.set(bs.get("risk_free_rate", gui.bs_risk_free_rate_var.get()))
+            gui.bs_max_quote_age_var.set(bs.get("max_quote_age", gui.bs_max_quote_age_var.get()))
             gui.bs_legs = bs.get("legs", getattr(gui, "bs_legs", []))
             if hasattr(gui, "calculate_bs_portfolio"):
                 gui.calculate_bs_portfolio()
@@ -0,0 +1,295 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from telegram import Bot
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+
+MAX_MESSAGE_LENGTH = 4096  # Telegram's limit for one message
+
+
+class TelegramNotifier:
+    """
+    Telegram alerts sent from one long-lived worker thread with its own event loop and a
+    single Bot (one HTTP connection pool), instead of a new Bot and asyncio.run() per alert.
+
+    notify() only queues the alert and returns. The worker waits coalesce_seconds after
+    the first queued alert so every alert of a monitor tick goes out as one message, keeps
+    at least min_interval seconds between messages (Telegram allows about one per second
+    per chat), honours RetryAfter from Telegram and retries network errors with exponential
+    backoff. The queue holds at most queue_size alerts; when it is full the oldest is dropped.
+    """
+
+    def __init__(self, token: str, chat_id: str, base_url: Optional[str] = None, queue_size: int = 1000,
+                 coalesce_seconds: float = 0.5, min_interval: float = 1.0, max_retries: int = 5,
+                 backoff_seconds: float = 1.0, max_backoff_seconds: float = 60.0, parse_mode: Optional[str] = "Markdown"):
+        self.token = token
+        self.chat_id = chat_id
+        self.base_url = base_url
+        self.queue_size = queue_size
+        self.coalesce_seconds = coalesce_seconds
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.parse_mode = parse_mode
+        self.stats = {"queued": 0, "dropped": 0, "messages": 0, "alerts_sent": 0, "retries": 0, "failed": 0}
+        self._closed = False
+        self._next_send = 0.0
+        self._loop = asyncio.new_event_loop()
+        self._queue: Optional[asyncio.Queue] = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="telegram-notifier", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+
+    def notify(self, title: str, message: str) -> bool:
+        """Queue one alert for Telegram. Never blocks; returns False once the notifier is closed."""
+        if self._closed:
+            return False
+        self._loop.call_soon_threadsafe(self._enqueue, (title, message))
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Send what is still queued, then stop the worker."""
+        if self._closed:
+            return
+        self._closed = True
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+        self._thread.join(timeout)
+
+    def _enqueue(self, item: Tuple[str, str]) -> None:
+        # The queue itself is unbounded so close()'s stop marker always fits; the bound is kept here
+        if self._queue.qsize() >= self.queue_size:
+            self._queue.get_nowait()
+            self.stats["dropped"] += 1
+        self._queue.put_nowait(item)
+        self.stats["queued"] += 1
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._worker())
+        finally:
+            self._loop.close()
+
+    async def _worker(self) -> None:
+        self._queue = asyncio.Queue()
+        self._ready.set()
+        bot = Bot(self.token, base_url=self.base_url) if self.base_url else Bot(self.token)
+        try:
+            await bot.initialize()
+        except TelegramError as e:
+            print(f"Telegram bot not initialized ({e}); sending anyway")
+        stopping = False
+        try:
+            while not stopping:
+                batch, stopping = await self._next_batch()
+                if batch:
+                    await self._send_batch(bot, batch)
+        finally:
+            try:
+                await bot.shutdown()
+            except Exception as e:
+                print(f"Error closing Telegram session: {e}")
+
+    async def _next_batch(self) -> Tuple[List[Tuple[str, str]], bool]:
+        """Alerts to send together: the next one plus everything queued within coalesce_seconds."""
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        await asyncio.sleep(self.coalesce_seconds)
+        batch, stopping = [first], False
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is None:
+                stopping = True
+            else:
+                batch.append(item)
+        return batch, stopping
+
+    async def _send_batch(self, bot: Bot, batch: List[Tuple[str, str]]) -> None:
+        sent = 0
+        for text, count in format_messages(batch):
+            if await self._send(bot, text):
+                sent += count
+        self.stats["alerts_sent"] += sent
+        if sent > 1:
+            print(f"Telegram notification sent ({sent} alerts)")
+        elif sent:
+            print("Telegram notification sent successfully")
+
+    async def _send(self, bot: Bot, text: str) -> bool:
+        loop = asyncio.get_running_loop()
+        parse_mode = self.parse_mode
+        for attempt in range(self.max_retries + 1):
+            wait = self._next_send - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await bot.send_message(chat_id=self.chat_id, text=text, parse_mode=parse_mode)
+                self._next_send = loop.time() + self.min_interval
+                self.stats["messages"] += 1
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                delay = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+            except BadRequest as e:
+                if parse_mode and "parse" in str(e).lower():
+                    # Alert text that is not valid Markdown (a stray _ or *): resend as plain text
+                    parse_mode = None
+                    continue
+                print(f"Failed to send Telegram notification: {e}")
+                break
+            except NetworkError as e:   # includes TimedOut
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+                print(f"Telegram send failed: {e}")
+            except TelegramError as e:
+                print(f"Failed to send Telegram notification: {e}")
+                break
+            if attempt == self.max_retries:
+                print(f"Giving up on Telegram notification after {self.max_retries} retries")
+                break
+            self.stats["retries"] += 1
+            self._next_send = loop.time() + delay
+        self.stats["failed"] += 1
+        return False
+
+
+def format_messages(batch: List[Tuple[str, str]]) -> List[Tuple[str, int]]:
+    """
+    One Telegram message per batch of (title, message) alerts, split at alert boundaries when
+    it would exceed MAX_MESSAGE_LENGTH. Returns (text, number of alerts in it) pairs.
+    """
+    messages, parts = [], []
+    length = 0
+    for title, message in batch:
+        part = f"*{title}*\n\n{message}"[:MAX_MESSAGE_LENGTH]
+        if parts and length + 2 + len(part) > MAX_MESSAGE_LENGTH:
+            messages.append(("\n\n".join(parts), len(parts)))
+            parts, length = [], 0
+        parts.append(part)
+        length += len(part) + 2
+    if parts:
+        messages.append(("\n\n".join(parts), len(parts)))
+    return messages
+
+
+# --- Fake Telegram endpoint ---
+class FakeTelegramServer:
+    """
+    Local stand-in for the Bot API (getMe, sendMessage) to test the notifier without
+    Telegram: TelegramNotifier(token, chat_id, base_url=server.base_url). Messages sent
+    closer together than min_interval get a 429 with retry_after, like Telegram;
+    latency adds a fixed delay to every request.
+    """
+
+    def __init__(self, min_interval: float = 0.0, retry_after: int = 1, latency: float = 0.0):
+        self.min_interval = min_interval
+        self.retry_after = retry_after
+        self.latency = latency
+        self.messages: List[Dict[str, Any]] = []
+        self.rejected = 0
+        self._last_message = 0.0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/bot"
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _reply(self, method: str, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}}
+        if method != "sendMessage":
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_message < self.min_interval:
+                self.rejected += 1
+                return 429, {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {self.retry_after}",
+                             "parameters": {"retry_after": self.retry_after}}
+            self._last_message = now
+            self.messages.append(params)
+            message_id = len(self.messages)
+        return 200, {"ok": True, "result": {"message_id": message_id, "date": int(time.time()), "text": params.get("text", ""),
+                                            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}}}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                if "json" in self.headers.get("Content-Type", ""):
+                    params = json.loads(body or "{}")
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body).items()}
+                if server.latency:
+                    time.sleep(server.latency)
+                status, reply = server._reply(self.path.rsplit("/", 1)[-1], params)
+                payload = json.dumps(reply).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def benchmark(ticks: int = 5, alerts_per_tick: int = 10, latency: float = 0.05) -> Dict[str, float]:
+    """Caller-side cost of 5 ticks x 10 alerts against a local fake endpoint: Bot + asyncio.run per alert vs the worker."""
+    server = FakeTelegramServer(latency=latency)
+    token, chat_id = "123:fake", "42"
+    alerts = [[(f"Spread Alert - S{i}", f"Price ${i + 0.5:.2f} reached upper target") for i in range(alerts_per_tick)]
+              for _ in range(ticks)]
+    try:
+        async def send_once(text):
+            bot = Bot(token=token, base_url=server.base_url)
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
+
+        started = time.perf_counter()
+        for tick in alerts:
+            for title, message in tick:
+                asyncio.run(send_once(f"*{title}*\n\n{message}"))
+        per_alert_ms = (time.perf_counter() - started) / (ticks * alerts_per_tick) * 1e3
+        old_messages = len(server.messages)
+
+        server.messages.clear()
+        server.min_interval = 0.2   # rate limit the fake like Telegram, scaled down
+        notifier = TelegramNotifier(token, chat_id, base_url=server.base_url, coalesce_seconds=0.05, min_interval=0.1)
+        blocked = 0.0
+        for tick in alerts:
+            started = time.perf_counter()
+            for title, message in tick:
+                notifier.notify(title, message)
+            blocked += time.perf_counter() - started
+            time.sleep(0.15)
+        notifier.close()
+        queued_us = blocked / (ticks * alerts_per_tick) * 1e6
+    finally:
+        server.close()
+    print(f"Telegram alerts, {ticks} ticks x {alerts_per_tick}: Bot + asyncio.run per alert {per_alert_ms:.1f}ms each "
+          f"({old_messages} messages); worker {queued_us:.1f}us each ({len(server.messages)} messages, "
+          f"{server.rejected} rate-limited and retried, {notifier.stats['alerts_sent']} alerts delivered)")
+    return {"per_alert_ms": per_alert_ms, "queued_us": queued_us, "messages": len(server.messages),
+            "rejected": server.rejected, **notifier.stats}
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,256 @@
+import math
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+
+CONTRACT_MULTIPLIER = 100  # same as futu_options_monitor.CONTRACT_MULTIPLIER
+RESYNC_UPDATES = 100_000   # re-add the totals from the legs after this many updates (float drift)
+
+# Additive per-leg contribution, in this order
+FIELDS = ("market_value", "bs_value", "pnl", "delta", "gamma", "vega", "theta", "rho",
+          "vanna", "volga", "charm", "speed",
+          "delta_options", "delta_stocks", "underlying_sum", "underlying_count", "initial_value")
+_ZERO = (0.0,) * len(FIELDS)
+
+
+def leg_inputs(greeks_data: Dict[str, Any], quantity: float, entry_cost: Optional[float]) -> Tuple:
+    """The fields of a leg that its contribution depends on (used to skip unchanged updates)."""
+    return (
+        greeks_data['current_option_price'], greeks_data.get('theoretical_price_bs', 0.0),
+        greeks_data['delta'], greeks_data['gamma'], greeks_data['vega'], greeks_data['theta'], greeks_data['rho'],
+        # Second-order Greeks are model values; stock legs have none
+        greeks_data.get('vanna', 0.0), greeks_data.get('volga', 0.0), greeks_data.get('charm', 0.0), greeks_data.get('speed', 0.0),
+        greeks_data.get('underlying_price', 0.0), bool(greeks_data.get('option_code')), quantity, entry_cost,
+    )
+
+
+def leg_contribution(inputs: Tuple, contract_multiplier: float = CONTRACT_MULTIPLIER) -> Tuple[float, ...]:
+    """
+    One leg's share of every portfolio total, in FIELDS order. Same formulas as
+    calculate_and_display_combined_summary: P&L and values use the contract multiplier
+    for options and 1 for stocks; the per-share Greeks are weighted by quantity only.
+    """
+    (price, bs_value, delta, gamma, vega, theta, rho, vanna, volga, charm, speed,
+     underlying, is_option, quantity, entry_cost) = inputs
+    multiplier = contract_multiplier if is_option else 1
+    pnl = 0.0
+    if entry_cost is not None:
+        if quantity > 0:
+            pnl = (price - entry_cost) * quantity * multiplier
+        else:
+            pnl = (entry_cost - price) * abs(quantity) * multiplier
+    has_underlying = underlying is not None and underlying > 0
+    return (
+        price * quantity * multiplier,
+        bs_value * quantity * multiplier,
+        pnl,
+        delta * quantity, gamma * quantity, vega * quantity, theta * quantity, rho * quantity,
+        vanna * quantity, volga * quantity, charm * quantity, speed * quantity,
+        delta * quantity * contract_multiplier if is_option else 0.0,
+        0.0 if is_option else delta * quantity,
+        underlying if has_underlying else 0.0,
+        1.0 if has_underlying else 0.0,
+        abs(quantity) * (entry_cost or 0.0) * multiplier,
+    )
+
+
+def leg_key(item: Dict[str, Any], index: int) -> Hashable:
+    """Aggregator key of a {'greeks_data', 'quantity', 'entry_cost'} leg: its leg_number (list position + 1 without one)."""
+    return item.get('leg_number', index + 1)
+
+
+class PortfolioAggregator:
+    """
+    Running portfolio totals (P&L, market and BS value, net Greeks) kept per leg.
+    update_leg() swaps one leg's old contribution for its new one, so a tick costs
+    O(changed legs) instead of a walk over the whole book; legs whose inputs did not
+    change are skipped. summary() returns the same dict as
+    calculate_and_display_combined_summary without touching the legs.
+    """
+
+    def __init__(self, contract_multiplier: float = CONTRACT_MULTIPLIER):
+        self.contract_multiplier = contract_multiplier
+        self.totals = [0.0] * len(FIELDS)
+        self.legs: Dict[Hashable, Dict[str, Any]] = {}     # key -> {"inputs", "contribution", "code", "quantity", "entry_cost"}
+        self.legs_by_code: Dict[str, set] = {}
+        self.updates = 0
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.legs)
+
+    def _apply(self, old: Tuple[float, ...], new: Tuple[float, ...]) -> None:
+        totals = self.totals
+        for i in range(len(FIELDS)):
+            totals[i] += new[i] - old[i]
+        self.updates += 1
+        # NaN/inf from one bad quote would stick in the running sums; rebuild them instead
+        if self.updates % RESYNC_UPDATES == 0 or not all(map(math.isfinite, totals)):
+            self.resync()
+
+    def update_leg(self, key: Hashable, greeks_data: Dict[str, Any], quantity: float,
+                   entry_cost: Optional[float]) -> bool:
+        """Add a leg or replace its data. Returns False if nothing it contributes changed."""
+        inputs = leg_inputs(greeks_data, quantity, entry_cost)
+        leg = self.legs.get(key)
+        if leg is not None and leg["inputs"] == inputs:
+            self.skipped += 1
+            return False
+        contribution = leg_contribution(inputs, self.contract_multiplier)
+        code = greeks_data.get('option_code') or greeks_data.get('ticker')
+        if leg is None:
+            leg = self.legs[key] = {"contribution": _ZERO, "code": None}
+        if leg["code"] != code:
+            self._unindex(key, leg["code"])
+            if code:
+                self.legs_by_code.setdefault(code, set()).add(key)
+        self._apply(leg["contribution"], contribution)
+        leg.update(inputs=inputs, contribution=contribution, code=code, quantity=quantity, entry_cost=entry_cost)
+        return True
+
+    def leg_pnl(self, key: Hashable) -> float:
+        leg = self.legs.get(key)
+        return leg["contribution"][FIELDS.index("pnl")] if leg is not None else 0.0
+
+    def remove_leg(self, key: Hashable) -> bool:
+        leg = self.legs.pop(key, None)
+        if leg is None:
+            return False
+        self._unindex(key, leg["code"])
+        self._apply(leg["contribution"], _ZERO)
+        return True
+
+    def retain(self, keys: Iterable[Hashable]) -> int:
+        """Remove every leg not in keys (positions closed since the last tick). Returns the count removed."""
+        keep = set(keys)
+        removed = [key for key in self.legs if key not in keep]
+        for key in removed:
+            self.remove_leg(key)
+        return len(removed)
+
+    def update_codes(self, codes: Iterable[str], greeks_for_code: Callable[[str], Optional[Dict[str, Any]]]) -> int:
+        """
+        Re-price only the legs on the changed option/stock codes (e.g. QuoteStream.consume_changes()),
+        keeping each leg's quantity and entry cost. Returns the number of legs updated.
+        """
+        updated = 0
+        for code in codes:
+            keys = self.legs_by_code.get(code)
+            if not keys:
+                continue
+            greeks_data = greeks_for_code(code)
+            if not greeks_data:
+                continue
+            for key in list(keys):
+                leg = self.legs[key]
+                updated += self.update_leg(key, greeks_data, leg["quantity"], leg["entry_cost"])
+        return updated
+
+    def _unindex(self, key, code):
+        keys = self.legs_by_code.get(code)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.legs_by_code[code]
+
+    def resync(self) -> None:
+        """Rebuild the totals from the stored per-leg contributions."""
+        self.totals = [math.fsum(leg["contribution"][i] for leg in self.legs.values()) for i in range(len(FIELDS))]
+
+    def clear(self) -> None:
+        self.totals = [0.0] * len(FIELDS)
+        self.legs.clear()
+        self.legs_by_code.clear()
+
+    def summary(self) -> Dict[str, float]:
+        """Portfolio totals in calculate_and_display_combined_summary's format, plus initial_value and legs."""
+        t = dict(zip(FIELDS, self.totals))
+        m = self.contract_multiplier
+        count = round(t["underlying_count"])
+        return {
+            "net_delta_per_share_equiv": t["delta"],
+            "net_gamma_per_share_equiv": t["gamma"],
+            "net_vega_per_share_equiv": t["vega"],
+            "net_theta_per_share_equiv": t["theta"],
+            "net_rho_per_share_equiv": t["rho"],
+            "net_vanna_per_share_equiv": t["vanna"],
+            "net_volga_per_share_equiv": t["volga"],
+            "net_charm_per_share_equiv": t["charm"],
+            "net_speed_per_share_equiv": t["speed"],
+            "total_net_delta": t["delta_options"] + t["delta_stocks"],
+            "total_delta_options": t["delta_options"],
+            "total_delta_stocks": t["delta_stocks"],
+            "total_net_gamma": t["gamma"] * m,
+            "portfolio_market_value": t["market_value"],
+            "portfolio_bs_value": t["bs_value"],
+            "portfolio_pnl": t["pnl"],
+            "avg_underlying": t["underlying_sum"] / count if count > 0 else 0.0,
+            "initial_value": t["initial_value"],
+            "legs": len(self.legs),
+        }
+
+
+def combined_summary(positions_data_list: Iterable[Dict[str, Any]], aggregator: Optional[PortfolioAggregator] = None,
+                     contract_multiplier: float = CONTRACT_MULTIPLIER) -> Dict[str, float]:
+    """
+    Portfolio totals of a list of {'greeks_data', 'quantity', 'entry_cost'} legs, keyed by
+    leg_key, so removing a leg does not re-add the ones after it. The math behind
+    calculate_and_display_combined_summary, without the printing. This walks the whole
+    book; callers that know which quotes moved keep the aggregator and pass those codes
+    to update_codes() instead (as the GUI and backtest.verify_against_monitor do).
+    """
+    aggregator = aggregator if aggregator is not None else PortfolioAggregator(contract_multiplier)
+    keyed = [(leg_key(item, index), item) for index, item in enumerate(positions_data_list)]
+    aggregator.retain(key for key, _ in keyed)
+    for key, item in keyed:
+        aggregator.update_leg(key, item['greeks_data'], item['quantity'], item['entry_cost'])
+    return aggregator.summary()
+
+
+def benchmark(n_legs: int = 1000, ticks: int = 2000, changed_per_tick: int = 5, seed: int = 7) -> Dict[str, float]:
+    """Summary per tick for a 1000-leg book where 5 quotes change: full recompute vs incremental."""
+    import random
+
+    rng = random.Random(seed)
+
+    def quote(code):
+        return {'option_code': code, 'current_option_price': rng.uniform(0.5, 20), 'theoretical_price_bs': rng.uniform(0.5, 20),
+                'delta': rng.uniform(-1, 1), 'gamma': rng.uniform(0, 0.1), 'vega': rng.uniform(0, 0.3),
+                'theta': rng.uniform(-0.2, 0), 'rho': rng.uniform(-0.1, 0.1), 'underlying_price': rng.uniform(90, 110)}
+
+    codes = [f"US.SYN{i:04d}" for i in range(n_legs)]
+    book = {code: quote(code) for code in codes}
+    positions = {code: (rng.choice([-5, -1, 1, 3, 10]), rng.uniform(0.5, 20)) for code in codes}
+    changes = [[rng.choice(codes) for _ in range(changed_per_tick)] for _ in range(ticks)]
+    updates = [[quote(code) for code in tick] for tick in changes]
+
+    def full_summary():
+        aggregator = PortfolioAggregator()
+        for code in codes:
+            aggregator.update_leg(code, book[code], *positions[code])
+        return aggregator.summary()
+
+    started = time.perf_counter()
+    for tick, quotes in zip(changes, updates):
+        book.update(zip(tick, quotes))
+        full = full_summary()
+    full_us = (time.perf_counter() - started) / ticks * 1e6
+
+    aggregator = PortfolioAggregator()
+    for code in codes:
+        aggregator.update_leg(code, book[code], *positions[code])
+    started = time.perf_counter()
+    for tick, quotes in zip(changes, updates):
+        book.update(zip(tick, quotes))
+        aggregator.update_codes(tick, book.get)
+        incremental = aggregator.summary()
+    incremental_us = (time.perf_counter() - started) / ticks * 1e6
+
+    drift = max(abs(incremental[key] - full[key]) for key in full)
+    print(f"Portfolio summary, {n_legs} legs / {changed_per_tick} changed per tick: full recompute {full_us:,.0f}us, "
+          f"incremental {incremental_us:,.1f}us ({full_us / incremental_us:,.0f}x), max difference {drift:.1e}")
+    return {"full_us": full_us, "incremental_us": incremental_us, "max_difference": drift}
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,187 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+
+TICK_CAPTURE_DIR = "tick_data"
+CHUNK_ROWS = 5000           # rows buffered before a chunk is handed to the writer thread
+FLUSH_SECONDS = 60.0        # ...or after this long, whichever comes first
+
+# Column layout of every chunk (one .npy file per column)
+STRING_COLUMNS = ("code", "underlying")
+FLOAT_COLUMNS = ("timestamp", "last_price", "implied_volatility", "delta", "gamma",
+                 "vega", "theta", "rho", "underlying_price")
+COLUMNS = STRING_COLUMNS + FLOAT_COLUMNS
+
+
+def day_of(timestamp: float) -> str:
+    """UTC trading-day key ("YYYY-MM-DD") of an epoch timestamp."""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d")
+
+
+class TickRecorder:
+    """
+    Append-only columnar store for captured quotes.
+
+    Layout: one directory per UTC day holding chunk directories (chunk-000001/, ...) and an
+    index.json. A chunk stores each column as an uncompressed .npy file, sorted by
+    underlying, and the index records the row range of every underlying in every chunk;
+    readers memory-map the columns and copy out only the rows of the underlyings they ask
+    for. record() only appends to an in-memory buffer; full buffers are written by a
+    background thread, so capture adds no I/O to the monitor tick.
+    """
+
+    def __init__(self, root: str = TICK_CAPTURE_DIR, chunk_rows: int = CHUNK_ROWS,
+                 flush_seconds: float = FLUSH_SECONDS):
+        self.root = root
+        self.chunk_rows = chunk_rows
+        self.flush_seconds = flush_seconds
+        self.rows_written = 0
+        self.chunks_written = 0
+        self._buffer: List[tuple] = []
+        self._buffer_started = time.time()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="tick-capture", daemon=True)
+        self._writer.start()
+
+    def record(self, code: str, underlying: Optional[str], timestamp: float, last_price: float,
+               implied_volatility: float, delta: float, gamma: float, vega: float, theta: float,
+               rho: float, underlying_price: float) -> None:
+        """Buffer one quote. Cheap: the write happens on the capture thread."""
+        row = (code, underlying or "", timestamp, last_price, implied_volatility,
+               delta, gamma, vega, theta, rho, underlying_price)
+        with self._lock:
+            if not self._buffer:
+                self._buffer_started = time.time()
+            self._buffer.append(row)
+            if len(self._buffer) >= self.chunk_rows or time.time() - self._buffer_started >= self.flush_seconds:
+                self._queue.put(self._buffer)
+                self._buffer = []
+
+    def record_greeks(self, greeks_data: Iterable[Dict[str, Any]], timestamp: Optional[float] = None) -> None:
+        """Buffer every option of a tick (build_option_greeks_data records) with one timestamp."""
+        timestamp = time.time() if timestamp is None else timestamp
+        for data in greeks_data:
+            if data:
+                self.record(data["option_code"], data.get("underlying_code"), timestamp,
+                            data["current_option_price"], data["volatility"], data["delta"],
+                            data["gamma"], data["vega"], data["theta"], data["rho"],
+                            data["underlying_price"])
+
+    def flush(self, wait: bool = True) -> None:
+        """Hand the partial buffer to the writer; with wait=True block until it is on disk."""
+        with self._lock:
+            if self._buffer:
+                self._queue.put(self._buffer)
+                self._buffer = []
+        if wait:
+            self._queue.join()
+
+    def close(self) -> None:
+        self.flush(wait=True)
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+
+    def _write_loop(self) -> None:
+        while True:
+            rows = self._queue.get()
+            try:
+                if rows is None:
+                    return
+                by_day: Dict[str, List[tuple]] = {}
+                for row in rows:
+                    by_day.setdefault(day_of(row[2]), []).append(row)
+                for day, day_rows in by_day.items():
+                    self._write_chunk(day, day_rows)
+            except Exception as e:
+                print(f"Error writing captured ticks: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write_chunk(self, day: str, rows: List[tuple]) -> None:
+        day_dir = os.path.join(self.root, day)
+        os.makedirs(day_dir, exist_ok=True)
+        index = _load_index(day_dir)
+
+        # Sort by underlying (then time) so each underlying is one contiguous row range
+        rows.sort(key=lambda row: (row[1], row[2]))
+        columns = {name: [row[i] for row in rows] for i, name in enumerate(COLUMNS)}
+        arrays = {name: np.asarray(columns[name], dtype=str) for name in STRING_COLUMNS}
+        arrays.update({name: np.asarray(columns[name], dtype=np.float64) for name in FLOAT_COLUMNS})
+
+        ranges: Dict[str, List[int]] = {}
+        for i, underlying in enumerate(columns["underlying"]):
+            ranges.setdefault(underlying, [i, i + 1])[1] = i + 1
+
+        chunk_name = f"chunk-{len(index['chunks']) + 1:06d}"
+        chunk_dir = os.path.join(day_dir, chunk_name)
+        os.makedirs(chunk_dir, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(chunk_dir, f"{name}.npy"), array)
+        index["chunks"].append({"file": chunk_name, "rows": len(rows), "underlyings": ranges,
+                                "start": float(arrays["timestamp"].min()),
+                                "end": float(arrays["timestamp"].max())})
+        # Write the index last (atomically) so readers never see a chunk that is half written
+        tmp_path = os.path.join(day_dir, "index.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(day_dir, "index.json"))
+        self.rows_written += len(rows)
+        self.chunks_written += 1
+
+
+def _load_index(day_dir: str) -> Dict[str, Any]:
+    path = os.path.join(day_dir, "index.json")
+    if not os.path.exists(path):
+        return {"chunks": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def list_days(root: str = TICK_CAPTURE_DIR) -> List[str]:
+    """Days that have captured data, oldest first."""
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.exists(os.path.join(root, name, "index.json")))
+
+
+def _read_chunk(chunk_path: str, row_ranges: List[tuple]) -> List[pd.DataFrame]:
+    """Rows of each (start, end) range of one chunk; .npy columns are memory-mapped, so only those rows are read."""
+    if chunk_path.endswith(".npz"):  # compressed chunks from earlier captures: decompressed once for every range
+        with np.load(chunk_path) as data:
+            columns = {name: data[name] for name in COLUMNS}
+    else:
+        columns = {name: np.load(os.path.join(chunk_path, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+    return [pd.DataFrame({name: np.array(columns[name][start:end]) for name in COLUMNS}) for start, end in row_ranges]
+
+
+def load_ticks(day: str, underlying: Optional[Union[str, Iterable[str]]] = None,
+               root: str = TICK_CAPTURE_DIR) -> pd.DataFrame:
+    """
+    Load one day of captured quotes, optionally only for one underlying ("US.AAPL") or a list
+    of them. Each chunk holding any of them is opened once and only their rows are read out.
+    Returns a DataFrame with COLUMNS plus a UTC "time" column, sorted by time.
+    """
+    wanted = [underlying] if isinstance(underlying, str) else None if underlying is None else list(underlying)
+    index = _load_index(os.path.join(root, day))
+    parts = []
+    for chunk in index["chunks"]:
+        if wanted is None:
+            row_ranges = [(0, chunk["rows"])]
+        else:
+            row_ranges = [tuple(chunk["underlyings"][name]) for name in wanted if name in chunk["underlyings"]]
+        if row_ranges:
+            parts.extend(_read_chunk(os.path.join(root, day, chunk["file"]), row_ranges))
+    if not parts:
+        return pd.DataFrame(columns=list(COLUMNS) + ["time"])
+    frame = pd.concat(parts, ignore_index=True)
+    frame["time"] = pd.to_datetime(frame["timestamp"], unit="s", utc=True)
+    return frame.sort_values("time", kind="stable").reset_index(drop=True)
@@ -0,0 +1,242 @@
+import bisect
+import math
+import threading
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+DAYS_PER_YEAR = 365.0
+MIN_POINTS_PER_EXPIRY = 5     # fewer usable quotes than this and the expiry is skipped
+REFIT_IV_CHANGE = 0.005       # refit when any input IV moved more than this (0.5 vol point)...
+REFIT_SPOT_CHANGE = 0.005     # ...or the spot moved more than this (0.5%)...
+REFIT_MAX_AGE = 300.0         # ...or the fit is older than this many seconds
+
+
+# --- SVI smile ---
+# Raw SVI (Gatheral): total implied variance at log-moneyness k = log(K / F)
+#   w(k) = a + b * (rho * (k - m) + sqrt((k - m)^2 + sigma^2))
+
+def svi_total_variance(params: Sequence[float], k):
+    """Total variance w(k) of raw SVI parameters (a, b, rho, m, sigma); k scalar or array."""
+    a, b, rho, m, sigma = params
+    k = np.asarray(k, dtype=np.float64)
+    return a + b * (rho * (k - m) + np.sqrt((k - m) ** 2 + sigma * sigma))
+
+
+def _fit_linear(k, w, weights, m, sigma):
+    """
+    For every candidate (m, sigma), w is linear in (a, b*rho, b): solve those weighted
+    least-squares problems together. Returns params (candidates, 5) and weighted SSE;
+    candidates violating b >= 0, |rho| < 1 or w >= 0 get an infinite error.
+    """
+    x = k[None, :] - m[:, None]
+    basis = np.stack([np.ones_like(x), x, np.sqrt(x * x + sigma[:, None] ** 2)], axis=-1)  # (cand, n, 3)
+    weighted = basis * weights[None, :, None]
+    normal = np.einsum("cni,cnj->cij", weighted, basis) + 1e-12 * np.eye(3)
+    rhs = np.einsum("cni,n->ci", weighted, w)
+    a, c, b = np.linalg.solve(normal, rhs[..., None])[..., 0].T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rho = np.where(b > 0, c / b, 0.0)
+    params = np.stack([a, b, rho, m, sigma], axis=-1)
+    residual = np.einsum("cni,ci->cn", basis, np.stack([a, c, b], axis=-1)) - w[None, :]
+    error = np.einsum("cn,n->c", residual * residual, weights)
+    # Minimum of w is a + b * sigma * sqrt(1 - rho^2)
+    valid = (b >= 0) & (np.abs(rho) < 1) & (a + b * sigma * np.sqrt(np.clip(1 - rho * rho, 0, None)) >= 0)
+    return params, np.where(valid, error, np.inf)
+
+
+def fit_svi(k, w, weights=None) -> Tuple[Tuple[float, ...], float]:
+    """
+    Fit raw SVI to total variances w at log-moneyness k. The inner parameters are solved
+    exactly for a grid of (m, sigma), which is then refined twice around the best point.
+    Returns (params, rmse of total variance).
+    """
+    k = np.asarray(k, dtype=np.float64)
+    w = np.asarray(w, dtype=np.float64)
+    weights = np.ones_like(k) if weights is None else np.asarray(weights, dtype=np.float64)
+    m_low, m_high = float(k.min()), float(k.max())
+    m_values = np.linspace(m_low - 0.1, m_high + 0.1, 25)
+    sigma_values = np.geomspace(1e-3, 1.0, 20)
+    for _ in range(3):
+        m_grid, sigma_grid = (grid.ravel() for grid in np.meshgrid(m_values, sigma_values))
+        params, error = _fit_linear(k, w, weights, m_grid, sigma_grid)
+        best = int(np.argmin(error))
+        best_m, best_sigma = m_grid[best], sigma_grid[best]
+        m_step = m_values[1] - m_values[0]
+        m_values = np.linspace(best_m - m_step, best_m + m_step, 15)
+        sigma_values = np.geomspace(max(best_sigma / 2, 1e-4), best_sigma * 2, 15)
+    rmse = math.sqrt(error[best] / weights.sum()) if np.isfinite(error[best]) else float("inf")
+    return tuple(float(value) for value in params[best]), rmse
+
+
+class VolSurface:
+    """
+    Volatility surface of one underlying: one SVI smile per listed expiry. vol(K, T) reads
+    the smile of the bracketing expiries, interpolating total variance linearly in T at the
+    same moneyness, and extrapolates flat in vol outside the fitted expiries. Lookups use
+    plain floats and math, so a single vol() costs a few microseconds.
+    """
+
+    def __init__(self, underlying: str, spot: float, r: float = 0.0):
+        self.underlying = underlying
+        self.spot = spot
+        self.r = r
+        self.fitted_at = time.time()
+        self.smiles: List[Dict[str, Any]] = []   # sorted by T: {"expiry", "T", "params", "rmse", "points"}
+        self.inputs: Dict[str, float] = {}        # option code -> IV the fit was made from
+        self._times: List[float] = []
+
+    def add_smile(self, expiry, T, params, rmse, points):
+        self.smiles.append({"expiry": expiry, "T": T, "params": tuple(params), "rmse": rmse, "points": points})
+        self.smiles.sort(key=lambda smile: smile["T"])
+        self._times = [smile["T"] for smile in self.smiles]
+
+    def age(self) -> float:
+        return time.time() - self.fitted_at
+
+    def _smile_vol(self, smile, k, T):
+        a, b, rho, m, sigma = smile["params"]
+        w = a + b * (rho * (k - m) + math.sqrt((k - m) * (k - m) + sigma * sigma))
+        return math.sqrt(max(w, 0.0) / smile["T"])
+
+    def vol(self, K: float, T: float) -> float:
+        """Implied vol for strike K and time T (years). NaN if the surface has no smiles."""
+        if not self.smiles:
+            return float("nan")
+        T = max(T, 1.0 / DAYS_PER_YEAR)
+        k = math.log(K / (self.spot * math.exp(self.r * T)))
+        i = bisect.bisect_left(self._times, T)
+        if i == 0:
+            return self._smile_vol(self.smiles[0], k, T)
+        if i == len(self.smiles):
+            return self._smile_vol(self.smiles[-1], k, T)
+        before, after = self.smiles[i - 1], self.smiles[i]
+        w_before = self._smile_vol(before, k, T) ** 2 * before["T"]
+        w_after = self._smile_vol(after, k, T) ** 2 * after["T"]
+        weight = (T - before["T"]) / (after["T"] - before["T"])
+        return math.sqrt(max(w_before + weight * (w_after - w_before), 0.0) / T)
+
+    def vols(self, K, T) -> np.ndarray:
+        """vol() for arrays of strikes and times (broadcast)."""
+        K, T = np.broadcast_arrays(np.asarray(K, dtype=np.float64), np.asarray(T, dtype=np.float64))
+        return np.array([self.vol(strike, years) for strike, years in zip(K.ravel(), T.ravel())]).reshape(K.shape)
+
+    def needs_refit(self, spot: float, quotes: Dict[str, float], iv_change: float = REFIT_IV_CHANGE,
+                    spot_change: float = REFIT_SPOT_CHANGE, max_age: float = REFIT_MAX_AGE) -> bool:
+        """Refit-on-change policy: spot or any input IV moved beyond the tolerances, or the fit is old."""
+        if self.age() > max_age or abs(spot / self.spot - 1.0) > spot_change:
+            return True
+        if set(quotes) != set(self.inputs):
+            return True
+        return any(abs(iv - self.inputs[code]) > iv_change for code, iv in quotes.items())
+
+
+def surface_inputs(chain, spot: float) -> Dict[str, float]:
+    """Option code -> IV of the chain's out-of-the-money quotes (calls at/above spot, puts below)."""
+    inputs = {}
+    for code in chain.codes:
+        row = chain.get_by_code(code)
+        iv = row.get("implied_volatility")
+        if not iv or iv <= 0 or not row.get("last_price"):
+            continue
+        if (row["option_type"] == "Call") == (row["strike_price"] >= spot):
+            inputs[code] = iv
+    return inputs
+
+
+def fit_surface(chain, spot: float, r: float = 0.0, today: Optional[date] = None,
+                inputs: Optional[Dict[str, float]] = None) -> VolSurface:
+    """Fit one SVI smile per expiry of an OptionChain (monitor.OptionChain) from its OTM quotes."""
+    today = today or date.today()
+    inputs = surface_inputs(chain, spot) if inputs is None else inputs
+    surface = VolSurface(chain.underlying, spot, r)
+    surface.inputs = dict(inputs)
+    by_expiry: Dict[Any, List[Tuple[float, float]]] = {}
+    for code, iv in inputs.items():
+        row = chain.get_by_code(code)
+        by_expiry.setdefault(row["expiry"], []).append((row["strike_price"], iv))
+    for expiry, points in by_expiry.items():
+        T = max((expiry - today).days, 1) / DAYS_PER_YEAR
+        if len(points) < MIN_POINTS_PER_EXPIRY:
+            continue
+        strikes, ivs = np.array(points).T
+        k = np.log(strikes / (spot * math.exp(r * T)))
+        params, rmse = fit_svi(k, ivs * ivs * T)
+        if math.isfinite(rmse):
+            surface.add_smile(expiry, T, params, rmse, len(points))
+    return surface
+
+
+class VolSurfaceCache:
+    """
+    Fitted surfaces per underlying. get() refits only when the surface's refit policy says
+    the chain or spot changed; otherwise it returns the cached parameters.
+    """
+
+    def __init__(self):
+        self._surfaces: Dict[str, VolSurface] = {}
+        self._lock = threading.Lock()
+        self.fits = 0
+
+    def get(self, chain, spot: float, r: float = 0.0) -> VolSurface:
+        inputs = surface_inputs(chain, spot)
+        with self._lock:
+            surface = self._surfaces.get(chain.underlying)
+        if surface is not None and not surface.needs_refit(spot, inputs):
+            return surface
+        surface = fit_surface(chain, spot, r, inputs=inputs)
+        with self._lock:
+            self._surfaces[chain.underlying] = surface
+            self.fits += 1
+        return surface
+
+    def peek(self, underlying: str) -> Optional[VolSurface]:
+        """The last fitted surface of an underlying, without any refit check."""
+        with self._lock:
+            return self._surfaces.get(underlying)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._surfaces.clear()
+
+
+def benchmark(seed: int = 5) -> Dict[str, float]:
+    """Fit a synthetic skewed chain (8 expiries x 41 strikes), then time scalar lookups."""
+    rng = np.random.default_rng(seed)
+    spot, today = 100.0, date.today()
+    true_params = (0.01, 0.08, -0.5, 0.02, 0.15)
+    rows = {}
+    for week in range(1, 9):
+        expiry = today + timedelta(days=7 * week)
+        T = 7 * week / DAYS_PER_YEAR
+        for strike in np.linspace(70, 130, 41):
+            k = math.log(strike / spot)
+            iv = math.sqrt(float(svi_total_variance(true_params, k)) * (1 + 0.3 * week) / (T * 5)) + rng.normal(0, 0.002)
+            kind = "Call" if strike >= spot else "Put"
+            code = f"SYN{week}{kind[0]}{strike:.1f}"
+            rows[code] = {"option_code": code, "expiry": expiry, "strike_price": float(strike),
+                          "option_type": kind, "implied_volatility": iv, "last_price": 1.0}
+    chain = SimpleNamespace(underlying="SYN", codes=list(rows), get_by_code=rows.get)
+
+    started = time.perf_counter()
+    surface = fit_surface(chain, spot, today=today)
+    fit_seconds = time.perf_counter() - started
+    n = 100_000
+    strikes = rng.uniform(75, 125, n).tolist()
+    times = rng.uniform(5, 60, n) / DAYS_PER_YEAR
+    started = time.perf_counter()
+    for strike, years in zip(strikes, times.tolist()):
+        surface.vol(strike, years)
+    lookup_us = (time.perf_counter() - started) / n * 1e6
+    max_rmse = max(smile["rmse"] for smile in surface.smiles)
+    print(f"SVI surface: {len(surface.smiles)} expiries x 41 strikes fitted in {fit_seconds * 1000:.0f}ms "
+          f"(max total-variance rmse {max_rmse:.1e}); vol(K, T) lookup {lookup_us:.1f}us")
+    return {"fit_seconds": fit_seconds, "lookup_us": lookup_us, "max_rmse": max_rmse}
+
+
+if __name__ == "__main__":
+    benchmark()